@@ -1,4 +1,5 @@
 import pandas as pd
+import pyarrow as pa
 from nettle.errors.custom_errors import DataframeInvalidException
 
 class DataframeValidator:
@@ -11,11 +12,28 @@ class DataframeValidator:
         data_dict_properties = [v["column name"] for v in data_dict.values()]
         return [x for x in df_properties if x not in data_dict_properties]
 
+    @staticmethod
+    def is_string_dtype(dtype) -> bool:
+        """
+        Strings can be python objects, pandas string dtypes (python or pyarrow backed), arrow string or
+        dictionary-encoded string columns, or categoricals of strings
+        """
+        if dtype == 'object' or isinstance(dtype, pd.StringDtype):
+            return True
+        if isinstance(dtype, pd.ArrowDtype):
+            arrow_type = dtype.pyarrow_dtype
+            if pa.types.is_dictionary(arrow_type):
+                arrow_type = arrow_type.value_type
+            return pa.types.is_string(arrow_type) or pa.types.is_large_string(arrow_type)
+        if isinstance(dtype, pd.CategoricalDtype):
+            return DataframeValidator.is_string_dtype(dtype.categories.dtype)
+        return False
+
     @staticmethod
     def not_strings_df_columns(
             dataframe: pd.DataFrame
     ):
-        return dataframe.dtypes[dataframe.dtypes != 'object']
+        return dataframe.dtypes[[not DataframeValidator.is_string_dtype(dtype) for dtype in dataframe.dtypes]]
 
     @staticmethod
     def validate(
@@ -0,0 +1,82 @@
+import io
+import os
+import shutil
+import threading
+import dag_cbor
+from multiformats import CID, varint
+
+
+class CARWriter:
+    """
+    Write blocks to a CAR (content addressable archive, version 1) file, the format read by `ipfs dag import`.
+
+    A CAR starts with a header naming its root CIDs, which are usually only known once every block is built, so the
+    blocks are appended to a side file as they are added and copied after the header on `close`. Blocks can be added
+    from several threads and a CID added twice is only written once.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.blocks_path = f"{path}.blocks"
+        self.roots = []
+        self.size = 0
+        self._cids = set()
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), 0o755, True)
+        self._blocks_file = open(self.blocks_path, "wb")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self._blocks_file.close()
+            os.remove(self.blocks_path)
+
+    def __len__(self):
+        return len(self._cids)
+
+    def add(self, cid: str, data: bytes) -> None:
+        cid_bytes = bytes(CID.decode(cid))
+        with self._lock:
+            if cid in self._cids:
+                return
+            self._cids.add(cid)
+            self._blocks_file.write(varint.encode(len(cid_bytes) + len(data)) + cid_bytes + data)
+            self.size += len(data)
+
+    def close(self) -> None:
+        """
+        Write the header with `roots` followed by the blocks to `path`
+        """
+        self._blocks_file.close()
+        header = dag_cbor.encode({"roots": [CID.decode(root) for root in self.roots], "version": 1})
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "wb") as f, open(self.blocks_path, "rb") as blocks:
+            f.write(varint.encode(len(header)) + header)
+            shutil.copyfileobj(blocks, f)
+        os.replace(tmp_path, self.path)
+        os.remove(self.blocks_path)
+
+
+def read_car(data: bytes) -> tuple[list[CID], list[tuple[CID, bytes]]]:
+    """
+    The roots and the (cid, data) blocks of a CAR version 1 archive
+    """
+    stream = io.BytesIO(data)
+    header = dag_cbor.decode(stream.read(varint.decode(stream)))
+    if header.get("version") != 1:
+        raise ValueError(f"unsupported CAR version {header.get('version')}")
+    blocks = []
+    while stream.tell() < len(data):
+        section = stream.read(varint.decode(stream))
+        # a CIDv1 is its version, codec and hash function varints followed by the digest size and digest
+        section_stream = io.BytesIO(section)
+        for _ in range(3):
+            varint.decode(section_stream)
+        digest_size = varint.decode(section_stream)
+        cid_length = section_stream.tell() + digest_size
+        blocks.append((CID.decode(section[:cid_length]), section[cid_length:]))
+    return header["roots"], blocks
@@ -0,0 +1,71 @@
+import threading
+from collections import OrderedDict
+from .disk_cache import DiskCache
+
+
+class CIDCache:
+    """
+    A cache of IPFS content keyed by CID.
+
+    Content addressed by a CID never changes, so entries are never invalidated, only evicted. Recently used entries
+    are kept in memory (least recently used ones are dropped past `max_memory_bytes`) in front of an optional,
+    size bounded DiskCache that persists between runs.
+    """
+
+    def __init__(self, disk_cache: DiskCache = None, max_memory_bytes: int = 64 * 1024 ** 2):
+        self.disk_cache = disk_cache
+        self.max_memory_bytes = max_memory_bytes
+        self._memory = OrderedDict()
+        self._memory_size = 0
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        # locks can't be pickled, e.g. to send a store to the transform worker processes, and the memory copies
+        # are left behind rather than sent to every worker
+        state = self.__dict__.copy()
+        del state["_lock"]
+        state["_memory"] = OrderedDict()
+        state["_memory_size"] = 0
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def is_immutable(cid) -> bool:
+        """
+        IPNS names and paths resolve to different content over time, only plain CIDs can be cached
+        """
+        return not str(cid).startswith("/ipns/")
+
+    def get(self, key: str) -> bytes | None:
+        with self._lock:
+            content = self._memory.get(key)
+            if content is not None:
+                self._memory.move_to_end(key)
+                return content
+        if self.disk_cache is None:
+            return None
+        content = self.disk_cache.get(key)
+        if content is not None:
+            self._remember(key, content)
+        return content
+
+    def put(self, key: str, content: bytes) -> None:
+        self._remember(key, content)
+        if self.disk_cache is not None:
+            self.disk_cache.put(key, content)
+
+    def _remember(self, key: str, content: bytes) -> None:
+        if len(content) > self.max_memory_bytes:
+            return
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                return
+            self._memory[key] = content
+            self._memory_size += len(content)
+            while self._memory_size > self.max_memory_bytes:
+                _, evicted = self._memory.popitem(last=False)
+                self._memory_size -= len(evicted)
@@ -0,0 +1,133 @@
+import os
+import json
+import hashlib
+import threading
+
+
+class DiskCache:
+    """
+    A size bounded key/value cache of bytes on local disk.
+
+    Each entry is a body file plus a small json file of metadata (validators, etags...). Reading an entry refreshes
+    its modification time, and when the cache grows past `max_bytes` the least recently used entries are evicted.
+    """
+    META_SUFFIX = ".meta.json"
+
+    def __init__(self, root: str, max_bytes: int = 1024 ** 3):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(self.root, 0o755, True)
+        self._size = sum(size for _, _, size in self._entries())
+
+    def __getstate__(self):
+        # locks can't be pickled, e.g. to send a store to the transform worker processes
+        state = self.__dict__.copy()
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def _path(self, key: str) -> str:
+        digest = hashlib.sha256(key.encode("utf-8")).hexdigest()
+        return os.path.join(self.root, digest[:2], digest)
+
+    def _entries(self):
+        """
+        Yield (body path, last access time, size) for every entry in the cache
+        """
+        for folder in os.scandir(self.root):
+            if not folder.is_dir():
+                continue
+            for entry in os.scandir(folder.path):
+                if entry.name.endswith(self.META_SUFFIX) or entry.name.endswith(".tmp"):
+                    continue
+                stat = entry.stat()
+                yield entry.path, stat.st_mtime, stat.st_size
+
+    def meta(self, key: str) -> dict | None:
+        try:
+            with open(self._path(key) + self.META_SUFFIX, encoding="utf-8") as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def get(self, key: str) -> bytes | None:
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None
+        self.touch(key)
+        return data
+
+    def touch(self, key: str) -> None:
+        try:
+            os.utime(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def set_meta(self, key: str, meta: dict) -> None:
+        """
+        Replace the metadata of an existing entry without rewriting its body
+        """
+        path = self._path(key)
+        with self._lock:
+            if not os.path.exists(path):
+                return
+            tmp_path = f"{path}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(meta, f)
+            os.replace(tmp_path, path + self.META_SUFFIX)
+
+    def put(self, key: str, data: bytes, meta: dict = None) -> None:
+        if self.max_bytes is not None and len(data) > self.max_bytes:
+            return
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), 0o755, True)
+        with self._lock:
+            self._size -= self._file_size(path)
+            # write to a temporary file first so readers never see half an entry
+            tmp_path = f"{path}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+            with open(path + self.META_SUFFIX, "w", encoding="utf-8") as f:
+                json.dump(meta if meta else {}, f)
+            self._size += len(data)
+            self._evict()
+
+    def delete(self, key: str) -> None:
+        path = self._path(key)
+        with self._lock:
+            self._size -= self._file_size(path)
+            self._remove(path)
+
+    def size(self) -> int:
+        return self._size
+
+    def _evict(self) -> None:
+        if self.max_bytes is None or self._size <= self.max_bytes:
+            return
+        for path, _, size in sorted(self._entries(), key=lambda entry: entry[1]):
+            self._remove(path)
+            self._size -= size
+            if self._size <= self.max_bytes:
+                break
+
+    @staticmethod
+    def _file_size(path: str) -> int:
+        try:
+            return os.path.getsize(path)
+        except FileNotFoundError:
+            return 0
+
+    def _remove(self, path: str) -> None:
+        for file_path in [path, path + self.META_SUFFIX]:
+            try:
+                os.remove(file_path)
+            except FileNotFoundError:
+                pass
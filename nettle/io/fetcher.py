@@ -0,0 +1,141 @@
+import threading
+import requests
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+from requests.adapters import HTTPAdapter, Retry
+from .disk_cache import DiskCache
+
+
+class HTTPFetcher:
+    """
+    Fetches source files for extract with a shared, pooled session.
+
+    Connections are kept alive and reused between requests, failed requests are retried with backoff and
+    `fetch_many` downloads a whole batch of urls concurrently, never running more than `max_per_host` requests
+    against the same host at a time.
+
+    With a `cache`, bodies are kept on disk along with their ETag/Last-Modified validators. Later fetches send a
+    conditional request and a 304 Not Modified answer is served from the local copy.
+    """
+    RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+    def __init__(
+            self,
+            log=None,
+            max_workers: int = 16,
+            max_per_host: int = 4,
+            retries: int = 5,
+            backoff_factor: float = 1,
+            timeout: int = 60,
+            headers: dict = None,
+            cache: DiskCache = None
+    ):
+        self.log = log
+        self.max_workers = max_workers
+        self.max_per_host = max_per_host
+        self.retries = retries
+        self.backoff_factor = backoff_factor
+        self.timeout = timeout
+        self.headers = headers if headers else {}
+        self.cache = cache
+        self._host_semaphores = {}
+        self._host_semaphores_lock = threading.Lock()
+
+    def session(self, refresh: bool = False) -> requests.Session:
+        if refresh or not hasattr(self, "_session"):
+            session = requests.Session()
+            retries = Retry(
+                total=self.retries,
+                backoff_factor=self.backoff_factor,
+                status_forcelist=self.RETRY_STATUSES,
+                allowed_methods=["GET", "HEAD"],
+                raise_on_status=False
+            )
+            adapter = HTTPAdapter(pool_connections=self.max_workers, pool_maxsize=self.max_workers,
+                                  max_retries=retries)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            session.headers.update(self.headers)
+            self._session = session
+        return self._session
+
+    def host_semaphore(self, url: str) -> threading.BoundedSemaphore:
+        host = urlsplit(url).netloc
+        with self._host_semaphores_lock:
+            if host not in self._host_semaphores:
+                self._host_semaphores[host] = threading.BoundedSemaphore(self.max_per_host)
+            return self._host_semaphores[host]
+
+    def get(self, url: str, headers: dict = None) -> requests.Response:
+        """
+        GET a url through the pooled session, limited by the per host concurrency
+        """
+        with self.host_semaphore(url):
+            return self.session().get(url, headers=headers, timeout=self.timeout)
+
+    def fetch(self, url: str, headers: dict = None) -> bytes | None:
+        """
+        Return the body of url, or None if it could not be retrieved
+        """
+        if self.cache is not None:
+            return self.fetch_conditional(url, headers)
+        try:
+            res = self.get(url, headers)
+            res.raise_for_status()
+            return res.content
+        except requests.HTTPError as e:
+            self._log_info(f"[fetcher.fetch] {e.response.status_code} for {url}")
+        except requests.RequestException as e:
+            self._log_warn(f"[fetcher.fetch] could not fetch {url}: {e}")
+        return None
+
+    def fetch_conditional(self, url: str, headers: dict = None) -> bytes | None:
+        """
+        Fetch url sending the validators of the cached copy, if any, and serve the cached body on 304
+        """
+        cached_meta = self.cache.meta(url)
+        request_headers = dict(headers) if headers else {}
+        if cached_meta is not None:
+            if cached_meta.get("etag"):
+                request_headers["If-None-Match"] = cached_meta["etag"]
+            if cached_meta.get("last_modified"):
+                request_headers["If-Modified-Since"] = cached_meta["last_modified"]
+        try:
+            res = self.get(url, request_headers)
+            if res.status_code == 304:
+                body = self.cache.get(url)
+                if body is not None:
+                    return body
+                # the body was evicted between reading its metadata and now, ask again unconditionally
+                self.cache.delete(url)
+                res = self.get(url, headers)
+            res.raise_for_status()
+        except requests.HTTPError as e:
+            self._log_info(f"[fetcher.fetch] {e.response.status_code} for {url}")
+            return None
+        except requests.RequestException as e:
+            self._log_warn(f"[fetcher.fetch] could not fetch {url}: {e}")
+            return None
+
+        etag = res.headers.get("ETag")
+        last_modified = res.headers.get("Last-Modified")
+        if etag or last_modified:
+            self.cache.put(url, res.content, {"etag": etag, "last_modified": last_modified})
+        return res.content
+
+    def fetch_many(self, urls: list[str], headers: dict = None) -> list[bytes | None]:
+        """
+        Fetch all urls concurrently. Bodies are returned in the same order as urls, None for the ones that failed
+        """
+        if not urls:
+            return []
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(urls))) as executor:
+            return list(executor.map(lambda url: self.fetch(url, headers), urls))
+
+    def _log_info(self, message):
+        if self.log is not None:
+            self.log.info(message)
+
+    def _log_warn(self, message):
+        if self.log is not None:
+            self.log.warn(message)
@@ -7,6 +7,8 @@ class FileHandler:
     # paths relative to the script directory
     RAW_DATA_ROOT = settings.RAW_DATA_ROOT
     PROCESSED_DATA_ROOT = settings.PROCESSED_DATA_ROOT
+    APPEND_DATA_ROOT = settings.APPEND_DATA_ROOT
+    METRICS_OUTPUT_ROOT = settings.METRICS_OUTPUT_ROOT
 
     def __init__(self, relative_path):
         '''
@@ -16,6 +18,9 @@ class FileHandler:
         self.relative_path = relative_path
         self.RAW_DATA_PATH = self.get_data_path(self.RAW_DATA_ROOT)
         self.PROCESSED_DATA_PATH = self.get_data_path(self.PROCESSED_DATA_ROOT)
+        # rows waiting to be appended to remote station files, only created when needed
+        self.APPEND_DATA_PATH = os.path.join(self.APPEND_DATA_ROOT, self.relative_path)
+        self.METRICS_OUTPUT_PATH = os.path.join(self.METRICS_OUTPUT_ROOT, self.relative_path)
 
     def create_directory_if_necessary(self, path):
         if not os.path.exists(path):
@@ -0,0 +1,175 @@
+import os
+import json
+import fcntl
+import threading
+from contextlib import contextmanager
+
+
+class HashIndex:
+    """
+    An append-only journal of the IPFS hashes published from this host.
+
+    It holds two tables, the same as the legacy heads.json and history.json files: `heads` (dataset key -> latest
+    hash) and `history` (dated key -> hash). Each update appends one json line to the journal, so recording a hash
+    costs the same however long the history is. The journal is replayed into memory once and later only the lines
+    appended since are read.
+
+    Appends and compaction hold an exclusive lock on a side lock file and reads a shared one, so several ETLs on the
+    same host can publish at the same time without losing updates. `compact` rewrites the journal with one line per
+    key, which happens automatically once it holds `compact_ratio` times more lines than keys.
+    """
+    TABLES = ("heads", "history")
+
+    def __init__(
+            self,
+            path: str,
+            legacy_heads_path: str = None,
+            legacy_history_path: str = None,
+            compact_ratio: int = 4
+    ):
+        self.path = path
+        self.lock_path = f"{path}.lock"
+        self.legacy_heads_path = legacy_heads_path
+        self.legacy_history_path = legacy_history_path
+        self.compact_ratio = compact_ratio
+        self.tables = {table: {} for table in self.TABLES}
+        self._lines = 0
+        self._offset = 0
+        self._inode = None
+        self._thread_lock = threading.Lock()
+
+    @contextmanager
+    def _locked(self, exclusive: bool):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), 0o755, True)
+        with self._thread_lock, open(self.lock_path, "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _refresh(self) -> None:
+        """
+        Apply the lines appended to the journal since the last read, or replay it all if it was compacted
+        """
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return
+        if stat.st_ino != self._inode or stat.st_size < self._offset:
+            self.tables = {table: {} for table in self.TABLES}
+            self._lines = 0
+            self._offset = 0
+            self._inode = stat.st_ino
+        if stat.st_size == self._offset:
+            return
+        with open(self.path, "rb") as f:
+            f.seek(self._offset)
+            for line in f:
+                # a line is only complete once its newline is written
+                if not line.endswith(b"\n"):
+                    break
+                self._apply(json.loads(line))
+                self._offset += len(line)
+
+    def _apply(self, record: dict) -> None:
+        for table in self.TABLES:
+            self.tables[table].update(record.get(table, {}))
+        self._lines += 1
+
+    def _append(self, records: list[dict]) -> None:
+        with open(self.path, "ab") as f:
+            f.write(b"".join(json.dumps(record, sort_keys=True).encode("utf-8") + b"\n" for record in records))
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _import_legacy(self) -> None:
+        """
+        Start a new journal from the legacy heads.json and history.json files, if they exist
+        """
+        if os.path.exists(self.path):
+            return
+        record = {}
+        for table, path in zip(self.TABLES, (self.legacy_heads_path, self.legacy_history_path)):
+            if path is None:
+                continue
+            try:
+                with open(path, encoding="utf-8") as f:
+                    record[table] = json.load(f)
+            except FileNotFoundError:
+                continue
+        if record:
+            self._append([record])
+
+    def record(self, heads: dict = None, history: dict = None) -> None:
+        """
+        Append new heads and history entries to the journal as a single line
+        """
+        record = {table: entries for table, entries in zip(self.TABLES, (heads, history)) if entries}
+        if not record:
+            return
+        with self._locked(exclusive=True):
+            self._import_legacy()
+            self._refresh()
+            self._append([record])
+            self._refresh()
+            if self._lines > self.compact_ratio * max(1, sum(len(entries) for entries in self.tables.values())):
+                self._compact()
+
+    def _read(self, table: str) -> dict:
+        with self._locked(exclusive=not os.path.exists(self.path)):
+            self._import_legacy()
+            self._refresh()
+            return dict(self.tables[table])
+
+    def heads(self) -> dict:
+        return self._read("heads")
+
+    def history(self, prefix: str = "") -> dict:
+        """
+        The history entries, only those whose key starts with `prefix` if given
+        """
+        return {key: value for key, value in self._read("history").items() if key.startswith(prefix)}
+
+    def head(self, key: str) -> str:
+        """
+        The latest hash recorded for key, raises KeyError if there is none
+        """
+        return self.heads()[key]
+
+    def _compact(self) -> None:
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "wb") as f:
+            for table in self.TABLES:
+                for key, value in self.tables[table].items():
+                    f.write(json.dumps({table: {key: value}}, sort_keys=True).encode("utf-8") + b"\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+        # replay the compacted journal on the next read
+        self._inode = None
+        self._refresh()
+
+    def compact(self) -> None:
+        """
+        Rewrite the journal with a single line per key
+        """
+        with self._locked(exclusive=True):
+            self._import_legacy()
+            self._refresh()
+            self._compact()
+
+    def export_legacy(self, heads_path: str = None, history_path: str = None) -> None:
+        """
+        Write the tables in the legacy heads.json and history.json layout
+        """
+        heads_path = heads_path if heads_path else self.legacy_heads_path
+        history_path = history_path if history_path else self.legacy_history_path
+        with self._locked(exclusive=False):
+            self._refresh()
+            tables = {table: dict(entries) for table, entries in self.tables.items()}
+        for table, path in zip(self.TABLES, (heads_path, history_path)):
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(tables[table], f, sort_keys=True, ensure_ascii=False, indent=4)
+            os.replace(tmp_path, path)
@@ -1,15 +1,35 @@
 import dag_cbor
+from dag_cbor.encoding.err import CBORError
 import requests
 import io
+import base64
+import os
 import json
-from multiformats import multicodec, multihash
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote
+from multiformats import CID, multicodec, multihash
 from requests.adapters import HTTPAdapter, Retry
+from .cid_cache import CIDCache
+from .known_cids import KnownCIDs
 
 
 class IPFSIO:
     """
     Methods to be inherited by a DatasetManager that needs to instantiate and interact with an IPFS client
     """
+    # size of the blocks files are read and streamed to the node in
+    ADD_BLOCK_SIZE = 256 * 1024
+    # largest block put on the node in one piece, nodes don't exchange blocks much larger than this
+    MAX_BLOCK_SIZE = 1024 * 1024
+    # requests run at once by the *_many methods, and kept-alive connections to the node
+    DEFAULT_MAX_WORKERS = 16
+    # roots pinned per pin/add request by pin_many, and how often (and after how many seconds, doubled each time)
+    # a failed request is tried again
+    PIN_BATCH_SIZE = 64
+    PIN_ATTEMPTS = 3
+    PIN_RETRY_DELAY = 2
 
     def __init__(
         self,
@@ -20,13 +40,21 @@ class IPFSIO:
         | multihash.Multihash = "sha2-256",
         default_base: str = "base32",
         default_timeout: int = 600,
+        max_workers: int = DEFAULT_MAX_WORKERS,
+        cache: CIDCache = None,
+        known_cids: KnownCIDs = None,
     ):
         self._host = host
         self._default_base = default_base
         self._default_timeout = default_timeout
         self._default_hash = default_hash
+        self.max_workers = max_workers
+        # responses of block/get, cat and ls by CID, see post_cid
+        self.cache = cache
+        # with a set of known CIDs, content already pinned on the node is not sent again, see ipfs_put
+        self.known_cids = known_cids
 
-        self.ipfs_session = IPFSIO.get_retry_session()
+        self.ipfs_session = IPFSIO.get_retry_session(pool_maxsize=max_workers)
 
     # FUNDAMENTAL METHODS
 
@@ -37,32 +65,46 @@ class IPFSIO:
         :param cid:
         :return:
         """
-        res = self.ipfs_session.post(
-            self._host + "/api/v0/ls",
-            timeout=self._default_timeout,
-            params={"arg": str(cid)},
-        )
-        res.raise_for_status()
-        return json.loads(res.content)['Objects'][0]['Links']
+        return json.loads(self.post_cid("/api/v0/ls", cid))['Objects'][0]['Links']
 
-    def ipfs_add(self, file):
+    def ipfs_add(self, file, should_pin: bool = True):
         res = self.ipfs_session.post(
             self._host + "/api/v0/add",
             params={
-                "hash": self._default_hash
+                "hash": self._default_hash,
+                "pin": should_pin
             },
             files={"dummy": file},
         )
         res.raise_for_status()
+        return res.json()["Hash"]
 
     def ipfs_cat(self, cid):
+        return json.loads(self.ipfs_cat_bytes(cid))
+
+    def ipfs_cat_bytes(self, cid) -> bytes:
+        return self.post_cid("/api/v0/cat", cid)
+
+    def post_cid(self, endpoint: str, cid) -> bytes:
+        """
+        Return the response body of an API call on a CID. The content of a CID never changes, so with a cache the
+        node is only asked once for each endpoint and CID
+        """
+        key = f"{endpoint}/{cid}"
+        cacheable = self.cache is not None and CIDCache.is_immutable(cid)
+        if cacheable:
+            content = self.cache.get(key)
+            if content is not None:
+                return content
         res = self.ipfs_session.post(
-            self._host + "/api/v0/cat",
+            self._host + endpoint,
             timeout=self._default_timeout,
             params={"arg": str(cid)},
         )
         res.raise_for_status()
-        return json.loads(res.content)
+        if cacheable:
+            self.cache.put(key, res.content)
+        return res.content
 
     def ipfs_add_multiple_files_wrapping_with_directory(self, files_array):
         """
@@ -85,14 +127,95 @@ class IPFSIO:
             files=files_dict,
         )
         res.raise_for_status()
-        resp = res.text.replace('\n', ',')
-        resp_files_list = json.loads(f"[{resp.rsplit(',', 1)[0]}]")
-        directory_dict = next(
-            (x for x in resp_files_list if x['Name'] == ''), None)
-        if directory_dict is None:
-            raise Exception('Could not create directory')
+        return self.directory_hash_from_add_response(res.iter_lines())
 
-        return directory_dict['Hash']
+    def ipfs_add_directory(self, paths: list[str], on_added=None, should_pin: bool = True) -> str:
+        """
+        Add local files to IPFS wrapped in a single directory and return the directory hash.
+
+        The multipart body is streamed from a generator that opens one file at a time and reads it in binary blocks,
+        so memory use and open file descriptors stay bounded whatever the number and size of the files.
+        The node's NDJSON response is parsed line by line as it reports each added file, `on_added` is called with
+        each entry (Name, Hash, Size)
+        """
+        boundary = uuid.uuid4().hex
+        res = self.ipfs_session.post(
+            self._host + "/api/v0/add",
+            timeout=self._default_timeout,
+            params={
+                "hash": self._default_hash,
+                "wrap-with-directory": True,
+                "pin": should_pin
+            },
+            headers={"Content-Type": f"multipart/form-data; boundary={boundary}"},
+            data=self.multipart_files_stream(paths, boundary, self.ADD_BLOCK_SIZE),
+            stream=True,
+        )
+        with res:
+            res.raise_for_status()
+            return self.directory_hash_from_add_response(res.iter_lines(), on_added)
+
+    def dag_import(self, car_path: str, pin_roots: bool = True) -> list[str]:
+        """
+        Import every block of a CAR file in a single request and return its roots, pinned recursively by default.
+        The file is streamed to the node the same way as `ipfs_add_directory`
+        """
+        boundary = uuid.uuid4().hex
+        res = self.ipfs_session.post(
+            self._host + "/api/v0/dag/import",
+            timeout=self._default_timeout,
+            params={"pin-roots": pin_roots},
+            headers={"Content-Type": f"multipart/form-data; boundary={boundary}"},
+            data=self.multipart_files_stream([car_path], boundary, self.ADD_BLOCK_SIZE),
+            stream=True,
+        )
+        roots = []
+        with res:
+            res.raise_for_status()
+            for line in res.iter_lines():
+                root = json.loads(line).get("Root") if line else None
+                if root is None:
+                    continue
+                if root.get("PinErrorMsg"):
+                    raise Exception(f"could not pin {root['Cid']['/']}: {root['PinErrorMsg']}")
+                roots.append(root["Cid"]["/"])
+        if pin_roots and self.known_cids is not None:
+            for root in roots:
+                self.known_cids.add(root)
+        return roots
+
+    @staticmethod
+    def multipart_files_stream(paths: list[str], boundary: str, block_size: int):
+        """
+        Yield a multipart/form-data body holding the files at paths, named by their base name
+        """
+        for path in paths:
+            yield (f'--{boundary}\r\n'
+                   f'Content-Disposition: form-data; name="file"; filename="{quote(os.path.basename(path))}"\r\n'
+                   f'Content-Type: application/octet-stream\r\n\r\n').encode("utf-8")
+            with open(path, "rb") as f:
+                for block in iter(lambda: f.read(block_size), b""):
+                    yield block
+            yield b"\r\n"
+        yield f"--{boundary}--\r\n".encode("utf-8")
+
+    @staticmethod
+    def directory_hash_from_add_response(lines, on_added=None) -> str:
+        """
+        Return the hash of the wrapping directory (the entry with an empty name) from the NDJSON lines of an add
+        """
+        directory_hash = None
+        for line in lines:
+            if not line:
+                continue
+            entry = json.loads(line)
+            if on_added is not None:
+                on_added(entry)
+            if entry.get('Name') == '':
+                directory_hash = entry['Hash']
+        if directory_hash is None:
+            raise Exception('Could not create directory')
+        return directory_hash
 
     def ipfs_get(self, cid: str) -> dict:
         """
@@ -108,13 +231,13 @@ class IPFSIO:
         dict
             The referenced DAG CBOR object decoded as a JSON
         """
-        res = self.ipfs_session.post(
-            self._host + "/api/v0/block/get",
-            timeout=self._default_timeout,
-            params={"arg": str(cid)},
-        )
-        res.raise_for_status()
-        return dag_cbor.decode(res.content)
+        return dag_cbor.decode(self.post_cid("/api/v0/block/get", cid))
+
+    def ipfs_block_get(self, cid: str) -> bytes:
+        """
+        Fetch the raw bytes of a single block, e.g. one put with `ipfs_block_put`
+        """
+        return self.post_cid("/api/v0/block/get", cid)
 
     def ipns_retrieve_object(self, key: str) -> tuple[dict, str, str] | None:
         """
@@ -194,6 +317,13 @@ class IPFSIO:
         str
             The IPFS hash (base32 encoded) corresponding to the newly created DAG object
         """
+        if hasattr(bytes_obj, "read"):
+            bytes_obj = bytes_obj.read()
+        if self.known_cids is not None:
+            # the node already has this exact object, skip the upload but return the same CID
+            cid = self.dag_cbor_cid(bytes_obj)
+            if cid is not None and cid in self.known_cids:
+                return cid
         res = self.ipfs_session.post(
             self._host + "/api/v0/dag/put",
             params={
@@ -205,7 +335,136 @@ class IPFSIO:
             files={"dummy": bytes_obj},
         )
         res.raise_for_status()
-        return res.json()["Cid"]["/"]  # returns hash of DAG object created
+        cid = res.json()["Cid"]["/"]  # returns hash of DAG object created
+        if should_pin and self.known_cids is not None:
+            self.known_cids.add(cid)
+        return cid
+
+    def ipfs_block_put(self, bytes_obj: bytes, should_pin: bool = True) -> str:
+        """
+        Put bytes on IPFS as a single raw block and return its CID. Blocks already known to be pinned are not sent
+        """
+        cid = self.cid(bytes_obj, "raw")
+        if self.known_cids is not None and cid in self.known_cids:
+            return cid
+        res = self.ipfs_session.post(
+            self._host + "/api/v0/block/put",
+            params={
+                "cid-codec": "raw",
+                "mhtype": self._default_hash,
+                "pin": should_pin,
+            },
+            files={"dummy": bytes_obj},
+        )
+        res.raise_for_status()
+        cid = res.json()["Key"]
+        if should_pin and self.known_cids is not None:
+            self.known_cids.add(cid)
+        return cid
+
+    # LOCAL CID COMPUTATION
+
+    def cid(self, data: bytes, codec: str) -> str:
+        """
+        The CIDv1 of a block of data encoded with `codec` (e.g. "raw" or "dag-cbor"), computed locally
+        """
+        return str(CID(self._default_base, 1, codec, multihash.digest(data, self._default_hash)))
+
+    def cid_string(self, cid) -> str:
+        """
+        A CID in the default base, e.g. for links decoded from dag-cbor which otherwise print as base58btc
+        """
+        return cid.encode(self._default_base) if isinstance(cid, CID) else str(cid)
+
+    def dag_cbor_cid(self, json_bytes: bytes) -> str | None:
+        """
+        The CID `ipfs_put` gets for dag-json input stored as dag-cbor, computed locally.
+        None if the content can't be encoded locally, it is then left to the node
+        """
+        try:
+            obj = self.dag_json_to_ipld(json.loads(json_bytes))
+            return self.cid(dag_cbor.encode(obj), "dag-cbor")
+        except (ValueError, CBORError):
+            return None
+
+    @classmethod
+    def dag_json_to_ipld(cls, obj):
+        """
+        Decode the dag-json forms of links ({"/": "<cid>"}) and bytes ({"/": {"bytes": "<base64>"}}) in parsed json
+        """
+        if isinstance(obj, list):
+            return [cls.dag_json_to_ipld(value) for value in obj]
+        if not isinstance(obj, dict):
+            return obj
+        if list(obj) == ["/"]:
+            if isinstance(obj["/"], str):
+                return CID.decode(obj["/"])
+            if isinstance(obj["/"], dict) and list(obj["/"]) == ["bytes"]:
+                return base64.b64decode(obj["/"]["bytes"] + "=" * (-len(obj["/"]["bytes"]) % 4))
+        return {key: cls.dag_json_to_ipld(value) for key, value in obj.items()}
+
+    # BATCH METHODS
+
+    def map_concurrently(self, function, items: list) -> list:
+        """
+        Call function on every item with at most `max_workers` requests to the node at once.
+        Results are returned in the same order as items
+        """
+        if not items:
+            return []
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(items))) as executor:
+            return list(executor.map(function, items))
+
+    def put_many(self, bytes_objs: list[bytes], should_pin: bool = True) -> list[str]:
+        """
+        `ipfs_put` several objects concurrently, returning their hashes in the same order
+        """
+        return self.map_concurrently(lambda bytes_obj: self.ipfs_put(bytes_obj, should_pin), bytes_objs)
+
+    def get_many(self, cids: list[str]) -> list[dict]:
+        """
+        `ipfs_get` several DAG CBOR objects concurrently, in the same order as cids
+        """
+        return self.map_concurrently(self.ipfs_get, cids)
+
+    def cat_many(self, cids: list[str]) -> list:
+        """
+        `ipfs_cat` several files concurrently, in the same order as cids
+        """
+        return self.map_concurrently(self.ipfs_cat, cids)
+
+    def pin_many(self, cids: list[str], on_progress=None) -> list[str]:
+        """
+        Pin objects recursively, PIN_BATCH_SIZE per request, e.g. the roots of content put with should_pin=False.
+
+        A batch that fails is tried again up to PIN_ATTEMPTS times, waiting longer each time, before the error is
+        raised. `on_progress` is called with the number of objects pinned so far and the total after each batch.
+        Returns the pinned CIDs
+        """
+        cids = list(dict.fromkeys(cids))
+        pinned = []
+        for start in range(0, len(cids), self.PIN_BATCH_SIZE):
+            batch = cids[start:start + self.PIN_BATCH_SIZE]
+            for attempt in range(self.PIN_ATTEMPTS):
+                try:
+                    res = self.ipfs_session.post(
+                        self._host + "/api/v0/pin/add",
+                        params={"arg": batch, "recursive": True},
+                        timeout=self._default_timeout,
+                    )
+                    res.raise_for_status()
+                    break
+                except requests.RequestException:
+                    if attempt == self.PIN_ATTEMPTS - 1:
+                        raise
+                    time.sleep(self.PIN_RETRY_DELAY * 2 ** attempt)
+            pinned.extend(res.json()["Pins"])
+            if self.known_cids is not None:
+                for cid in batch:
+                    self.known_cids.add(cid)
+            if on_progress is not None:
+                on_progress(start + len(batch), len(cids))
+        return pinned
 
     @staticmethod
     def json_to_bytes(obj: dict) -> bytes:
@@ -229,9 +488,10 @@ class IPFSIO:
         return io.BytesIO(obj.encode('utf-8')).read()
 
     @staticmethod
-    def get_retry_session() -> requests.Session:
+    def get_retry_session(pool_maxsize: int = DEFAULT_MAX_WORKERS) -> requests.Session:
         session = requests.Session()
         retries = Retry(connect=5, total=5, backoff_factor=4)
-        session.mount("http://", HTTPAdapter(max_retries=retries))
+        # every request goes to the same node, keep enough connections alive for the concurrent batch methods
+        session.mount("http://", HTTPAdapter(pool_connections=1, pool_maxsize=pool_maxsize, max_retries=retries))
         return session
 
@@ -0,0 +1,49 @@
+import os
+import threading
+
+
+class KnownCIDs:
+    """
+    A persisted set of the CIDs already pinned on this host's IPFS node.
+
+    CIDs are appended to the file one per line as they are added, so recording one never rewrites the set.
+    Content whose locally computed CID is in the set does not need to be sent to the node again.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._cids = self.load()
+
+    def __getstate__(self):
+        # locks can't be pickled, e.g. to send a store to the transform worker processes
+        state = self.__dict__.copy()
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def load(self) -> set:
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                return {line.strip() for line in f if line.strip()}
+        except FileNotFoundError:
+            return set()
+
+    def __contains__(self, cid) -> bool:
+        return str(cid) in self._cids
+
+    def __len__(self) -> int:
+        return len(self._cids)
+
+    def add(self, cid) -> None:
+        cid = str(cid)
+        with self._lock:
+            if cid in self._cids:
+                return
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), 0o755, True)
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(f"{cid}\n")
+            self._cids.add(cid)
@@ -2,18 +2,40 @@
 from __future__ import annotations
 
 import os
+import io
+import gzip
 import json
+import time
+import hashlib
+import dag_cbor
 import s3fs
 import fsspec
 from contextlib import contextmanager
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
 from botocore.session import Session
+from multiformats import CID
 from abc import abstractmethod, ABC
 from nettle.utils import settings
 from .ipfs import IPFSIO
+from .car import CARWriter
+from .disk_cache import DiskCache
+from .cid_cache import CIDCache
+from .known_cids import KnownCIDs
+from .hash_index import HashIndex
+from .file_handler import FileHandler
+
+
+PARQUET_COMPRESSION = "zstd"
+PARQUET_ROW_GROUP_SIZE = 64 * 1024
+# file name suffix -> compression codec of files written and read compressed, e.g. KALUMBURU.csv.gz
+COMPRESSION_SUFFIXES = {"gz": "gzip", "zst": "zstd"}
 
 
 class StoreInterface(ABC):
+    # extra pandas.read_csv arguments used when reading csv files
+    CSV_READ_KWARGS = {}
 
     def __init__(self, log=None):
         self.log = log
@@ -41,6 +63,107 @@ class StoreInterface(ABC):
     def read(self, filepath: str, file_type=None, **kwargs):
         pass
 
+    def read_many(self, filepaths: list[str]) -> dict:
+        """
+        Read several files (relative folder path + filename) at once, returning filepath -> content for the files
+        that exist. Stores that can fetch a batch concurrently override this
+        """
+        contents = {}
+        for filepath in filepaths:
+            content = self.read(filepath)
+            if content is not None:
+                contents[filepath] = content
+        return contents
+
+    @abstractmethod
+    def put_local_file(self, local_path: str, filepath: str):
+        """
+        Copy a single local file to filepath (relative folder path + filename) on this store
+        """
+        pass
+
+    @staticmethod
+    def file_type(filepath: str) -> str:
+        return strip_compression_suffix(filepath).split(".")[-1]
+
+    def cat_many(self, filepaths: list[str]) -> dict:
+        """
+        Fetch the raw bytes of several files in one concurrent batch, skipping the ones that do not exist.
+        Only for stores with an fsspec filesystem
+        """
+        full_filepaths = {self.fs()._strip_protocol(os.path.join(self.base_folder, filepath)): filepath
+                          for filepath in filepaths}
+        full_filepaths = {path: filepath for path, filepath in full_filepaths.items() if not self.known_missing(path)}
+        if not full_filepaths:
+            return {}
+        with self.deal_with_errors(self.base_folder):
+            contents = self.fs().cat(list(full_filepaths), on_error='omit')
+            # a single path is returned as bytes rather than a dict
+            if not isinstance(contents, dict):
+                contents = {next(iter(full_filepaths)): contents}
+            return {full_filepaths[self.fs()._strip_protocol(path)]: content for path, content in contents.items()}
+        return {}
+
+    def parse_bytes(self, content: bytes, file_type: str, compression: str = None, **kwargs):
+        content = decompress_bytes(content, compression)
+        if file_type == 'json' or file_type == 'geojson':
+            return json.loads(content)
+        elif file_type == 'csv':
+            return pd.read_csv(io.BytesIO(content), dtype=self.string_dtype, **self.CSV_READ_KWARGS)
+        elif file_type == 'parquet':
+            return self.read_parquet(io.BytesIO(content), **kwargs)
+        raise Exception('[store.read] file type not identified')
+
+    def known_missing(self, full_filepath: str) -> bool:
+        """
+        True if the store knows full_filepath does not exist without asking the remote, see S3.snapshot_listing
+        """
+        return False
+
+    def file_info(self, full_filepath: str) -> dict:
+        return self.fs().info(full_filepath)
+
+    def read_parquet(self, source, **kwargs) -> pd.DataFrame:
+        return read_parquet(source, columns=kwargs.get('columns'), start=kwargs.get('start'),
+                            end=kwargs.get('end'), string_dtype=self.string_dtype)
+
+    def cached_cat(self, full_filepath: str) -> bytes | None:
+        """
+        Return the bytes of full_filepath through the store's DiskCache, or None if it does not exist.
+
+        Copies fetched less than `cache_ttl` seconds ago are trusted as they are. Older ones are revalidated with a
+        metadata (HEAD) request and only downloaded again if the object's ETag (or size and modification time,
+        for filesystems without ETags) changed
+        """
+        meta = self.cache.meta(full_filepath)
+        if meta is not None and self.cache_ttl is not None and time.time() - meta["fetched"] < self.cache_ttl:
+            content = self.cache.get(full_filepath)
+            if content is not None:
+                return content
+        try:
+            info = self.file_info(full_filepath)
+        except FileNotFoundError:
+            self.cache.delete(full_filepath)
+            return None
+        version = info.get("ETag") or f"{info.get('size')}-{info.get('mtime', info.get('LastModified'))}"
+        if meta is not None and meta.get("version") == version:
+            content = self.cache.get(full_filepath)
+            if content is not None:
+                self.cache.set_meta(full_filepath, {**meta, "fetched": time.time()})
+                return content
+        content = self.fs().cat_file(full_filepath)
+        self.cache.put(full_filepath, content, {"version": version, "fetched": time.time()})
+        return content
+
+    def write_parquet_file(self, full_filepath: str, dataframe: pd.DataFrame, **kwargs) -> None:
+        write_parquet(
+            self.fs(),
+            full_filepath,
+            dataframe,
+            compression=kwargs.get('compression', self.parquet_compression),
+            row_group_size=kwargs.get('row_group_size', self.parquet_row_group_size)
+        )
+
     @contextmanager
     def deal_with_errors(self, filepath):
         try:
@@ -60,16 +183,296 @@ class StoreInterface(ABC):
             raise e
 
 
+def file_compression(filepath: str) -> str | None:
+    """
+    The codec of a compressed file from its suffix ("gzip" for KALUMBURU.csv.gz), or None if it is not compressed
+    """
+    return COMPRESSION_SUFFIXES.get(filepath.split(".")[-1])
+
+
+def compression_suffix(compression: str | None) -> str:
+    """
+    The suffix added to the names of files compressed with `compression`, e.g. ".gz" for "gzip"
+    """
+    if compression is None:
+        return ""
+    for suffix, codec in COMPRESSION_SUFFIXES.items():
+        if codec == compression:
+            return f".{suffix}"
+    raise ValueError(
+        f"[store] unsupported compression {compression}, use one of {list(COMPRESSION_SUFFIXES.values())}")
+
+
+def strip_compression_suffix(filepath: str) -> str:
+    return filepath.rsplit(".", 1)[0] if file_compression(filepath) else filepath
+
+
+def check_compression(compression: str | None) -> None:
+    """
+    zstd support is optional, raise a clear error when the zstandard package is missing
+    """
+    if compression == "zstd":
+        try:
+            import zstandard  # noqa: F401
+        except ImportError:
+            raise ImportError("[store] reading or writing .zst files requires the zstandard package") from None
+
+
+def decompress_bytes(content: bytes, compression: str | None) -> bytes:
+    if compression == "gzip":
+        return gzip.decompress(content)
+    if compression == "zstd":
+        check_compression(compression)
+        import zstandard
+        # stream the frame as it may not record its decompressed size
+        with zstandard.ZstdDecompressor().stream_reader(io.BytesIO(content)) as reader:
+            return reader.read()
+    return content
+
+
+def read_csv_edges(fs, full_filepath: str, block_size: int = 64 * 1024) -> tuple[pd.DataFrame, pd.DataFrame] | None:
+    """
+    Read the first and the last data rows of a csv with ranged reads instead of downloading the whole file.
+
+    The head is read forward until the header and first row are complete, the tail is read backwards from the end
+    of the file until it holds at least one complete row.
+    Returns (first row, last rows) as string dataframes, or None if the file does not exist
+    """
+    if not fs.exists(full_filepath):
+        return None
+    size = fs.size(full_filepath)
+
+    end = min(size, block_size)
+    head = fs.cat_file(full_filepath, start=0, end=end)
+    while head.count(b"\n") < 2 and end < size:
+        end = min(size, end * 2)
+        head = fs.cat_file(full_filepath, start=0, end=end)
+    head_lines = head.splitlines()[:2]
+
+    start = max(0, size - block_size)
+    tail = fs.cat_file(full_filepath, start=start, end=size)
+    # the first line of the block is cut unless the block starts at the beginning of the file
+    while start > 0 and tail.rstrip(b"\n").count(b"\n") < 1:
+        start = max(0, start - len(tail))
+        tail = fs.cat_file(full_filepath, start=start, end=size)
+    # drop the header, or the partial line the block starts in the middle of
+    tail_lines = tail.splitlines()[1:]
+
+    def to_dataframe(lines: list[bytes]) -> pd.DataFrame:
+        return pd.read_csv(io.BytesIO(b"\n".join([head_lines[0]] + [line for line in lines if line])), dtype=str)
+
+    return to_dataframe(head_lines[1:]), to_dataframe(tail_lines)
+
+
+def write_parquet(
+        fs,
+        full_filepath: str,
+        dataframe: pd.DataFrame,
+        compression: str = PARQUET_COMPRESSION,
+        row_group_size: int = PARQUET_ROW_GROUP_SIZE
+) -> None:
+    table = pa.Table.from_pandas(dataframe, preserve_index=False)
+    with fs.open(full_filepath, "wb") as f:
+        pq.write_table(table, f, compression=compression, row_group_size=row_group_size)
+
+
+def read_parquet(
+        source,
+        columns: list[str] = None,
+        start=None,
+        end=None,
+        string_dtype=str
+) -> pd.DataFrame:
+    """
+    Read a parquet file (an open binary file), only loading `columns` if given.
+    `start` and `end` keep the rows whose dt is within them (inclusive). Row groups whose dt statistics are entirely
+    outside the range are skipped without being read. They must be of the same type as the stored dt column.
+    String columns are converted to `string_dtype`, python string objects by default
+    """
+    filters = []
+    if start is not None:
+        filters.append(("dt", ">=", start))
+    if end is not None:
+        filters.append(("dt", "<=", end))
+    table = pq.read_table(source, columns=columns, filters=filters if filters else None)
+    if string_dtype is str:
+        return table.to_pandas()
+    string_dtype = pd.api.types.pandas_dtype(string_dtype)
+
+    def types_mapper(arrow_type):
+        if pa.types.is_string(arrow_type) or pa.types.is_large_string(arrow_type):
+            return string_dtype
+        return None
+
+    return table.to_pandas(types_mapper=types_mapper)
+
+
+def parquet_chunks(
+        dataframe: pd.DataFrame,
+        max_bytes: int,
+        compression: str = PARQUET_COMPRESSION
+) -> list[tuple[pd.DataFrame, bytes]]:
+    """
+    Split a dataframe into consecutive runs of rows, each encoded as a parquet file of at most max_bytes
+    (unless a single row is larger). Returns (rows, parquet bytes) for each chunk
+    """
+    def encode(rows: pd.DataFrame) -> bytes:
+        buffer = io.BytesIO()
+        pq.write_table(pa.Table.from_pandas(rows, preserve_index=False), buffer, compression=compression)
+        return buffer.getvalue()
+
+    data = encode(dataframe)
+    if len(data) <= max_bytes or len(dataframe) <= 1:
+        return [(dataframe, data)]
+    # aim a little under the limit as smaller files compress less well, and split again the chunks still too large
+    rows_per_chunk = max(1, int(len(dataframe) * max_bytes * 0.8 / len(data)))
+    chunks = []
+    for start in range(0, len(dataframe), rows_per_chunk):
+        rows = dataframe.iloc[start:start + rows_per_chunk]
+        data = encode(rows)
+        if len(data) > max_bytes and len(rows) > 1:
+            half = len(rows) // 2
+            chunks.extend(parquet_chunks(rows.iloc[:half], max_bytes, compression))
+            chunks.extend(parquet_chunks(rows.iloc[half:], max_bytes, compression))
+        else:
+            chunks.append((rows, data))
+    return chunks
+
+
+def file_md5(path: str, block_size: int = 1024 * 1024) -> str:
+    md5 = hashlib.md5()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            md5.update(block)
+    return md5.hexdigest()
+
+
+def file_sha256(path: str, block_size: int = 1024 * 1024) -> str:
+    sha256 = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            sha256.update(block)
+    return sha256.hexdigest()
+
+
+class SyncReport:
+    """
+    What a folder sync uploaded and what it skipped because the remote copy was already identical
+    """
+
+    def __init__(self):
+        self.uploaded = []
+        self.skipped = []
+        self.bytes_uploaded = 0
+        self.bytes_skipped = 0
+
+    def add(self, filepath: str, size: int, upload: bool) -> None:
+        if upload:
+            self.uploaded.append(filepath)
+            self.bytes_uploaded += size
+        else:
+            self.skipped.append(filepath)
+            self.bytes_skipped += size
+
+    def __repr__(self):
+        return (f"SyncReport(uploaded {len(self.uploaded)} files / {self.bytes_uploaded} bytes, "
+                f"skipped {len(self.skipped)} files / {self.bytes_skipped} bytes)")
+
+
+def append_csv(fs, full_filepath: str, dataframe: pd.DataFrame) -> None:
+    """
+    Append the rows of dataframe, without header, to the end of an existing csv
+    """
+    prefix = b""
+    size = fs.size(full_filepath)
+    if size and fs.cat_file(full_filepath, start=size - 1, end=size) != b"\n":
+        prefix = b"\n"
+    with fs.open(full_filepath, "ab") as f:
+        f.write(prefix + dataframe.to_csv(index=False, header=False).encode("utf-8"))
+
+
+# every part of an S3 multipart upload but the last must be at least this large, and a copied part at most
+S3_MIN_PART_SIZE = 5 * 1024 ** 2
+S3_MAX_PART_SIZE = 5 * 1024 ** 3
+
+
+def s3_append_csv(fs: s3fs.S3FileSystem, full_filepath: str, dataframe: pd.DataFrame) -> None:
+    """
+    Append the rows of dataframe, without header, to the end of an existing csv on S3.
+
+    S3 objects can't be appended to, so the object is replaced by a multipart upload whose first parts are copied
+    from the existing object within S3 (UploadPartCopy) and whose last part holds the new rows: only the new rows
+    are uploaded and nothing is downloaded but the last byte. Objects smaller than S3_MIN_PART_SIZE can't be a
+    copied part, they are downloaded and written again with the rows appended
+    """
+    rows = dataframe.to_csv(index=False, header=False).encode("utf-8")
+    size = fs.size(full_filepath)
+    if size < S3_MIN_PART_SIZE:
+        content = fs.cat_file(full_filepath)
+        fs.pipe_file(full_filepath, content + (b"\n" if content and not content.endswith(b"\n") else b"") + rows)
+        return
+    if fs.cat_file(full_filepath, start=size - 1, end=size) != b"\n":
+        rows = b"\n" + rows
+    bucket, key, _ = fs.split_path(full_filepath)
+    upload_id = fs.call_s3("create_multipart_upload", Bucket=bucket, Key=key)["UploadId"]
+    try:
+        parts = []
+        # equal copied parts, all within the part size limits
+        part_size = -(-size // -(-size // S3_MAX_PART_SIZE))
+        for start in range(0, size, part_size):
+            copied = fs.call_s3("upload_part_copy", Bucket=bucket, Key=key, UploadId=upload_id,
+                                PartNumber=len(parts) + 1, CopySource={"Bucket": bucket, "Key": key},
+                                CopySourceRange=f"bytes={start}-{min(start + part_size, size) - 1}")
+            parts.append({"PartNumber": len(parts) + 1, "ETag": copied["CopyPartResult"]["ETag"]})
+        uploaded = fs.call_s3("upload_part", Bucket=bucket, Key=key, UploadId=upload_id,
+                              PartNumber=len(parts) + 1, Body=rows)
+        parts.append({"PartNumber": len(parts) + 1, "ETag": uploaded["ETag"]})
+        fs.call_s3("complete_multipart_upload", Bucket=bucket, Key=key, UploadId=upload_id,
+                   MultipartUpload={"Parts": parts})
+    except Exception:
+        fs.call_s3("abort_multipart_upload", Bucket=bucket, Key=key, UploadId=upload_id)
+        raise
+    finally:
+        fs.invalidate_cache(full_filepath)
+
+
 class S3(StoreInterface):
+    CSV_READ_KWARGS = {'on_bad_lines': 'skip'}
 
     def __init__(
             self,
             log=None,
             bucket: str = '',
-            credentials_name: str = ''
+            credentials_name: str = '',
+            parquet_compression: str = PARQUET_COMPRESSION,
+            parquet_row_group_size: int = PARQUET_ROW_GROUP_SIZE,
+            string_dtype=str,
+            cache: DiskCache = None,
+            cache_ttl: float = None,
+            snapshot_listings: bool = False,
+            sync_uploads: bool = False,
+            upload_concurrency: int = 16,
+            multipart_chunksize: int = 50 * 1024 ** 2
     ):
         super().__init__(log)
         self.bucket = bucket
+        # only upload new or changed files in cp_folder_to_remote, see remote_file_unchanged
+        self.sync_uploads = sync_uploads
+        self.upload_concurrency = upload_concurrency
+        # files larger than this are uploaded in parts of this size
+        self.multipart_chunksize = multipart_chunksize
+        self.last_sync_report = None
+        # answer existence, size and ETag lookups from one listing of the dataset, see snapshot_listing
+        self.snapshot_listings = snapshot_listings
+        self._listing = None
+        self._listing_prefix = None
+        self.parquet_compression = parquet_compression
+        self.parquet_row_group_size = parquet_row_group_size
+        # dtype of the string columns read back, e.g. "string[pyarrow]" instead of python string objects
+        self.string_dtype = string_dtype
+        # optional local copy of the files read, see cached_cat
+        self.cache = cache
+        self.cache_ttl = cache_ttl
         self.credentials_name = credentials_name
         self.creds = Session(profile=credentials_name).get_credentials() if credentials_name else None
         self.base_folder = f"s3://{self.bucket}/"
@@ -109,7 +512,7 @@ class S3(StoreInterface):
             self.base_folder,
             filepath
         )
-        return self.fs().exists(full_filepath)
+        return self.has_existing_file_full_path(full_filepath)
 
     def has_existing_file_full_path(self, filepath):
         """
@@ -117,24 +520,155 @@ class S3(StoreInterface):
         :param filepath:
         :return:
         """
+        snapshot_key = self._snapshot_key(filepath)
+        if snapshot_key is not None:
+            return snapshot_key in self._listing
         return self.fs().exists(filepath)
 
+    def snapshot_listing(self, relative_path: str) -> int:
+        """
+        List every object under relative_path once, with its size and ETag (s3fs paginates the listing).
+        Lookups for files under that prefix are then answered from this snapshot instead of a HEAD request each,
+        and the snapshot is kept up to date with the files written through this store.
+        Returns the number of objects listed
+        """
+        prefix = s3fs.S3FileSystem._strip_protocol(os.path.join(self.base_folder, relative_path)).rstrip('/')
+        with self.deal_with_errors(prefix):
+            self._listing = self.fs().find(prefix, detail=True)
+            self._listing_prefix = f"{prefix}/"
+            self.log.info(f"[store.snapshot_listing] listed {len(self._listing)} objects under {prefix}")
+            return len(self._listing)
+
+    def _snapshot_key(self, full_filepath: str) -> str | None:
+        """
+        The key of full_filepath in the listing snapshot, or None if the snapshot does not cover it
+        """
+        if self._listing is None:
+            return None
+        path = s3fs.S3FileSystem._strip_protocol(full_filepath)
+        return path if path.startswith(self._listing_prefix) else None
+
+    def _record_write(self, full_filepath: str, size: int = None) -> None:
+        snapshot_key = self._snapshot_key(full_filepath)
+        if snapshot_key is not None:
+            # the new ETag is unknown, lookups that need it ask S3 again
+            self._listing[snapshot_key] = {"name": snapshot_key, "type": "file", "size": size}
+
+    def known_missing(self, full_filepath: str) -> bool:
+        snapshot_key = self._snapshot_key(full_filepath)
+        return snapshot_key is not None and snapshot_key not in self._listing
+
+    def file_info(self, full_filepath: str) -> dict:
+        snapshot_key = self._snapshot_key(full_filepath)
+        if snapshot_key is not None:
+            info = self._listing.get(snapshot_key)
+            if info is None:
+                raise FileNotFoundError(full_filepath)
+            if info.get("ETag"):
+                return info
+        return self.fs().info(full_filepath)
+
     # relative_s3_path is the directory before the last directory
     # relative_s3_path usually is just collection name
     # For example, if you have this: s3://arbol-station-dev/bom2/bom2-daily/metadata.json
     # relative_s3_path would be: bom2
     def cp_folder_to_remote(self, local_path: str, relative_s3_path: str):
+        """
+        Upload the local_path folder into relative_s3_path, e.g. processed_data/bom2/bom2-daily into bom2 gives
+        s3://bucket/bom2/bom2-daily/...
+
+        Every file is given its full destination path, so no folder needs to exist beforehand, and files are
+        uploaded `upload_concurrency` at a time. With `sync_uploads` only new or changed files are uploaded.
+        """
         s3_folder_path = os.path.join(self.base_folder, relative_s3_path)
+        remote_folder = os.path.join(s3_folder_path, os.path.basename(os.path.normpath(local_path)))
         with self.deal_with_errors(local_path):
-            if not self.has_existing_file_full_path(s3_folder_path):
-                # Hack to create folder and avoid duplicated sub-folder
-                self.fs().touch(os.path.join(s3_folder_path, 'tempCVG2Qy95Jp'))
-                self.fs().put(local_path, s3_folder_path, recursive=True)
-                self.fs().rm(os.path.join(s3_folder_path, 'tempCVG2Qy95Jp'))
-            else:
-                self.fs().put(local_path, s3_folder_path, recursive=True)
+            local_filepaths = sorted(os.path.join(root, file)
+                                     for root, _, files in os.walk(local_path) for file in files)
+            remote_filepaths = [os.path.join(remote_folder, os.path.relpath(local_filepath, local_path))
+                                for local_filepath in local_filepaths]
+            manifest_path = f"{os.path.normpath(local_path)}.sync_manifest.json"
+            manifest = FileHandler.load_dict(manifest_path) if self.sync_uploads else None
+            remote_files = self.remote_file_details(remote_folder) if self.sync_uploads else {}
+
+            report = SyncReport()
+            uploads = []
+            for local_filepath, remote_filepath in zip(local_filepaths, remote_filepaths):
+                upload = not self.sync_uploads or not self.remote_file_unchanged(
+                    local_filepath, remote_files.get(s3fs.S3FileSystem._strip_protocol(remote_filepath)),
+                    (manifest if manifest else {}).get(remote_filepath))
+                report.add(remote_filepath, os.path.getsize(local_filepath), upload)
+                if upload:
+                    uploads.append((local_filepath, remote_filepath))
+
+            if uploads:
+                self.fs().put([local_filepath for local_filepath, _ in uploads],
+                              [remote_filepath for _, remote_filepath in uploads],
+                              batch_size=self.upload_concurrency,
+                              chunksize=self.multipart_chunksize)
+            for local_filepath, remote_filepath in uploads:
+                self._record_write(remote_filepath, os.path.getsize(local_filepath))
+            if self.sync_uploads:
+                self.save_sync_manifest(manifest_path, manifest if manifest else {}, uploads, remote_folder)
+            self.log.info(f"[store.cp_folder_to_remote] {report}")
+            self.last_sync_report = report
             return s3_folder_path
 
+    def remote_file_details(self, remote_folder: str) -> dict:
+        """
+        Path -> details (size, ETag) of every object under remote_folder, from the listing snapshot if it has them
+        """
+        path = s3fs.S3FileSystem._strip_protocol(remote_folder)
+        if self._snapshot_key(f"{path}/") is not None:
+            return {key: info for key, info in self._listing.items() if key.startswith(f"{path}/")}
+        try:
+            return self.fs().find(path, detail=True)
+        except FileNotFoundError:
+            return {}
+
+    @staticmethod
+    def remote_file_unchanged(local_filepath: str, remote_details: dict | None, manifest_entry: dict | None) -> bool:
+        """
+        A remote object is unchanged if its size matches and either its ETag is the md5 of the local file (single
+        part uploads) or it is the ETag recorded when this exact local content was last uploaded (multipart uploads)
+        """
+        if remote_details is None or remote_details.get("size") != os.path.getsize(local_filepath):
+            return False
+        etag = (remote_details.get("ETag") or "").strip('"')
+        if not etag:
+            return False
+        local_md5 = file_md5(local_filepath)
+        if etag == local_md5:
+            return True
+        return manifest_entry is not None and manifest_entry.get("md5") == local_md5 \
+            and manifest_entry.get("etag") == etag
+
+    def save_sync_manifest(self, manifest_path: str, manifest: dict, uploads: list, remote_folder: str) -> None:
+        """
+        Record the md5 and the new ETag of uploaded files, needed to recognise unchanged multipart uploads
+        """
+        if not uploads:
+            return
+        remote_files = self.fs().find(s3fs.S3FileSystem._strip_protocol(remote_folder), detail=True)
+        for local_filepath, remote_filepath in uploads:
+            details = remote_files.get(s3fs.S3FileSystem._strip_protocol(remote_filepath), {})
+            manifest[remote_filepath] = {"md5": file_md5(local_filepath),
+                                         "etag": (details.get("ETag") or "").strip('"')}
+        tmp_path = f"{manifest_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(manifest, f)
+        os.replace(tmp_path, manifest_path)
+
+    def put_local_file(self, local_path: str, filepath: str):
+        full_filepath = os.path.join(
+            self.base_folder,
+            filepath
+        )
+        with self.deal_with_errors(local_path):
+            self.fs().put_file(local_path, full_filepath)
+            self._record_write(full_filepath, os.path.getsize(local_path))
+        return full_filepath
+
     def write(self, filepath: str, content, encoding=None, **kwargs):
         """
         filepath = relative folder path + filename
@@ -150,10 +684,17 @@ class S3(StoreInterface):
         )
 
         with self.deal_with_errors(full_filepath):
+            if isinstance(content, pd.DataFrame) and self.file_type(filepath) == 'parquet':
+                self.write_parquet_file(full_filepath, content, **kwargs)
+                self._record_write(full_filepath)
+                return filepath
+
             if isinstance(content, dict):
                 encoding = 'utf-8'
+            compression = file_compression(filepath)
+            check_compression(compression)
 
-            with self.fs().open(full_filepath, 'w', encoding=encoding) as f:
+            with self.fs().open(full_filepath, 'w', encoding=encoding, compression=compression) as f:
                 if isinstance(content, dict):
                     json.dump(content, f, sort_keys=False,
                               ensure_ascii=False, indent=4)
@@ -162,12 +703,18 @@ class S3(StoreInterface):
                 else:
                     raise Exception(
                         "[store.write] content file not identified")
+            self._record_write(full_filepath)
 
         return filepath
 
     def read(self, filepath: str, file_type=None, **kwargs):
+        """
+        For parquet files, `columns`, `start` and `end` can be passed in kwargs, see `read_parquet`
+        """
         if file_type is None:
-            file_type = filepath.split(".")[-1]
+            file_type = self.file_type(filepath)
+        compression = file_compression(filepath)
+        check_compression(compression)
 
         full_filepath = os.path.join(
             self.base_folder,
@@ -175,11 +722,17 @@ class S3(StoreInterface):
         )
 
         with self.deal_with_errors(full_filepath):
+            if self.cache is not None:
+                content = self.cached_cat(full_filepath)
+                return None if content is None else self.parse_bytes(content, file_type, compression, **kwargs)
             if self.has_existing_file_full_path(full_filepath):
-                with self.fs().open(full_filepath, 'r') as f:
+                if file_type == 'parquet':
+                    with self.fs().open(full_filepath, 'rb', compression=compression) as f:
+                        return self.read_parquet(f, **kwargs)
+                with self.fs().open(full_filepath, 'r', compression=compression) as f:
                     if file_type == 'csv':
                         csv = pd.read_csv(
-                            f, dtype=str, on_bad_lines='skip')
+                            f, dtype=self.string_dtype, **self.CSV_READ_KWARGS)
                         return csv
                     elif file_type == 'json' or file_type == 'geojson':
                         return json.load(f)
@@ -187,6 +740,34 @@ class S3(StoreInterface):
                         raise Exception(
                             '[store.read] file type not identified')
 
+    def read_csv_edges(self, filepath: str) -> tuple[pd.DataFrame, pd.DataFrame] | None:
+        """
+        Return the first row and the last rows of the csv at filepath (relative folder path + filename) using
+        ranged reads, see `read_csv_edges`
+        """
+        full_filepath = os.path.join(
+            self.base_folder,
+            filepath
+        )
+        with self.deal_with_errors(full_filepath):
+            return read_csv_edges(self.fs(), full_filepath)
+
+    def append_csv(self, filepath: str, dataframe: pd.DataFrame):
+        full_filepath = os.path.join(
+            self.base_folder,
+            filepath
+        )
+        with self.deal_with_errors(full_filepath):
+            s3_append_csv(self.fs(), full_filepath, dataframe)
+            self._record_write(full_filepath)
+        return filepath
+
+    def read_many(self, filepaths: list[str]) -> dict:
+        if not filepaths:
+            return {}
+        return {filepath: self.parse_bytes(content, self.file_type(filepath), file_compression(filepath))
+                for filepath, content in self.cat_many(filepaths).items()}
+
     # def latest_metadata(self, path: str, **kwargs):
     #     self.log.info(f"getting latest metadata")
     #     try:
@@ -207,13 +788,27 @@ class S3(StoreInterface):
 
 
 class Local(StoreInterface):
+    CSV_READ_KWARGS = {'na_values': ""}
+
     def __init__(
             self,
             log=None,
-            base_folder: str = ''
+            base_folder: str = '',
+            parquet_compression: str = PARQUET_COMPRESSION,
+            parquet_row_group_size: int = PARQUET_ROW_GROUP_SIZE,
+            string_dtype=str,
+            cache: DiskCache = None,
+            cache_ttl: float = None
     ):
         super().__init__(log)
         self.base_folder = base_folder
+        self.parquet_compression = parquet_compression
+        self.parquet_row_group_size = parquet_row_group_size
+        # dtype of the string columns read back, e.g. "string[pyarrow]" instead of python string objects
+        self.string_dtype = string_dtype
+        # optional local copy of the files read, see cached_cat
+        self.cache = cache
+        self.cache_ttl = cache_ttl
 
     def __str__(self) -> str:
         return self.base_folder
@@ -243,6 +838,18 @@ class Local(StoreInterface):
         """
         return self.fs().exists(filepath)
 
+    def put_local_file(self, local_path: str, filepath: str):
+        full_filepath = os.path.join(
+            self.base_folder,
+            filepath
+        )
+        # processed files usually already live in the local store's base folder
+        if os.path.abspath(local_path) != os.path.abspath(full_filepath):
+            with self.deal_with_errors(local_path):
+                self.fs().makedirs(os.path.dirname(full_filepath), exist_ok=True)
+                self.fs().copy(local_path, full_filepath)
+        return full_filepath
+
     def write(self, filepath: str, content, encoding=None, **kwargs):
         full_filepath = os.path.join(
             self.base_folder,
@@ -250,9 +857,15 @@ class Local(StoreInterface):
         )
 
         with self.deal_with_errors(full_filepath):
+            if isinstance(content, pd.DataFrame) and self.file_type(filepath) == 'parquet':
+                self.write_parquet_file(full_filepath, content, **kwargs)
+                return filepath
+
             if isinstance(content, dict):
                 encoding = 'utf-8'
-            with self.fs().open(full_filepath, 'w', encoding=encoding) as f:
+            compression = file_compression(filepath)
+            check_compression(compression)
+            with self.fs().open(full_filepath, 'w', encoding=encoding, compression=compression) as f:
                 if isinstance(content, dict):
                     json.dump(content, f, sort_keys=False,
                               ensure_ascii=False, indent=4)
@@ -266,8 +879,13 @@ class Local(StoreInterface):
         return filepath
 
     def read(self, filepath: str, file_type=None, **kwargs):
+        """
+        For parquet files, `columns`, `start` and `end` can be passed in kwargs, see `read_parquet`
+        """
         if file_type is None:
-            file_type = filepath.split(".")[-1]
+            file_type = self.file_type(filepath)
+        compression = file_compression(filepath)
+        check_compression(compression)
 
         full_filepath = os.path.join(
             self.base_folder,
@@ -275,10 +893,16 @@ class Local(StoreInterface):
         )
 
         with self.deal_with_errors(full_filepath):
+            if self.cache is not None:
+                content = self.cached_cat(full_filepath)
+                return None if content is None else self.parse_bytes(content, file_type, compression, **kwargs)
             if self.has_existing_file_full_path(full_filepath):
-                with self.fs().open(full_filepath, 'r') as f:
+                if file_type == 'parquet':
+                    with self.fs().open(full_filepath, 'rb', compression=compression) as f:
+                        return self.read_parquet(f, **kwargs)
+                with self.fs().open(full_filepath, 'r', compression=compression) as f:
                     if file_type == 'csv':
-                        csv = pd.read_csv(f, dtype=str, na_values="")
+                        csv = pd.read_csv(f, dtype=self.string_dtype, **self.CSV_READ_KWARGS)
                         return csv
                     elif file_type == 'json' or file_type == 'geojson':
                         return json.load(f)
@@ -286,6 +910,33 @@ class Local(StoreInterface):
                         raise Exception(
                             '[store.read] file type not identified')
 
+    def read_csv_edges(self, filepath: str) -> tuple[pd.DataFrame, pd.DataFrame] | None:
+        """
+        Return the first row and the last rows of the csv at filepath (relative folder path + filename) using
+        ranged reads, see `read_csv_edges`
+        """
+        full_filepath = os.path.join(
+            self.base_folder,
+            filepath
+        )
+        with self.deal_with_errors(full_filepath):
+            return read_csv_edges(self.fs(), full_filepath)
+
+    def append_csv(self, filepath: str, dataframe: pd.DataFrame):
+        full_filepath = os.path.join(
+            self.base_folder,
+            filepath
+        )
+        with self.deal_with_errors(full_filepath):
+            append_csv(self.fs(), full_filepath, dataframe)
+        return filepath
+
+    def read_many(self, filepaths: list[str]) -> dict:
+        if not filepaths:
+            return {}
+        return {filepath: self.parse_bytes(content, self.file_type(filepath), file_compression(filepath))
+                for filepath, content in self.cat_many(filepaths).items()}
+
     # def metadata_by_filesystem(self, directory, path):
     #     '''
     #     Get metadata from local filesystem by passing in a root folder path
@@ -319,119 +970,209 @@ class IPFS(StoreInterface):
     HASHES_OUTPUT_ROOT = settings.HASHES_OUTPUT_ROOT
     HASH_HEADS_PATH = os.path.join(HASHES_OUTPUT_ROOT, HEADS_FILE_NAME)
     HASH_HISTORY_PATH = os.path.join(HASHES_OUTPUT_ROOT, HISTORY_FILE_NAME)
+    HASH_INDEX_PATH = os.path.join(HASHES_OUTPUT_ROOT, "index.jsonl")
+    # identifies the roots written by publish_dag
+    DAG_TYPE = "nettle station set"
+    # above this many files the entries of a DAG are split into 256 shards by the hash of their name
+    DAG_SHARD_THRESHOLD = 256
 
-    def __init__(self, dataset_manager=None):
+    def __init__(
+            self,
+            dataset_manager=None,
+            max_workers: int = IPFSIO.DEFAULT_MAX_WORKERS,
+            cache: DiskCache = None,
+            memory_cache_bytes: int = 64 * 1024 ** 2,
+            known_cids_path: str = None,
+            export_legacy_hashes: bool = False,
+            layout: str = "directory",
+            defer_pins: bool = False
+    ):
         super().__init__(dataset_manager)
-        self.ipfs_io = IPFSIO()
+        # see IPFSIO.put_many, CIDCache for the objects read by CID and KnownCIDs for the content not sent again
+        self.ipfs_io = IPFSIO(
+            max_workers=max_workers,
+            cache=CIDCache(cache, memory_cache_bytes),
+            known_cids=KnownCIDs(known_cids_path) if known_cids_path else None
+        )
+        # also rewrite heads.json and history.json after each publish, for tools that still read them
+        self.export_legacy_hashes = export_legacy_hashes
+        # "directory" adds the whole folder as one wrapped directory, "dag" only publishes changes, see publish_dag,
+        # and "car" imports the same DAG built locally in one request, see publish_car
+        self.layout = layout
+        # write everything unpinned and only pin the roots written, recursively and in batches, once the folder is
+        # published, see pin_pending
+        self.defer_pins = defer_pins
+        self.pending_pins = []
+        self._hash_index = None
+
+    def __getstate__(self):
+        # the StationSet sets itself as dm again when it is rebuilt, e.g. in a transform worker
+        state = self.__dict__.copy()
+        state.pop("dm", None)
+        # holds a lock, it is opened again on first use
+        state["_hash_index"] = None
+        return state
+
+    def list_directory(self, cid):
+        return self.list_directory_files(cid)
 
     def has_existing_file(self, filepath) -> bool:
         pass
 
-    def _read_hashes_file(self, path, encoding='utf-8'):
-        self.dm.log.info(f"reading ipfs hash from {path}")
-        with open(path, 'r', encoding=encoding) as f:
-            return json.load(f)
-
-    def _create_empty_hashes_file(self, path, encoding='utf-8'):
-        self.dm.log.info(
-            f"could not read hash file, creating a new one in {path}")
-        # Create Directory
-        try:
-            os.makedirs(self.HASHES_OUTPUT_ROOT)
-        except FileExistsError:
-            # directory already exists
-            pass
-
-        # Create File with empty dict
-        with open(path, 'w+', encoding=encoding) as f:
-            json.dump({}, f, sort_keys=True, ensure_ascii=False, indent=4)
-        return {}
-
-    @staticmethod
-    def _append_hash_in_hashes(hashes, content, key):
-        hashes[key] = content
-        return hashes
+    @property
+    def hash_index(self) -> HashIndex:
+        """
+        The journal of published hashes, started from the legacy heads.json and history.json if they exist
+        """
+        if self._hash_index is None:
+            self._hash_index = HashIndex(self.HASH_INDEX_PATH, self.HASH_HEADS_PATH, self.HASH_HISTORY_PATH)
+        return self._hash_index
 
-    def _append_hash_in_history_hashes(self, hashes, content):
-        return self._append_hash_in_hashes(hashes, content, f"{self.dm}_{self.dm.today_with_time.date().strftime('%Y%m%d')}")
+    def _heads_key(self) -> str:
+        return f"{self.dm}"
 
-    def _append_hash_in_heads_hashes(self, hashes, content):
-        return self._append_hash_in_hashes(hashes, content, f"{self.dm}")
+    def _history_key(self) -> str:
+        return f"{self.dm}_{self.dm.today_with_time.date().strftime('%Y%m%d')}"
 
-    def _write_in_hashes_file(self, hash_ipfs, hash_path, encoding='utf-8'):
-        with open(hash_path, "w", encoding=encoding) as fp:
-            json.dump(hash_ipfs, fp, sort_keys=True,
-                      ensure_ascii=False, indent=4)
+    def _record_hashes(self, heads: dict = None, history: dict = None) -> None:
+        self.hash_index.record(heads, history)
+        if self.export_legacy_hashes:
+            self.hash_index.export_legacy()
 
     def _write_hash_in_hashes_file(self, directory_hash):
         try:
-            heads_hashes = self._read_hashes_file(self.HASH_HEADS_PATH)
-        except FileNotFoundError:
-            try:
-                heads_hashes = self._create_empty_hashes_file(
-                    self.HASH_HEADS_PATH)
-            except IOError as e:
-                self.dm.log.error(
-                    "I/O error({0}): {1}".format(e.errno, e.strerror))
-                raise e
-            except Exception as e:
-                self.dm.log.error("Unexpected error writing heads hashes")
-                raise e
-
-        try:
-            history_hashes = self._read_hashes_file(self.HASH_HISTORY_PATH)
-        except FileNotFoundError:
-            try:
-                history_hashes = self._create_empty_hashes_file(
-                    self.HASH_HISTORY_PATH)
-            except IOError as e:
-                self.dm.log.error(
-                    "I/O error({0}): {1}".format(e.errno, e.strerror))
-                raise e
-            except Exception as e:
-                self.dm.log.error("Unexpected error writing history hashes")
-                raise e
-
-        heads_hashes = self._append_hash_in_heads_hashes(
-            heads_hashes, directory_hash)
-        history_hashes = self._append_hash_in_history_hashes(
-            history_hashes, directory_hash)
-
-        self._write_in_hashes_file(heads_hashes, self.HASH_HEADS_PATH)
-        self._write_in_hashes_file(history_hashes, self.HASH_HISTORY_PATH)
+            self._record_hashes({self._heads_key(): directory_hash}, {self._history_key(): directory_hash})
+        except IOError as e:
+            self.dm.log.error(
+                "I/O error({0}): {1}".format(e.errno, e.strerror))
+            raise e
 
     def write(self, file_name: str, content, encoding='utf-8', **kwargs):
         # check if exist first
         # check if key exist
+        return self.write_many({file_name: content}, encoding)[file_name]
 
-        # read locally in heads.json
-        with open(self.HASH_HEADS_PATH, encoding=encoding) as fp:
-            self.dm.log.info(f"reading ipfs hash from {self.HASH_HEADS_PATH}")
-            hash_ipfs = json.load(fp)
+    def write_many(self, contents: dict, encoding='utf-8') -> dict:
+        """
+        Put several files (file name -> dict or DataFrame) on IPFS concurrently and record their hashes in the hash
+        index with a single append. Returns file name -> hash
+        """
+        file_names = [file_name for file_name in contents if not isinstance(contents[file_name], pd.DataFrame)]
+        hashes = dict(zip(file_names, self.ipfs_io.put_many(
+            [self._content_bytes(contents[file_name]) for file_name in file_names], self.should_pin)))
+        self._defer_pins(hashes.values())
+        for file_name, content in contents.items():
+            if isinstance(content, pd.DataFrame):
+                hashes[file_name] = self.put_dataframe(content)
+        self._record_hashes({f"{self.dm}_{self.dm.today_with_time.date()}_{file_name}": file_hash
+                             for file_name, file_hash in hashes.items()})
+        return hashes
 
+    def _content_bytes(self, content) -> bytes:
         if isinstance(content, dict):
-            hash_ipfs[f"{self.dm}_{self.dm.today_with_time.date()}_{file_name}"] = self.ipfs_io.ipfs_put(
-                self.ipfs_io.json_to_bytes(content))
-        elif isinstance(content, pd.DataFrame):
-            print('content is dataframe')
-            # jason = {'csv': self.ipfs_io.csv_to_bytes(content.to_csv(index=False))}
-            jason = {'csv': content.to_csv(index=False)}
-
-            # converts to string
-            y = json.dumps(jason)
-
-            # converts to bytes
-            p = bytes(y, encoding="utf-8")
-            hash_ipfs[f"{self.dm}_{self.dm.today_with_time.date()}_{file_name}"] = self.ipfs_io.ipfs_put(
-                p)
-            # hash_ipfs[f"{self.dm}_{self.dm.today_with_time.date()}_{file_name}"] = self.ipfs_io.ipfs_put(bytes(content.to_csv(index=False), encoding='utf-8'))
+            return self.ipfs_io.json_to_bytes(content)
         else:
             raise Exception("Content file not identified")
 
-        # write locally in heads.json
-        with open(self.HASH_HEADS_PATH, "w", encoding=encoding) as fp:
-            json.dump(hash_ipfs, fp, sort_keys=True,
-                      ensure_ascii=False, indent=4)
+    def put_dataframe(self, dataframe: pd.DataFrame, time_column: str = "dt") -> str:
+        """
+        Put a DataFrame on IPFS as parquet chunks of consecutive rows, each a raw block of at most
+        IPFSIO.MAX_BLOCK_SIZE, linked from a dag-cbor manifest that records the time range of every chunk.
+        Rows are sorted by time_column when there is one. Returns the hash of the manifest, see `read_dataframe`
+        """
+        has_time = time_column in dataframe.columns
+        if has_time:
+            dataframe = dataframe.sort_values(time_column, kind="stable")
+        chunks = parquet_chunks(dataframe, IPFSIO.MAX_BLOCK_SIZE)
+        cids = self.ipfs_io.map_concurrently(lambda data: self.ipfs_io.ipfs_block_put(data, self.should_pin),
+                                             [data for _, data in chunks])
+        manifest = {
+            "format": "parquet",
+            "columns": [str(column) for column in dataframe.columns],
+            "rows": len(dataframe),
+            "time column": time_column if has_time else None,
+            "chunks": [
+                {
+                    "rows": len(rows),
+                    "size": len(data),
+                    "start": str(rows[time_column].iloc[0]) if has_time and len(rows) else None,
+                    "end": str(rows[time_column].iloc[-1]) if has_time and len(rows) else None,
+                    "data": {"/": cid},
+                }
+                for (rows, data), cid in zip(chunks, cids)
+            ]
+        }
+        return self._defer_pins([self.ipfs_io.ipfs_put(self.ipfs_io.json_to_bytes(manifest), self.should_pin)])[0]
+
+    @property
+    def should_pin(self) -> bool:
+        return not self.defer_pins
+
+    def _defer_pins(self, cids) -> list[str]:
+        cids = list(cids)
+        if self.defer_pins:
+            self.pending_pins.extend(cids)
+        return cids
+
+    def pin_pending(self) -> list[str]:
+        """
+        Pin the roots written since the last call with defer_pins, recursively so everything they link is pinned
+        too, in batches of IPFSIO.PIN_BATCH_SIZE with retries, see IPFSIO.pin_many
+        """
+        if not self.pending_pins:
+            return []
+        self.dm.log.info(f"pinning {len(self.pending_pins)} roots")
+        pinned = self.ipfs_io.pin_many(
+            self.pending_pins,
+            on_progress=lambda done, total: self.dm.log.info(f"pinned {done} of {total} roots")
+        )
+        self.pending_pins = []
+        return pinned
+
+    def read_dataframe(self, cid, start=None, end=None, columns: list[str] = None) -> pd.DataFrame:
+        """
+        Read a DataFrame written by `put_dataframe`, only fetching the chunks whose time range overlaps `start` and
+        `end` (inclusive, anything pandas.Timestamp accepts) and keeping the rows within them.
+        DataFrames written by older versions as csv wrapped in json are read too
+        """
+        manifest = self.ipfs_io.ipfs_get(cid)
+        if "csv" in manifest:
+            dataframe = pd.read_csv(io.StringIO(manifest["csv"]))
+            return dataframe if columns is None else dataframe[columns]
+        time_column = manifest["time column"]
+        start = None if start is None or time_column is None else pd.Timestamp(start)
+        end = None if end is None or time_column is None else pd.Timestamp(end)
+        chunks = [chunk for chunk in manifest["chunks"]
+                  if chunk["start"] is None
+                  or ((start is None or pd.Timestamp(chunk["end"]) >= start)
+                      and (end is None or pd.Timestamp(chunk["start"]) <= end))]
+        read_columns = columns
+        if columns is not None and (start is not None or end is not None) and time_column not in columns:
+            read_columns = columns + [time_column]
+        blocks = self.ipfs_io.map_concurrently(self.ipfs_io.ipfs_block_get,
+                                               [self.ipfs_io.cid_string(chunk["data"]) for chunk in chunks])
+        if blocks:
+            dataframe = pd.concat([pq.read_table(io.BytesIO(block), columns=read_columns).to_pandas()
+                                   for block in blocks], ignore_index=True)
+        else:
+            dataframe = pd.DataFrame(columns=read_columns if read_columns else manifest["columns"])
+        if start is not None or end is not None:
+            times = pd.to_datetime(dataframe[time_column])
+            keep = pd.Series(True, index=dataframe.index)
+            if start is not None:
+                keep &= times >= start
+            if end is not None:
+                keep &= times <= end
+            dataframe = dataframe[keep].reset_index(drop=True)
+        return dataframe if columns is None else dataframe[columns]
+
+    def put_local_file(self, local_path: str, filepath: str = None):
+        """
+        Add a single local file to IPFS and return its hash. IPFS content is addressed by hash, so filepath is unused.
+        With defer_pins the file is added unpinned and pinned by the next `pin_pending`
+        """
+        with open(local_path, 'rb') as f:
+            return self._defer_pins([self.ipfs_io.ipfs_add(f, self.should_pin)])[0]
 
     def read(self, cid, **kwargs):
         file_content = self.ipfs_io.ipfs_get(cid)
@@ -445,13 +1186,16 @@ class IPFS(StoreInterface):
         return self.ipfs_io.ipfs_ls(cid)
 
     def latest_directory_hash(self, key, encoding='utf-8'):
-        try:
-            heads_hash = self._read_hashes_file(self.HASH_HEADS_PATH)
-            return heads_hash[key]
-        except (FileNotFoundError, IOError) as e:
-            raise e
-        except KeyError as e:
-            raise e
+        """
+        The latest hash published for key, raises KeyError if there is none
+        """
+        return self.hash_index.head(key)
+
+    def directory_hash_history(self, key) -> dict:
+        """
+        The dated directory hashes published for key, e.g. {"bom_20230801": "bafy..."}
+        """
+        return self.hash_index.history(f"{key}_")
 
     def json_key(self, append_date=False):
         '''
@@ -470,25 +1214,40 @@ class IPFS(StoreInterface):
         return key
 
     def cp_local_folder_to_remote(self):
-        local_path = self.dm.file_handler.output_path()
+        return self.cp_folder_to_remote(self.dm.file_handler.PROCESSED_DATA_PATH)
 
+    def cp_folder_to_remote(self, local_path: str, relative_path: str = None):
+        """
+        Add the files of local_path to IPFS and record the hash of the directory (or DAG root with the "dag" and
+        "car" layouts) in the hash index. The "car" layout keeps the archive next to local_path, as local_path.car.
+        IPFS content is addressed by hash, so relative_path is unused.
+        Files are streamed to the node one at a time, see IPFSIO.ipfs_add_directory
+        """
         try:
-            # copy files to ipfs
-            files = []
-            for filename in os.listdir(local_path):
-                heads_file = os.path.join(local_path, filename)
-                files.append(open(heads_file, 'r'))
-            directory_hash = self.ipfs_io.ipfs_add_multiple_files_wrapping_with_directory(
-                files)
+            paths = [os.path.join(local_path, filename) for filename in sorted(os.listdir(local_path))]
+            paths = [path for path in paths if os.path.isfile(path)]
+            if self.layout == "dag":
+                directory_hash = self.publish_dag(paths)
+            elif self.layout == "car":
+                directory_hash = self.publish_car(paths, f"{os.path.normpath(local_path)}.car")
+            else:
+                directory_hash = self.ipfs_io.ipfs_add_directory(
+                    paths,
+                    on_added=lambda entry: self.dm.log.debug(f"added {entry['Name']} to IPFS as {entry['Hash']}"),
+                    should_pin=self.should_pin
+                )
             self.dm.log.info(
-                f"files created in IPFS with directory hash {directory_hash}")
+                f"{len(paths)} files created in IPFS with directory hash {directory_hash}")
+            self._defer_pins([directory_hash])
+            self.pin_pending()
 
             # set hashes in file
             # ToDo: Check if hashes/heads.json exist, if not create it with an empty dict
             self._write_hash_in_hashes_file(directory_hash)
 
             self.dm.log.info(
-                f"directory hash written in {self.HASH_HEADS_PATH}")
+                f"directory hash written in {self.HASH_INDEX_PATH}")
+            return directory_hash
         except IOError as e:
             self.dm.log.error(
                 "I/O error({0}): {1}".format(e.errno, e.strerror))
@@ -497,6 +1256,168 @@ class IPFS(StoreInterface):
             self.dm.log.error("Unexpected error writing station file")
             raise e
 
+    def publish_dag(self, paths: list[str]) -> str:
+        """
+        Publish files as a dag-cbor DAG of per file entries (cid, sha256 and size) and return its root.
+
+        The DAG is patched from the previous root of this set: only files whose sha256 changed are added to the
+        node and, once the files are split into shards, only the shards holding changed entries are put again,
+        so a publish costs in proportion to what changed. Files missing locally keep their previous entry.
+        The root records the previous root in "previous hash", like metadata.json
+        """
+        previous_root = self._previous_dag_root()
+        entries, shards = self._dag_entries_and_shards(previous_root) if previous_root else ({}, {})
+        hashes = self.ipfs_io.map_concurrently(file_sha256, paths)
+        changed = [(path, sha256) for path, sha256 in zip(paths, hashes)
+                   if entries.get(os.path.basename(path), {}).get("sha256") != sha256]
+        cids = self.ipfs_io.map_concurrently(self._put_file, [path for path, _ in changed])
+        for (path, sha256), cid in zip(changed, cids):
+            entries[os.path.basename(path)] = {"cid": cid, "sha256": sha256, "size": os.path.getsize(path)}
+        self.dm.log.info(f"{len(changed)} of {len(paths)} files changed since {previous_root}")
+
+        return self._build_dag(
+            entries, previous_root, shards,
+            lambda nodes: self.ipfs_io.put_many([self.ipfs_io.json_to_bytes(node) for node in nodes], self.should_pin)
+        )
+
+    def _build_dag(self, entries: dict, previous_root: str | None, shards: dict, put_nodes) -> str:
+        """
+        Build the root (and shards) of a DAG of entries and return the root's CID. `put_nodes` stores a list of
+        dag-json nodes and returns their CIDs, shards found unchanged in `shards` are not stored again
+        """
+        root = {"type": self.DAG_TYPE, "previous hash": previous_root, "count": len(entries)}
+        if len(entries) <= self.DAG_SHARD_THRESHOLD:
+            root["files"] = {name: self._dag_entry_json(entry) for name, entry in sorted(entries.items())}
+        else:
+            shard_entries = {}
+            for name, entry in entries.items():
+                shard_entries.setdefault(self._dag_shard(name), {})[name] = entry
+            # shards whose entries are all the same as before keep their CID
+            new_shards = sorted(prefix for prefix, shard in shard_entries.items()
+                                if prefix not in shards or shards[prefix][1] != shard)
+            new_cids = put_nodes([{"files": {
+                name: self._dag_entry_json(entry) for name, entry in sorted(shard_entries[prefix].items())
+            }} for prefix in new_shards])
+            shard_cids = {prefix: shards[prefix][0] for prefix in shard_entries if prefix in shards}
+            shard_cids.update(zip(new_shards, new_cids))
+            root["shards"] = {prefix: {"/": cid} for prefix, cid in sorted(shard_cids.items())}
+        return put_nodes([root])[0]
+
+    def publish_car(self, paths: list[str], car_path: str) -> str:
+        """
+        Publish files with a single `dag/import` of a CAR archive built locally at car_path, which is kept.
+
+        The archive holds the same DAG as `publish_dag` builds, but every block and CID is computed in-process
+        (files are hashed concurrently) instead of sent to the node one request at a time. Unlike publish_dag it
+        holds every file so the archive is complete by itself, files over a block are split into raw "chunks"
+        """
+        previous_root = self._previous_dag_root()
+        with CARWriter(car_path) as car:
+            def file_entry(path: str) -> dict:
+                sha256 = hashlib.sha256()
+                chunks = []
+                with open(path, "rb") as f:
+                    for chunk in iter(lambda: f.read(IPFSIO.MAX_BLOCK_SIZE), b""):
+                        sha256.update(chunk)
+                        chunks.append(self.ipfs_io.cid(chunk, "raw"))
+                        car.add(chunks[-1], chunk)
+                if not chunks:
+                    chunks.append(self.ipfs_io.cid(b"", "raw"))
+                    car.add(chunks[-1], b"")
+                entry = {"sha256": sha256.hexdigest(), "size": os.path.getsize(path)}
+                if len(chunks) == 1:
+                    entry["cid"] = chunks[0]
+                else:
+                    entry["chunks"] = chunks
+                return entry
+
+            def put_nodes(nodes: list[dict]) -> list[str]:
+                cids = []
+                for node in nodes:
+                    data = dag_cbor.encode(IPFSIO.dag_json_to_ipld(node))
+                    cids.append(self.ipfs_io.cid(data, "dag-cbor"))
+                    car.add(cids[-1], data)
+                return cids
+
+            entries = dict(zip([os.path.basename(path) for path in paths],
+                               self.ipfs_io.map_concurrently(file_entry, paths)))
+            root = self._build_dag(entries, previous_root, {}, put_nodes)
+            car.roots = [root]
+        self.dm.log.info(f"built {car_path} with {len(car)} blocks ({car.size} bytes) for {len(paths)} files")
+        self.ipfs_io.dag_import(car_path, pin_roots=self.should_pin)
+        return root
+
+    def _put_file(self, path: str) -> str:
+        """
+        Add a single file, as a raw block when it fits in one
+        """
+        if os.path.getsize(path) <= IPFSIO.MAX_BLOCK_SIZE:
+            with open(path, "rb") as f:
+                return self.ipfs_io.ipfs_block_put(f.read(), self.should_pin)
+        with open(path, "rb") as f:
+            return self.ipfs_io.ipfs_add(f, self.should_pin)
+
+    @staticmethod
+    def _dag_entry_json(entry: dict) -> dict:
+        if "chunks" in entry:
+            return {**entry, "chunks": [{"/": cid} for cid in entry["chunks"]]}
+        return {**entry, "cid": {"/": entry["cid"]}}
+
+    @staticmethod
+    def _dag_shard(name: str) -> str:
+        return hashlib.sha256(name.encode("utf-8")).hexdigest()[:2]
+
+    def _previous_dag_root(self) -> str | None:
+        try:
+            return self.latest_directory_hash(self._heads_key())
+        except KeyError:
+            return None
+
+    def _dag_entries_and_shards(self, root_cid: str) -> tuple[dict, dict]:
+        """
+        The entries of a DAG written by publish_dag (name -> cid, sha256 and size) and its shards
+        (prefix -> (cid, entries)). Empty for anything else, e.g. a directory published with the "directory" layout
+        """
+        try:
+            if CID.decode(root_cid).codec.name != "dag-cbor":
+                return {}, {}
+        except ValueError:
+            return {}, {}
+        root = self.ipfs_io.ipfs_get(root_cid)
+        if not isinstance(root, dict) or root.get("type") != self.DAG_TYPE:
+            return {}, {}
+
+        def decode_entry(entry: dict) -> dict:
+            if "chunks" in entry:
+                return {**entry, "chunks": [self.ipfs_io.cid_string(cid) for cid in entry["chunks"]]}
+            return {**entry, "cid": self.ipfs_io.cid_string(entry["cid"])}
+
+        def decode(files: dict) -> dict:
+            return {name: decode_entry(entry) for name, entry in files.items()}
+
+        if "files" in root:
+            return decode(root["files"]), {}
+        prefixes = sorted(root["shards"])
+        shard_cids = [self.ipfs_io.cid_string(root["shards"][prefix]) for prefix in prefixes]
+        shards = {prefix: (cid, decode(shard["files"]))
+                  for prefix, cid, shard in zip(prefixes, shard_cids, self.ipfs_io.get_many(shard_cids))}
+        entries = {}
+        for _, shard_entries in shards.values():
+            entries.update(shard_entries)
+        return entries, shards
+
+    def dag_entries(self, root_cid: str) -> dict:
+        """
+        The files of a DAG written by publish_dag or publish_car, name -> cid (or chunks), sha256 and size
+        """
+        return self._dag_entries_and_shards(root_cid)[0]
+
+    def read_dag_file(self, root_cid: str, name: str) -> bytes:
+        entry = self.dag_entries(root_cid)[name]
+        if "chunks" in entry:
+            return b"".join(self.ipfs_io.map_concurrently(self.ipfs_io.ipfs_block_get, entry["chunks"]))
+        return self.ipfs_io.ipfs_cat_bytes(entry["cid"])
+
     def latest_hash(self):
         key = self.json_key()
         directory_cid = self.latest_directory_hash(key)
@@ -16,6 +16,8 @@ class MetadataHandler:
         self.store = store
         self.local_store = local_store
         self.log = log
+        # station -> old station geojson (None if there is none), filled by prefetch_old_station_geo_metadata
+        self.prefetched_station_geo_metadata = {}
 
     def get_dict(self, dict_folder, dict_name: str = None):
         if dict_name is None:
@@ -46,6 +48,22 @@ class MetadataHandler:
         old_metadata = self.get_metadata(f'{station}.geojson', store)
         return old_metadata
 
+    def prefetch_old_station_geo_metadata(self, stations: list[str], store=None) -> None:
+        """
+        Fetch the old geojson of every station in one concurrent batch. Each is served from memory, once, by
+        get_old_station_geo_metadata instead of being requested from the store station by station
+        """
+        if store is None:
+            store = self.store
+        filepaths = {os.path.join(self.file_handler.relative_path, f'{station}.geojson'): station
+                     for station in stations}
+        contents = store.read_many(list(filepaths))
+        for filepath, station in filepaths.items():
+            self.prefetched_station_geo_metadata[station] = contents.get(filepath)
+        self.log.info(
+            f"[metadata_handler.prefetch_old_station_geo_metadata] prefetched {len(contents)} of "
+            f"{len(filepaths)} old station metadata")
+
     def get_old_metadata_by_store(self, store=None):
         if store is None:
             store = self.store
@@ -75,9 +93,12 @@ class MetadataHandler:
             self,
             station_id: str
     ) -> dict:
-        # Get old station metadata using current store
-        old_station_metadata = self.get_old_station_geo_metadata_by_store(
-            station_id)
+        if station_id in self.prefetched_station_geo_metadata:
+            old_station_metadata = self.prefetched_station_geo_metadata.pop(station_id)
+        else:
+            # Get old station metadata using current store
+            old_station_metadata = self.get_old_station_geo_metadata_by_store(
+                station_id)
 
         # if old_station_metadata is None:
         #     # Get old station metadata using local_store (Look into processed_data folder)
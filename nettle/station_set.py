@@ -14,9 +14,21 @@ from .errors.custom_errors import MetadataInvalidException
 from .errors.custom_errors import FailedStationException
 from .utils.date_range_handler import DateRangeHandler
 from .utils.log_info import LogInfo
+from .utils.transform_pool import TransformPool
+from .utils.transform_pool import transform_station
+from .utils.transform_manifest import TransformManifest
+from .utils.pipeline import PipelineStage
+from .utils.pipeline import StationPipeline
+from .utils.metrics import StageTimer
+from .utils.metrics import summarize_timings
+from .utils.metrics import write_metrics_report
 from .io.store import Local
 from .io.store import S3
+from .io.store import compression_suffix
+from .io.store import strip_compression_suffix
 from .io.file_handler import FileHandler
+from .io.fetcher import HTTPFetcher
+from .io.disk_cache import DiskCache
 from contextlib import contextmanager
 from copy import deepcopy
 from abc import ABC, abstractmethod
@@ -27,7 +39,6 @@ import pandas as pd
 import time
 import re
 import json
-import multiprocessing
 # manually add in imperial units (thanks USA)
 import astropy.units as astropy_units
 astropy_units.add_enabled_units(units=astropy_units.imperial)
@@ -41,6 +52,8 @@ class StationSet(ABC):
     The base class contains all the tools required to write an ETL for a station-style dataset. This is any dataset
     that can be broken up in to groups like stations, that share the same data station to station.
     '''
+    # cache of downloaded source files, shared by every set under RAW_DATA_ROOT
+    HTTP_CACHE_FOLDER = '.http_cache'
 
     def __init__(
             self,
@@ -51,13 +64,59 @@ class StationSet(ABC):
             custom_dict_path=None,
             historical_store=None,
             data_lake_store=None,
+            transform_workers=None,
+            transform_chunk_size=None,
+            http_cache_max_bytes=None,
+            skip_unchanged_stations=False,
+            append_remote_history=False,
+            processed_file_format='csv',
+            string_dtype=None,
+            processed_file_compression=None,
     ):
         '''
         Set member variables to defaults.
         '''
+        # Keep the constructor arguments so worker processes can build their own copy of this set
+        self._init_kwargs = {
+            "log": log,
+            "custom_relative_data_path": custom_relative_data_path,
+            "store": store,
+            "multithread_transform": multithread_transform,
+            "custom_dict_path": custom_dict_path,
+            "historical_store": historical_store,
+            "data_lake_store": data_lake_store,
+            "transform_workers": transform_workers,
+            "transform_chunk_size": transform_chunk_size,
+            "http_cache_max_bytes": http_cache_max_bytes,
+            "skip_unchanged_stations": skip_unchanged_stations,
+            "append_remote_history": append_remote_history,
+            "processed_file_format": processed_file_format,
+            "string_dtype": string_dtype,
+            "processed_file_compression": processed_file_compression,
+        }
         # Establish date today just incase etl runs over midnight
         self.today_with_time = datetime.datetime.now()
         self.multithread_transform = multithread_transform
+        self.transform_workers = transform_workers
+        self.transform_chunk_size = transform_chunk_size
+        self.http_cache_max_bytes = http_cache_max_bytes
+        self.skip_unchanged_stations = skip_unchanged_stations
+        self.append_remote_history = append_remote_history
+        # 'csv' or 'parquet', the format processed station files are written in
+        self.processed_file_format = processed_file_format
+        # None, 'gzip' or 'zstd', the codec processed station files are compressed with, e.g. KALUMBURU.csv.gz
+        if processed_file_compression is not None and processed_file_format != 'csv':
+            raise ValueError(f"processed_file_compression only applies to csv files, {processed_file_format} files "
+                             f"are compressed internally (see the stores' parquet_compression)")
+        self.processed_file_compression = processed_file_compression
+        # time spent in each stage of single_station_transform, see write_transform_metrics
+        self.stage_timer = StageTimer()
+        # station_id -> reason, for stations that failed in check_station_parse_loop
+        self.failed_stations = {}
+        # station_id -> reason, for stations that failed in check_station_extract_loop. Kept apart from
+        # failed_stations so an extract failure is never reported as the outcome of the station's transform
+        self.failed_extracts = {}
+        self.transform_results = []
         self.custom_dict_path = custom_dict_path
         self.log = LogInfo(log, self.name())
         self.BASE_OUTPUT_METADATA = BASE_OUTPUT_METADATA
@@ -71,6 +130,9 @@ class StationSet(ABC):
             relative_path = custom_relative_data_path
         self.store = store
         self.store.log = self.log
+        if self.store.name() == 'ipfs':
+            # the IPFS store keys its hashes by this set and logs through it
+            self.store.dm = self
         if historical_store:
             self.historical_store = historical_store
             self.historical_store.log = self.log
@@ -82,6 +144,12 @@ class StationSet(ABC):
         self.local_store = Local(
             log=self.log
         )
+        if string_dtype is not None:
+            # e.g. "string[pyarrow]", read string columns into arrow memory instead of one python object per cell
+            for station_store in [self.store, self.local_store, getattr(self, 'historical_store', None),
+                                  getattr(self, 'data_lake_store', None)]:
+                if hasattr(station_store, 'string_dtype'):
+                    station_store.string_dtype = string_dtype
         self.date_range_handler = DateRangeHandler()
         self.file_handler = FileHandler(relative_path=relative_path)
         self.metadata_handler = MetadataHandler(self.file_handler,
@@ -96,6 +164,17 @@ class StationSet(ABC):
         self.STATION_DICTIONARY = self.metadata_handler.get_station_info()
         self.DATA_DICTIONARY = self.metadata_handler.get_data_dict()
 
+        # raw file hashes of the last transform, used to skip stations whose raw data did not change
+        self.transform_manifest = TransformManifest(
+            self.file_handler.RAW_DATA_PATH,
+            TransformManifest.fingerprint_of(self.DATA_DICTIONARY, self.STATION_DICTIONARY)
+        ) if skip_unchanged_stations else None
+        # station_id -> manifest entry of stations transformed by this process, collected by transform_station
+        self.pending_manifest_entries = {}
+        # formatted station id -> feature of every station finished (or skipped as unchanged) in this run,
+        # merged with the old stations.geojson by generate_combined_station_metadata
+        self.station_features = {}
+
     def __str__(self):
         return self.name()
 
@@ -108,6 +187,13 @@ class StationSet(ABC):
     def __hash__(self):
         return hash(str(self))
 
+    def worker_init_kwargs(self) -> dict:
+        """
+        The keyword arguments used to build this set again inside a transform worker process.
+        Override this if your child class takes extra constructor arguments.
+        """
+        return dict(self._init_kwargs)
+
     def default_dict_path(self):
         """
         When running on prefect this will require
@@ -261,6 +347,36 @@ class StationSet(ABC):
     #####################################################################
     # EXTRACT METHODS
     #####################################################################
+    def fetcher(self, refresh: bool = False) -> HTTPFetcher:
+        """
+        A shared, pooled HTTP client for extract. Use `fetch_many` to download every station/month file of a
+        run as one batch instead of one request at a time
+        """
+        if refresh or not hasattr(self, "_fetcher"):
+            cache = None
+            if self.http_cache_max_bytes:
+                cache = DiskCache(os.path.join(FileHandler.RAW_DATA_ROOT, self.HTTP_CACHE_FOLDER),
+                                  max_bytes=self.http_cache_max_bytes)
+            self._fetcher = HTTPFetcher(log=self.log, cache=cache)
+        return self._fetcher
+
+    def stations_to_extract(self) -> list:
+        """
+        The station ids fed to `pipeline()`. Defaults to every station in STATION_DICTIONARY
+        """
+        return list(self.STATION_DICTIONARY.keys())
+
+    def extract_station(self, station_id: str, **kwargs) -> pd.DataFrame | None:
+        """
+        Download the raw data of a single station. Implement this to be able to use `pipeline()`.
+
+            Returns:
+                (pd.DataFrame | None): The raw station dataframe, it will be saved with save_raw_dataframe.
+                Return None if the station was already saved or has nothing new.
+        """
+        raise NotImplementedError(
+            f"[extract_station] {self.name()} must implement extract_station to run as a pipeline")
+
     def save_raw_dataframe(
             self,
             raw_dataframe: pd.DataFrame,
@@ -282,9 +398,100 @@ class StationSet(ABC):
         try:
             yield
         except FailedStationException as fse:
+            self.failed_extracts[station_id] = str(fse)
             self.log.error(
                 f"[extract] update Local Station failed for {station_id}: {str(fse)}")
 
+    #####################################################################
+    # PIPELINE
+    #####################################################################
+    def pipeline(
+            self,
+            extract_threads: int = 4,
+            transform_threads: int = 1,
+            upload_threads: int = 4,
+            queue_size: int = 32,
+            **kwargs
+    ) -> None:
+        """
+        Run extract, transform and load station by station instead of one phase after the other.
+
+        Each station goes through the extract, transform (which validates the processed dataframe and station
+        metadata) and upload stages, connected by bounded queues, so downloads, processing and uploads overlap.
+        The combined metadata files are generated and uploaded once every station has been through.
+        Requires `extract_station` to be implemented.
+        """
+        if type(self).extract_station is StationSet.extract_station:
+            raise NotImplementedError(
+                f"[pipeline] {self.name()} must implement extract_station to run as a pipeline")
+        stages = [
+            PipelineStage('extract', lambda station_id: self.pipeline_extract_station(station_id, **kwargs),
+                          extract_threads),
+            PipelineStage('transform', lambda station_id: self.pipeline_transform_station(station_id, **kwargs),
+                          transform_threads),
+        ]
+        # IPFS publishes the whole folder as one directory, it is added once at the end instead
+        upload_per_station = self.store.name() != 'ipfs'
+        if upload_per_station:
+            stages.append(PipelineStage('upload', self.pipeline_upload_station, upload_threads))
+
+        self.log.info("[pipeline] beginning pipelined extract, transform and load")
+        self.snapshot_store_listing()
+        stations = self.stations_to_extract()
+        self.prefetch_station_metadata(stations)
+        pipeline = StationPipeline(stages, queue_size=queue_size, log=self.log)
+        self.transform_results = pipeline.run(stations)
+        self.log_transform_results(self.transform_results)
+        self.save_combined_metadata_files(**kwargs)
+        # the transform threads all record into this set's timer
+        self.write_transform_metrics(self.stage_timer.drain())
+
+        if upload_per_station:
+            for file_name in [MetadataHandler.METADATA_FILE_NAME, MetadataHandler.STATION_METADATA_FILE_NAME]:
+                self.upload_processed_file(file_name)
+        else:
+            self.store.cp_local_folder_to_remote()
+        if self.store.name() == 'ipfs':
+            # with defer_pins, everything uploaded is pinned in one batch once the whole set is loaded
+            self.store.pin_pending()
+
+    def pipeline_extract_station(self, station_id: str, **kwargs) -> None:
+        with self.etl_print_runtime(station_id, 'extract'), self.check_station_extract_loop(station_id):
+            raw_dataframe = self.extract_station(station_id, **kwargs)
+            if raw_dataframe is not None:
+                self.save_raw_dataframe(raw_dataframe, station_id)
+        error = self.failed_extracts.pop(station_id, None)
+        if error is not None:
+            raise FailedStationException(error)
+        # the local store logs and swallows write errors, so check the raw file really is there
+        raw_filepath = self.raw_station_path(station_id)
+        if not self.local_store.has_existing_file(raw_filepath):
+            raise FailedStationException(f"no raw data saved to {raw_filepath}")
+
+    def pipeline_transform_station(self, station_id: str, **kwargs) -> None:
+        with self.etl_print_runtime(station_id):
+            self.single_station_transform(station_id, **kwargs)
+        error = self.failed_stations.pop(station_id, None)
+        if error is not None:
+            raise FailedStationException(error)
+
+    def pipeline_upload_station(self, station_id: str) -> None:
+        for file_name in self.processed_station_file_names(station_id):
+            if self.has_staged_append(file_name):
+                self.append_staged_file(file_name)
+            else:
+                self.upload_processed_file(file_name)
+
+    def processed_station_file_names(self, station_id: str) -> list[str]:
+        return [self.station_file_name(station_id), f"{self.station_name_formatter(station_id)}.geojson"]
+
+    def upload_processed_file(self, file_name: str) -> None:
+        filepath = self.store.put_local_file(
+            os.path.join(self.file_handler.PROCESSED_DATA_PATH, file_name),
+            os.path.join(self.file_handler.relative_path, file_name)
+        )
+        self.log.info(f"[load] uploaded {file_name} to {filepath}")
+
     #####################################################################
     # TRANSFORM
     #####################################################################
@@ -292,19 +499,32 @@ class StationSet(ABC):
         """
         The T in ETL, where stations are processed individually and saved locally in their final format
         """
+        self.snapshot_store_listing()
         stations = self.get_stations_to_transform()
+        if self.transform_manifest is not None:
+            stations = self.filter_unchanged_stations(stations)
         if self.multithread_transform:
             self.log.info("Beginning multiprocessed transform of csvs")
-            with multiprocessing.get_context("spawn").Pool(max(1, multiprocessing.cpu_count() - 2)) as pool:
-                for res in pool.imap_unordered(self.single_station_transform, stations):
-                    pass
-            pool.close()
-            pool.join()
+            pool = TransformPool(self, workers=self.transform_workers, chunk_size=self.transform_chunk_size)
+            self.transform_results = pool.run(stations, **kwargs)
         else:
+            self.transform_results = []
+            self.prefetch_station_metadata(stations)
+            # transform_station drains the timer, keep the batch prefetch out of the first station's timings
+            prefetch_timings = self.stage_timer.drain()
             for station_id in stations:
                 with self.etl_print_runtime(station_id):
-                    self.single_station_transform(station_id, **kwargs)
+                    # only FailedStationException is recorded per station, anything else stops the run as before
+                    self.transform_results.append(transform_station(self, station_id, catch_errors=False, **kwargs))
+            self.stage_timer.extend(prefetch_timings)
+        self.log_transform_results(self.transform_results)
+        self.register_station_features(self.transform_results)
+        if self.transform_manifest is not None:
+            self.update_transform_manifest(self.transform_results)
         self.save_combined_metadata_files(**kwargs)
+        for result in self.transform_results:
+            self.stage_timer.extend(result.timings)
+        self.write_transform_metrics(self.stage_timer.drain())
 
     #####################################################################
     # TRANSFORM METHODS
@@ -313,8 +533,92 @@ class StationSet(ABC):
             self
     ) -> list:
         stations = os.listdir(self.file_handler.RAW_DATA_PATH)
-        # -4 cuts off .csv
-        return [self.station_name_formatter(station[:-4]) for station in stations if '.csv' in station]
+        return [self.station_name_formatter(os.path.splitext(station)[0]) for station in stations if '.csv' in station]
+
+    def station_file_name(self, station_id: str) -> str:
+        """
+        The name of a station's processed data file, e.g. KALUMBURU.csv, KALUMBURU.csv.gz or KALUMBURU.parquet
+        """
+        return (f"{self.station_name_formatter(station_id)}.{self.processed_file_format}"
+                f"{compression_suffix(self.processed_file_compression)}")
+
+    def processed_file_codec(self) -> str | None:
+        """
+        The compression codec of the processed station files, recorded in the "compression" field of metadata.json.
+        Parquet files are compressed internally with the local store's parquet compression
+        """
+        if self.processed_file_compression is not None:
+            return self.processed_file_compression
+        if self.processed_file_format == 'parquet':
+            return self.local_store.parquet_compression
+        return None
+
+    def raw_station_path(self, station_id: str) -> str:
+        return os.path.join(self.file_handler.RAW_DATA_PATH, f"{self.station_name_formatter(station_id)}.csv")
+
+    def filter_unchanged_stations(self, stations: list) -> list:
+        """
+        Drop the stations whose raw file is identical to the one they were last transformed from. Their previous
+        feature is kept to be reused in stations.geojson
+        """
+        changed_stations = []
+        for station_id in stations:
+            if self.transform_manifest.is_unchanged(station_id, self.raw_station_path(station_id)):
+                self.station_features[self.station_name_formatter(station_id)] = \
+                    self.transform_manifest.feature(station_id)
+            else:
+                changed_stations.append(station_id)
+        self.log.info(
+            f"[transform] skipping {len(stations) - len(changed_stations)} unchanged stations, "
+            f"{len(changed_stations)} to transform")
+        return changed_stations
+
+    def record_transform_manifest_entry(self, station_id: str, processed_station_metadata: dict) -> None:
+        formatted_station_id = self.station_name_formatter(station_id)
+        self.pending_manifest_entries[station_id] = TransformManifest.entry(
+            self.raw_station_path(station_id),
+            [self.station_file_name(station_id), f"{formatted_station_id}.geojson"],
+            processed_station_metadata["features"][0]
+        )
+
+    def register_station_features(self, results: list) -> None:
+        """
+        Add the features sent back with the results of transformed stations to the feature registry
+        """
+        for result in results:
+            if result.succeeded and result.feature is not None:
+                self.station_features[self.station_name_formatter(result.station_id)] = result.feature
+
+    def update_transform_manifest(self, results: list) -> None:
+        for result in results:
+            if result.succeeded and result.manifest_entry is not None:
+                self.transform_manifest.record(result.station_id, result.manifest_entry)
+        self.transform_manifest.save()
+        self.log.info(f"[transform] saved transform manifest to {self.transform_manifest.path}")
+
+    def write_transform_metrics(self, timings: dict) -> None:
+        """
+        Log the time spent in each stage of the transform over all stations and write it to a json report and a
+        Prometheus textfile in METRICS_OUTPUT_PATH
+        """
+        summary = summarize_timings(timings)
+        if not summary:
+            return
+        for name, stage in summary.items():
+            self.log.info(
+                f"[transform] stage={name} count={stage['count']} total={stage['total']:.2f} "
+                f"p50={stage['p50']:.3f} p90={stage['p90']:.3f} p99={stage['p99']:.3f} max={stage['max']:.3f}")
+        json_path, prom_path = write_metrics_report(
+            summary, self.file_handler.METRICS_OUTPUT_PATH, 'transform', {'set': self.name()})
+        self.log.info(f"[transform] wrote stage timings to {json_path} and {prom_path}")
+
+    def log_transform_results(self, results: list) -> None:
+        failed = [result for result in results if not result.succeeded]
+        self.log.info(
+            f"[transform] transformed {len(results) - len(failed)} of {len(results)} stations")
+        for result in failed:
+            self.log.warn(
+                f"[transform] station_id={result.station_id} failed: {result.error}")
 
     @contextmanager
     def etl_print_runtime(
@@ -334,32 +638,39 @@ class StationSet(ABC):
         """
         with self.check_station_parse_loop(station_id):
             # read in raw dataframe from raw_data/station_id.csv
-            raw_dataframe = self.read_raw_station_data(station_id, **kwargs)
+            with self.stage_timer.stage('read_raw'):
+                raw_dataframe = self.read_raw_station_data(station_id, **kwargs)
             # get a station-level template for metadata
-            base_station_metadata = self.get_old_or_default_station_geo_metadata(
-                station_id)
-            # augment station-level metadata and process raw dataframe
-            raw_station_metadata, processed_dataframe = self.transform_raw_data(
-                base_station_metadata, raw_dataframe, station_id, **kwargs)
-            # process raw metadata
-            processed_station_metadata = self.transform_raw_metadata(
-                raw_station_metadata, station_id, **kwargs)
+            with self.stage_timer.stage('fetch_old_metadata'):
+                base_station_metadata = self.get_old_or_default_station_geo_metadata(
+                    station_id)
+            with self.stage_timer.stage('transform_raw_data'):
+                # augment station-level metadata and process raw dataframe
+                raw_station_metadata, processed_dataframe = self.transform_raw_data(
+                    base_station_metadata, raw_dataframe, station_id, **kwargs)
+                # process raw metadata
+                processed_station_metadata = self.transform_raw_metadata(
+                    raw_station_metadata, station_id, **kwargs)
             # validate processed dataframe ensuring format is okay (using validators)
-            self.validate_processed_dataframe(processed_dataframe)
+            with self.stage_timer.stage('validate'):
+                self.validate_processed_dataframe(processed_dataframe)
 
             # save processed data to processed_data/station_id.csv
             # return new date range and combined processed dataframe
             new_date_range, combined_processed_dataframe = self.save_processed_data(
                 processed_dataframe, station_id, **kwargs)
             # add date range and data dict to station level metadata
-            self.programmatic_station_metadata_update(
-                processed_dataframe, combined_processed_dataframe, processed_station_metadata, **kwargs)
+            with self.stage_timer.stage('metadata_update'):
+                self.programmatic_station_metadata_update(
+                    processed_dataframe, combined_processed_dataframe, processed_station_metadata, **kwargs)
             # validate station level metadata according to validators
-            self.validate_station_metadata(
-                processed_station_metadata, new_date_range)
+            with self.stage_timer.stage('validate_metadata'):
+                self.validate_station_metadata(
+                    processed_station_metadata, new_date_range)
             # save processed metadata to processed_data/station_id.geojson
-            self.save_processed_station_metadata(
-                processed_station_metadata, station_id, **kwargs)
+            with self.stage_timer.stage('write_metadata'):
+                self.save_processed_station_metadata(
+                    processed_station_metadata, station_id, **kwargs)
 
     @contextmanager
     def check_station_parse_loop(
@@ -369,6 +680,7 @@ class StationSet(ABC):
         try:
             yield
         except FailedStationException as fse:
+            self.failed_stations[station_id] = str(fse)
             self.log.error(
                 f"[transform] transform single station failed for {station_id}: {str(fse)}")
 
@@ -377,10 +689,7 @@ class StationSet(ABC):
             station_id: str,
             **kwargs
     ) -> pd.DataFrame:
-        df = self.local_store.read(
-            os.path.join(self.file_handler.RAW_DATA_PATH,
-                         f"{self.station_name_formatter(station_id)}.csv")
-        )
+        df = self.local_store.read(self.raw_station_path(station_id))
         self.log.info("[read_raw_station_data] read raw station data")
         return df
 
@@ -394,7 +703,23 @@ class StationSet(ABC):
         """
         station_metadata = self.metadata_handler.get_old_station_geo_metadata(
             station_id)
-        return self.BASE_OUTPUT_STATION_METADATA if station_metadata is None else station_metadata
+        # copy the template, it is filled in place and stations can be transformed concurrently
+        return deepcopy(self.BASE_OUTPUT_STATION_METADATA) if station_metadata is None else station_metadata
+
+    def snapshot_store_listing(self) -> None:
+        """
+        List this set's remote folder once so existence checks do not each need a request, if the store is
+        configured to (see S3.snapshot_listing). Worker processes receive the snapshot with the store
+        """
+        if getattr(self.store, 'snapshot_listings', False):
+            self.store.snapshot_listing(self.file_handler.relative_path)
+
+    def prefetch_station_metadata(self, stations: list) -> None:
+        """
+        Fetch the old geojson of all these stations from the store in one batch before transforming them
+        """
+        with self.stage_timer.stage('prefetch_old_metadata'):
+            self.metadata_handler.prefetch_old_station_geo_metadata(stations)
 
     def get_old_or_default_dataset_geojson(self) -> dict:
         """
@@ -462,21 +787,82 @@ class StationSet(ABC):
     def save_processed_data(
         self, processed_dataframe: pd.DataFrame, station_id: str, **kwargs
     ) -> tuple[list[datetime.datetime], pd.DataFrame]:
+        if self.append_remote_history:
+            with self.stage_timer.stage('append_to_remote'):
+                appended = self.stage_append_to_remote(processed_dataframe, station_id)
+            if appended is not None:
+                return appended
         # To check this we need to pass station_metadata which currently doesnt happen
         # if self.should_combine__dataframe_with_remote_old_dataframe(processed_dataframe, station_metadata):
-        combined_processed_dataframe = (
-            self.combine_processed_dataframe_with_remote_old_dataframe(
-                processed_dataframe, station_id
+        with self.stage_timer.stage('combine'):
+            combined_processed_dataframe = (
+                self.combine_processed_dataframe_with_remote_old_dataframe(
+                    processed_dataframe, station_id
+                )
+            )
+        with self.stage_timer.stage('write'):
+            self.save_processed_dataframe(
+                combined_processed_dataframe, station_id, **kwargs
             )
-        )
-        self.save_processed_dataframe(
-            combined_processed_dataframe, station_id, **kwargs
-        )
         return [
             min(combined_processed_dataframe["dt"]),
             max(combined_processed_dataframe["dt"]),
         ], combined_processed_dataframe
 
+    def stage_append_to_remote(
+            self,
+            processed_dataframe: pd.DataFrame,
+            station_id: str
+    ) -> tuple[list, pd.DataFrame] | None:
+        """
+        Save the new rows of a station so they can be appended to its remote csv instead of rewriting it.
+
+        Only the header, first row and last rows of the remote file are read, with ranged reads. This is possible
+        when every new row comes after the remote history and no new column was added; otherwise None is returned
+        and the station is combined with its full remote history as usual. Compressed files are always rewritten.
+
+        The new rows are written to APPEND_DATA_PATH and appended on load. Local stores write processed files
+        straight into the store, so there they are appended immediately.
+        Returns the date range of the whole remote file and the last remote rows followed by the new rows.
+        """
+        if (not isinstance(self.store, (S3, Local)) or self.processed_file_format != 'csv'
+                or self.processed_file_compression is not None or processed_dataframe.empty):
+            return None
+        file_name = f"{self.station_name_formatter(station_id)}.csv"
+        edges = self.store.read_csv_edges(os.path.join(self.file_handler.relative_path, file_name))
+        if edges is None:
+            return None
+        head_dataframe, tail_dataframe = edges
+        if head_dataframe.empty or tail_dataframe.empty:
+            return None
+        if not set(processed_dataframe.columns).issubset(head_dataframe.columns):
+            self.log.info(f"[save_processed_data] new columns for {station_id}, rewriting the whole file")
+            return None
+
+        new_dataframe = self._sorted_unique_dates(processed_dataframe).reindex(columns=head_dataframe.columns)
+        try:
+            if pd.to_datetime(tail_dataframe['dt']).max() >= pd.to_datetime(new_dataframe['dt']).min():
+                return None
+        except (TypeError, ValueError):
+            return None
+
+        if isinstance(self.store, Local):
+            self.store.append_csv(os.path.join(self.file_handler.relative_path, file_name), new_dataframe)
+        else:
+            self.file_handler.create_directory_if_necessary(self.file_handler.APPEND_DATA_PATH)
+            self.local_store.write(os.path.join(self.file_handler.APPEND_DATA_PATH, file_name), new_dataframe)
+            # a processed file left from an earlier run must not overwrite the remote history on load
+            stale_filepath = os.path.join(self.file_handler.PROCESSED_DATA_PATH, file_name)
+            if os.path.exists(stale_filepath):
+                os.remove(stale_filepath)
+        self.log.info(f"[save_processed_data] appending {len(new_dataframe)} new rows to {file_name}")
+
+        first_date = head_dataframe['dt'].iloc[0]
+        if pd.api.types.is_datetime64_any_dtype(new_dataframe['dt']):
+            first_date = pd.to_datetime(first_date)
+        return [first_date, new_dataframe['dt'].iloc[-1]], pd.concat([tail_dataframe, new_dataframe],
+                                                                     ignore_index=True)
+
     def combine_processed_dataframe_with_remote_old_dataframe(
             self,
             processed_dataframe: pd.DataFrame,
@@ -484,44 +870,76 @@ class StationSet(ABC):
     ) -> pd.DataFrame:
         self.log.info(
             "[save_processed_data] needs combining old data to new data")
-        filename = f"{self.station_name_formatter(station_id)}.csv"
+        filename = self.station_file_name(station_id)
         old_df = self.store.read(os.path.join(
             self.file_handler.relative_path, filename))
+        if old_df is None and self.processed_file_compression is not None:
+            # the history of a dataset published before compression was turned on is in the uncompressed file
+            old_df = self.store.read(os.path.join(
+                self.file_handler.relative_path, strip_compression_suffix(filename)))
+            if old_df is not None:
+                self.log.info(f"[save_processed_data] read old dataframe from uncompressed "
+                              f"{strip_compression_suffix(filename)}")
 
-        # order define the priority of which df should keep the row in case they have the same date
-        # In this case processed has the priority
-        processed_dataframe['order'] = 1
         if old_df is None:
             self.log.warn(
-                f"[save_processed_data] could not find old dataframe {station_id}.csv on {self.store.base_folder}")
+                f"[save_processed_data] could not find old dataframe {filename} on {self.store.base_folder}")
             old_df = pd.DataFrame()
 
-        else:
-            old_df['order'] = 0
-            # processed_dataframe = processed_dataframe.astype({'dt': 'datetime64[ns]'})
-            # old_df = old_df.astype({'dt': 'datetime64[ns]'})
-
-        # combine the two
-        df = pd.concat([old_df, processed_dataframe])
-        joiner_df = df[['dt', 'order']].groupby(
-            'dt', as_index=False).max('order')
-        final_df = pd.merge(joiner_df, df,
-                            how='left', on=['dt', 'order'])
-        final_df.sort_values(by='dt', ascending=True,
-                             inplace=True, ignore_index=True)
-        final_df = final_df.drop(columns=['order'])
-        final_df.drop_duplicates(subset='dt', inplace=True, ignore_index=True)
+        final_df = self.combine_dataframes(old_df, processed_dataframe)
 
         self.log.info("[save_processed_data] combined old data to new data")
         return final_df
 
+    @staticmethod
+    def combine_dataframes(
+            old_df: pd.DataFrame,
+            processed_dataframe: pd.DataFrame
+    ) -> pd.DataFrame:
+        """
+        Combine a station's old data with its newly processed data, sorted by dt with one row per date.
+        Processed rows take priority over old rows with the same date.
+
+        Both inputs are expected to be (nearly) sorted already, so no full sort is needed:
+        - when every new row comes after the old history (the usual daily update) they are simply appended
+        - otherwise the overlapping old rows are dropped and the two sorted runs are merged with a stable sort,
+          which is linear on already sorted runs
+        """
+        processed_dataframe = StationSet._sorted_unique_dates(processed_dataframe)
+        if old_df.empty:
+            final_df = processed_dataframe
+        elif processed_dataframe.empty:
+            final_df = StationSet._sorted_unique_dates(old_df)
+        else:
+            old_df = StationSet._sorted_unique_dates(old_df)
+            if old_df['dt'].iloc[-1] < processed_dataframe['dt'].iloc[0]:
+                final_df = pd.concat([old_df, processed_dataframe], ignore_index=True)
+            else:
+                old_df = old_df[~old_df['dt'].isin(processed_dataframe['dt'])]
+                final_df = pd.concat([old_df, processed_dataframe], ignore_index=True)
+                final_df.sort_values(by='dt', kind='stable', inplace=True, ignore_index=True)
+
+        # keep dt as the first column
+        return final_df[['dt'] + [column for column in final_df.columns if column != 'dt']]
+
+    @staticmethod
+    def _sorted_unique_dates(dataframe: pd.DataFrame) -> pd.DataFrame:
+        """
+        Return dataframe sorted by dt keeping the first row of each date, skipping the work if it already is
+        """
+        if not dataframe['dt'].is_unique:
+            dataframe = dataframe.drop_duplicates(subset='dt', ignore_index=True)
+        if not dataframe['dt'].is_monotonic_increasing:
+            dataframe = dataframe.sort_values(by='dt', kind='stable', ignore_index=True)
+        return dataframe
+
     def save_processed_dataframe(
             self,
             combined_processed_dataframe: pd.DataFrame,
             station_id: str,
             **kwargs
     ) -> None:
-        file_name = f"{self.station_name_formatter(station_id)}.csv"
+        file_name = self.station_file_name(station_id)
         filepath = self.local_store.write(
             os.path.join(self.file_handler.PROCESSED_DATA_PATH, file_name),
             combined_processed_dataframe
@@ -585,6 +1003,9 @@ class StationSet(ABC):
         )
         self.log.info(
             "[save_processed_station_metadata] wrote station geojson metadata to {}".format(filepath))
+        self.station_features[self.station_name_formatter(station_id)] = processed_station_metadata["features"][0]
+        if self.transform_manifest is not None:
+            self.record_transform_manifest_entry(station_id, processed_station_metadata)
 
     def save_combined_metadata_files(
             self,
@@ -599,6 +1020,9 @@ class StationSet(ABC):
         self.log.info(
             "[save_combined_metadata_files] populating blank metadata")
         metadata = self.fill_in_static_metadata(base_metadata)
+        codec = self.processed_file_codec()
+        if codec is not None:
+            metadata = {**metadata, "compression": codec}
         # validate
         self.log.info(
             "[save_combined_metadata_files] validating metadata.json")
@@ -651,41 +1075,46 @@ class StationSet(ABC):
         """
         Steps are:
         1) Load old stations.geojson
-        2) Iterate through old stations.geojson looking for updated files
-        3) Save new updates, but also save stations that haven't been updated
-        4) Iterate through new files to see if any stations are appearing for the first time
+        2) Iterate through old stations.geojson once, taking each station's feature from the registry of features
+           finished in this run, from its geojson in the processed folder, or else keeping the old feature
+        3) Add the registered stations that are appearing for the first time
+        4) Add first time stations only found as geojson files in the processed folder
         5) Output combined stations.geojson dict
         """
         new_features = []
-        used_ids = []
+        used_ids = set()
         # read in old station metadata or pull the template if None
         base_station_geo_metadata = self.get_old_or_default_dataset_geojson()
         # Iterate through old features
         old_features = base_station_geo_metadata["features"]
         for old_feature in old_features:
-            new_metadata_file_name = old_feature["properties"]["file name"][:-4] + '.geojson'
-            new_metadata_path = os.path.join(
-                self.file_handler.PROCESSED_DATA_PATH, new_metadata_file_name)
-            new_feature = FileHandler.load_dict(new_metadata_path)
-            # '.geojson' clause to stop the metadata template from entering the file
-            if new_feature == None and new_metadata_file_name != '.geojson':
-                # take old feature
-                new_features.append(old_feature)
-                used_ids.append(new_metadata_file_name)
-            elif new_feature != None:
-                # take new feature
-                new_features.append(new_feature["features"][0])
-                used_ids.append(new_metadata_file_name)
+            formatted_station_id = os.path.splitext(strip_compression_suffix(old_feature["properties"]["file name"]))[0]
+            # empty file name clause to stop the metadata template from entering the file
+            if not formatted_station_id or formatted_station_id in used_ids:
+                continue
+            new_feature = self.station_features.get(formatted_station_id)
+            if new_feature is None:
+                # a station not transformed in this run may still have been processed locally in an earlier one
+                new_geojson = FileHandler.load_dict(
+                    os.path.join(self.file_handler.PROCESSED_DATA_PATH, f"{formatted_station_id}.geojson"))
+                new_feature = old_feature if new_geojson is None else new_geojson["features"][0]
+            new_features.append(new_feature)
+            used_ids.add(formatted_station_id)
+
+        # registered stations that don't exist in the old stations.geojson
+        for formatted_station_id, feature in self.station_features.items():
+            if formatted_station_id not in used_ids:
+                new_features.append(feature)
+                used_ids.add(formatted_station_id)
 
-        # iterate through new stations for any that don't exist in used_ids
         # these are first time stations that should be added to the combined file
-        new_files = os.listdir(self.file_handler.PROCESSED_DATA_PATH)
-        new_files = [file for file in new_files if '.geojson' in file]
-        for file in new_files:
-            if file not in used_ids and file != 'stations.geojson':
+        for file in sorted(os.listdir(self.file_handler.PROCESSED_DATA_PATH)):
+            formatted_station_id, extension = os.path.splitext(file)
+            if extension == '.geojson' and formatted_station_id not in used_ids and file != 'stations.geojson':
                 new_feature = FileHandler.load_dict(os.path.join(
                     self.file_handler.PROCESSED_DATA_PATH, file))
                 new_features.append(new_feature["features"][0])
+                used_ids.add(formatted_station_id)
 
         # append new_features to general geojson template
         stations_geojson = {
@@ -704,8 +1133,29 @@ class StationSet(ABC):
         local_path = self.file_handler.PROCESSED_DATA_PATH if custom_local_full_path is None else custom_local_full_path
         relative_s3_path = os.path.dirname(
             self.file_handler.relative_path) if custom_s3_relative_path is None else custom_s3_relative_path
+        if custom_local_full_path is None:
+            self.append_staged_files()
         return self.store.cp_folder_to_remote(local_path, relative_s3_path)
 
+    def has_staged_append(self, file_name: str) -> bool:
+        return os.path.exists(os.path.join(self.file_handler.APPEND_DATA_PATH, file_name))
+
+    def append_staged_files(self) -> None:
+        """
+        Append the rows staged by `stage_append_to_remote` to the remote station files
+        """
+        if not os.path.isdir(self.file_handler.APPEND_DATA_PATH):
+            return
+        for file_name in sorted(os.listdir(self.file_handler.APPEND_DATA_PATH)):
+            self.append_staged_file(file_name)
+
+    def append_staged_file(self, file_name: str) -> None:
+        staged_filepath = os.path.join(self.file_handler.APPEND_DATA_PATH, file_name)
+        new_dataframe = pd.read_csv(staged_filepath, dtype=str, keep_default_na=False)
+        filepath = self.store.append_csv(os.path.join(self.file_handler.relative_path, file_name), new_dataframe)
+        os.remove(staged_filepath)
+        self.log.info(f"[load] appended {len(new_dataframe)} rows to {filepath}")
+
     #####################################################################
     # GENERAL FUNCTIONS
     #####################################################################
@@ -0,0 +1,100 @@
+import os
+import json
+import time
+import threading
+import numpy as np
+from contextlib import contextmanager
+
+PERCENTILES = (50, 90, 99)
+
+
+class StageTimer:
+    """
+    Collects the wall-clock time spent in each named stage of the transform.
+
+    Timings are kept as a list of durations (in seconds) per stage so they can be sent back from worker processes
+    with each station's result and aggregated in the parent. It is safe to use from several threads at once.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.timings = {}
+
+    @contextmanager
+    def stage(self, name: str):
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start_time)
+
+    def add(self, name: str, seconds: float) -> None:
+        with self._lock:
+            self.timings.setdefault(name, []).append(seconds)
+
+    def extend(self, timings: dict) -> None:
+        with self._lock:
+            for name, durations in timings.items():
+                self.timings.setdefault(name, []).extend(durations)
+
+    def drain(self) -> dict:
+        """
+        Return the timings collected so far and start again from empty
+        """
+        with self._lock:
+            timings, self.timings = self.timings, {}
+        return timings
+
+
+def summarize_timings(timings: dict) -> dict:
+    """
+    Count, total, mean, max and percentiles of the durations of each stage
+    """
+    summary = {}
+    for name, durations in timings.items():
+        if not durations:
+            continue
+        values = np.asarray(durations, dtype=float)
+        summary[name] = {
+            "count": int(values.size),
+            "total": float(values.sum()),
+            "mean": float(values.mean()),
+            "max": float(values.max()),
+            **{f"p{percentile}": float(np.percentile(values, percentile)) for percentile in PERCENTILES}
+        }
+    return summary
+
+
+def prometheus_textfile(summary: dict, labels: dict) -> str:
+    """
+    Format a summary as a Prometheus summary metric, for the node exporter textfile collector
+    """
+    metric = "nettle_transform_stage_seconds"
+    lines = [
+        f"# HELP {metric} Time spent in each stage of a station transform",
+        f"# TYPE {metric} summary",
+    ]
+    for name, stage in summary.items():
+        stage_labels = ",".join(f'{key}="{value}"' for key, value in {**labels, "stage": name}.items())
+        for percentile in PERCENTILES:
+            lines.append(f'{metric}{{{stage_labels},quantile="{percentile / 100}"}} {stage[f"p{percentile}"]}')
+        lines.append(f"{metric}_sum{{{stage_labels}}} {stage['total']}")
+        lines.append(f"{metric}_count{{{stage_labels}}} {stage['count']}")
+    return "\n".join(lines) + "\n"
+
+
+def write_metrics_report(summary: dict, folder: str, name: str, labels: dict = None) -> tuple[str, str]:
+    """
+    Write the summary to folder/<name>.json and folder/<name>.prom, returning both paths.
+    Files are replaced atomically so collectors never read a partial file
+    """
+    os.makedirs(folder, 0o755, True)
+    json_path = os.path.join(folder, f"{name}.json")
+    prom_path = os.path.join(folder, f"{name}.prom")
+    for path, content in [(json_path, json.dumps(summary, indent=4)),
+                          (prom_path, prometheus_textfile(summary, labels if labels else {}))]:
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(content)
+        os.replace(tmp_path, path)
+    return json_path, prom_path
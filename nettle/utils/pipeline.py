@@ -0,0 +1,98 @@
+import queue
+import threading
+from .transform_pool import StationTransformResult
+
+
+class PipelineStage:
+    """
+    A named step of a StationPipeline. `func` receives a station id and raises if the station should not move on
+    """
+
+    def __init__(self, name: str, func, workers: int = 1):
+        self.name = name
+        self.func = func
+        self.workers = max(1, workers)
+
+
+class StationPipeline:
+    """
+    Runs stations through a series of stages connected by bounded queues.
+
+    Every stage has its own worker threads, so a station can be uploading while the next one is transforming and
+    another is still being fetched. The bounded queues stop a fast stage from running too far ahead of a slow one.
+    A station that fails in one stage is reported and does not reach the following stages.
+    """
+    _DONE = object()
+
+    def __init__(self, stages: list[PipelineStage], queue_size: int = 32, log=None):
+        self.stages = stages
+        self.queue_size = queue_size
+        self.log = log
+        self._results = []
+        self._results_lock = threading.Lock()
+
+    def run(self, station_ids: list[str]) -> list[StationTransformResult]:
+        self._results = []
+        queues = [queue.Queue(maxsize=self.queue_size) for _ in range(len(self.stages) + 1)]
+        threads = []
+        for stage, in_queue, out_queue in zip(self.stages, queues[:-1], queues[1:]):
+            remaining = [stage.workers]
+            lock = threading.Lock()
+            for _ in range(stage.workers):
+                thread = threading.Thread(
+                    target=self._stage_worker,
+                    args=(stage, in_queue, out_queue, remaining, lock),
+                    name=f"pipeline-{stage.name}",
+                    daemon=True
+                )
+                thread.start()
+                threads.append(thread)
+
+        # feed the first queue from its own thread, the bounded queues would block it while results pile up
+        feeder = threading.Thread(
+            target=self._feed, args=(station_ids, queues[0]), name="pipeline-feed", daemon=True)
+        feeder.start()
+        threads.append(feeder)
+
+        # drain the last queue, every station arriving here went through all stages
+        while True:
+            station_id = queues[-1].get()
+            if station_id is self._DONE:
+                break
+            self._add_result(StationTransformResult(station_id))
+
+        for thread in threads:
+            thread.join()
+        return self._results
+
+    def _feed(self, station_ids: list[str], in_queue: queue.Queue) -> None:
+        for station_id in station_ids:
+            in_queue.put(station_id)
+        in_queue.put(self._DONE)
+
+    def _stage_worker(self, stage: PipelineStage, in_queue: queue.Queue, out_queue: queue.Queue,
+                      remaining: list[int], lock: threading.Lock) -> None:
+        while True:
+            station_id = in_queue.get()
+            if station_id is self._DONE:
+                # let the sibling workers of this stage see the end marker too
+                in_queue.put(self._DONE)
+                with lock:
+                    remaining[0] -= 1
+                    last_worker = remaining[0] == 0
+                if last_worker:
+                    out_queue.put(self._DONE)
+                return
+            try:
+                stage.func(station_id)
+            except Exception as e:
+                error = f"[{stage.name}] {type(e).__name__}: {e}"
+                if self.log is not None:
+                    self.log.error(f"[pipeline] station_id={station_id} failed: {error}")
+                self._add_result(StationTransformResult(station_id, error))
+                continue
+            out_queue.put(station_id)
+
+    def _add_result(self, result: StationTransformResult) -> None:
+        with self._results_lock:
+            self._results.append(result)
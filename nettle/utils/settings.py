@@ -8,6 +8,8 @@ load_dotenv(dotenv_path)
 
 RAW_DATA_ROOT = os.path.join(os.getcwd(), "raw_data")
 PROCESSED_DATA_ROOT = os.path.join(os.getcwd(), "processed_data")
+APPEND_DATA_ROOT = os.path.join(os.getcwd(), "append_data")
+METRICS_OUTPUT_ROOT = os.path.join(os.getcwd(), "metrics")
 HASHES_OUTPUT_ROOT = os.path.join(PROCESSED_DATA_ROOT, "hashes")
 
 # Env is dev, prod
@@ -0,0 +1,78 @@
+import os
+import json
+import hashlib
+import threading
+
+
+class TransformManifest:
+    """
+    A persisted record of the raw file each station was last transformed from.
+
+    For every station it keeps the size and md5 of the raw file, the processed files it produced and the station's
+    geojson feature. A station whose raw file has the same size and hash as last time does not need to be
+    transformed again and its previous feature can be reused in stations.geojson.
+
+    `fingerprint` identifies anything else the outputs depend on (e.g. the data dictionary). When it changes every
+    station is considered changed.
+    """
+    FILE_NAME = ".transform_manifest.json"
+    HASH_BLOCK_SIZE = 1024 * 1024
+
+    def __init__(self, folder: str, fingerprint: str = ""):
+        self.path = os.path.join(folder, self.FILE_NAME)
+        self.fingerprint = fingerprint
+        self._lock = threading.Lock()
+        self.stations = self.load()
+
+    def load(self) -> dict:
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                manifest = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return {}
+        if manifest.get("fingerprint") != self.fingerprint:
+            return {}
+        return manifest.get("stations", {})
+
+    def save(self) -> None:
+        tmp_path = f"{self.path}.tmp"
+        with self._lock:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"fingerprint": self.fingerprint, "stations": self.stations}, f)
+            os.replace(tmp_path, self.path)
+
+    @classmethod
+    def raw_signature(cls, raw_path: str) -> dict:
+        md5 = hashlib.md5()
+        with open(raw_path, "rb") as f:
+            for block in iter(lambda: f.read(cls.HASH_BLOCK_SIZE), b""):
+                md5.update(block)
+        return {"size": os.path.getsize(raw_path), "md5": md5.hexdigest()}
+
+    @staticmethod
+    def fingerprint_of(*objects) -> str:
+        return hashlib.md5(json.dumps(objects, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+    def is_unchanged(self, station_id: str, raw_path: str) -> bool:
+        entry = self.stations.get(station_id)
+        if entry is None or entry.get("feature") is None:
+            return False
+        try:
+            # compare sizes first, hashing is only needed when they match
+            if os.path.getsize(raw_path) != entry["raw"]["size"]:
+                return False
+            return self.raw_signature(raw_path) == entry["raw"]
+        except FileNotFoundError:
+            return False
+
+    def feature(self, station_id: str) -> dict | None:
+        entry = self.stations.get(station_id)
+        return None if entry is None else entry.get("feature")
+
+    def record(self, station_id: str, entry: dict) -> None:
+        with self._lock:
+            self.stations[station_id] = entry
+
+    @classmethod
+    def entry(cls, raw_path: str, outputs: list[str], feature: dict) -> dict:
+        return {"raw": cls.raw_signature(raw_path), "outputs": outputs, "feature": feature}
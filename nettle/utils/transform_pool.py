@@ -0,0 +1,119 @@
+import multiprocessing
+
+# Each worker process holds a single StationSet, built once by the pool initializer
+_worker_station_set = None
+# Set instead when the StationSet could not be built, so tasks fail rather than the pool respawning workers forever
+_worker_init_error = None
+
+
+class StationTransformResult:
+    """
+    The outcome of transforming a single station, sent back from a worker to the parent process
+    """
+
+    def __init__(
+            self,
+            station_id: str,
+            error: str = None,
+            manifest_entry: dict = None,
+            timings: dict = None,
+            feature: dict = None
+    ):
+        self.station_id = station_id
+        self.error = error
+        # the station's geojson feature, added to the parent's feature registry for stations.geojson
+        self.feature = feature
+        # raw file signature, outputs and feature of the station, see TransformManifest
+        self.manifest_entry = manifest_entry
+        # stage name -> durations in seconds, see StageTimer
+        self.timings = timings if timings else {}
+
+    @property
+    def succeeded(self) -> bool:
+        return self.error is None
+
+    def __repr__(self):
+        status = "ok" if self.succeeded else f"failed: {self.error}"
+        return f"StationTransformResult({self.station_id}, {status})"
+
+
+def init_transform_worker(station_set_class, init_kwargs: dict, today_with_time) -> None:
+    """
+    Pool initializer. Builds the worker's StationSet once so tasks only need to carry station ids
+    """
+    global _worker_station_set, _worker_init_error
+    try:
+        _worker_station_set = station_set_class(**init_kwargs)
+    except Exception as e:
+        _worker_init_error = f"could not build {station_set_class.__name__} in worker: {type(e).__name__}: {e}"
+        return
+    # keep the parent's run date so every worker writes the same dates
+    _worker_station_set.today_with_time = today_with_time
+
+
+def transform_station_chunk(task: tuple[list[str], dict]) -> tuple[list[StationTransformResult], dict]:
+    """
+    Transform a chunk of stations with the worker's StationSet and report the outcome of each, along with the
+    timings of the work done for the whole chunk (the metadata prefetch)
+    """
+    station_ids, kwargs = task
+    if _worker_init_error is not None:
+        return [StationTransformResult(station_id, _worker_init_error) for station_id in station_ids], {}
+    _worker_station_set.prefetch_station_metadata(station_ids)
+    chunk_timings = _worker_station_set.stage_timer.drain()
+    return [transform_station(_worker_station_set, station_id, **kwargs) for station_id in station_ids], chunk_timings
+
+
+def transform_station(station_set, station_id: str, catch_errors: bool = True, **kwargs) -> StationTransformResult:
+    """
+    Transform a station and report the outcome. Unexpected exceptions are recorded as the station's error so a
+    worker goes on with its other stations, or raised with catch_errors=False to stop the run instead
+    """
+    try:
+        station_set.single_station_transform(station_id, **kwargs)
+        # FailedStationException is logged and swallowed by check_station_parse_loop, which records it
+        error = station_set.failed_stations.pop(station_id, None)
+    except Exception as e:
+        if not catch_errors:
+            raise
+        error = f"{type(e).__name__}: {e}"
+        station_set.log.error(
+            f"[transform] transform single station failed for {station_id}: {error}")
+    manifest_entry = station_set.pending_manifest_entries.pop(station_id, None)
+    feature = station_set.station_features.pop(station_set.station_name_formatter(station_id), None)
+    return StationTransformResult(station_id, error, manifest_entry if error is None else None,
+                                  station_set.stage_timer.drain(), feature if error is None else None)
+
+
+class TransformPool:
+    """
+    A persistent pool of worker processes, each holding its own StationSet.
+
+    The StationSet is built once per worker through the pool initializer, so the tasks sent to the workers only
+    contain lists of station ids. Results (including failures) for every station are returned to the parent.
+    """
+    DEFAULT_CHUNK_SIZE = 16
+
+    def __init__(self, station_set, workers: int = None, chunk_size: int = None):
+        self.station_set = station_set
+        self.workers = workers if workers else max(1, multiprocessing.cpu_count() - 2)
+        self.chunk_size = chunk_size if chunk_size else self.DEFAULT_CHUNK_SIZE
+
+    @staticmethod
+    def chunk(station_ids: list[str], chunk_size: int) -> list[list[str]]:
+        return [station_ids[i:i + chunk_size] for i in range(0, len(station_ids), chunk_size)]
+
+    def run(self, station_ids: list[str], **kwargs) -> list[StationTransformResult]:
+        tasks = [(chunk, kwargs) for chunk in self.chunk(station_ids, self.chunk_size)]
+        results = []
+        with multiprocessing.get_context("spawn").Pool(
+                min(self.workers, max(1, len(tasks))),
+                initializer=init_transform_worker,
+                initargs=(type(self.station_set),
+                          self.station_set.worker_init_kwargs(),
+                          self.station_set.today_with_time)
+        ) as pool:
+            for chunk_results, chunk_timings in pool.imap_unordered(transform_station_chunk, tasks):
+                results.extend(chunk_results)
+                self.station_set.stage_timer.extend(chunk_timings)
+        return results
@@ -1,12 +1,12 @@
 import pandas as pd
 from datetime import datetime, timedelta, date
 from dateutil.rrule import rrule, MONTHLY
-from urllib.request import Request, urlopen
-from urllib.error import HTTPError
 from nettle.station_set import StationSet
 
 
 class BOMTest(StationSet):
+    HEADERS = {'User-Agent': 'Mozilla/5.0 (X11; Ubuntu; Linux x86_64; rv:77.0) Gecko/20100101 Firefox/77.0'}
+
     @staticmethod
     def collection() -> str:
         return "BOMTest"
@@ -34,7 +34,7 @@ class BOMTest(StationSet):
         raw_station_metadata['features'][0]['geometry'] = self.STATION_DICTIONARY[f'{station_id}']['geometry']
         raw_station_metadata['features'][0]['properties']["station name"] = f"{station_id}"
         raw_station_metadata['features'][0]['properties']["code"] = self.STATION_DICTIONARY[f'{station_id}']['code']
-        raw_station_metadata['features'][0]['properties']["file name"] = f"{self.station_name_formatter(station_id)}.csv"
+        raw_station_metadata['features'][0]['properties']["file name"] = self.station_file_name(station_id)
         return raw_station_metadata
 
     def extract(self):
@@ -43,11 +43,16 @@ class BOMTest(StationSet):
         for station_id in stations:
             with self.etl_print_runtime(station_id, 'extract'), self.check_station_extract_loop(station_id):
                 new_start = self.get_new_start(station_id)
-                station_df = self.get_dfs_with_formatted_data(new_start=new_start, station_id=station_id)
+                station_df = self.extract_station(station_id, new_start=new_start)
                 self.save_raw_dataframe(station_df, station_id)
                 stations_updated_counter += int(pd.Timestamp(new_start) > station_df["dt"].max())
         return stations_updated_counter != len(stations)
 
+    def extract_station(self, station_id: str, new_start: date = None, **kwargs) -> pd.DataFrame:
+        if new_start is None:
+            new_start = self.get_new_start(station_id)
+        return self.get_dfs_with_formatted_data(new_start=new_start, station_id=station_id)
+
     def get_new_start(self, station_id: str):
         if "date range" in self.STATION_DICTIONARY[station_id]:
             # previous end date + 1 days
@@ -58,44 +63,51 @@ class BOMTest(StationSet):
 
     def get_dfs_with_formatted_data(self, new_start: date, station_id: str):
         url_id = self.STATION_DICTIONARY[station_id]["code"]
-        dfs = []
         # Need to replace day with 1st of month to avoid skipping months with rrule
-        for dt_month in rrule(MONTHLY, dtstart=new_start.replace(day=1), until=self.today_with_time.replace(day=1)):
-            dfs.append(self.single_df(str(f"{dt_month.month:02}"), str(dt_month.year), url_id))
+        months = [(str(f"{dt_month.month:02}"), str(dt_month.year)) for dt_month in
+                  rrule(MONTHLY, dtstart=new_start.replace(day=1), until=self.today_with_time.replace(day=1))]
+        # fetch every month at once, bodies come back in the same order as the urls
+        contents = self.fetcher().fetch_many([self.month_url(month, year, url_id) for month, year in months],
+                                             headers=self.HEADERS)
+        dfs = [self.parse_single_df(content, month, year, url_id) for content, (month, year) in zip(contents, months)]
         station_df = pd.concat(dfs, ignore_index=True)
         station_df['dt'] = [datetime.strptime(x, '%Y-%m-%d') for x in station_df['dt']]  # index
         station_df.sort_values(by='dt', inplace=True, ignore_index=True)
         return station_df
 
+    @staticmethod
+    def month_url(month: str, year: str, url_id: str) -> str:
+        return f'http://www.bom.gov.au/climate/dwo/{year+month}/text/{url_id}.{year+month}.csv'
+
     def single_df(self, month: str, year: str, url_id: str):
         """
         Given a month, year and ID, return all the climate data for that month. Will return an empty dataframe
         with columns ['Date','Tmin','Tmax','Rain','Winddir','Windspeed'] if anything goes wrong
         """
-        try:
-            new_url = f'http://www.bom.gov.au/climate/dwo/{year+month}/text/{url_id}.{year+month}.csv'
-            req = Request(new_url)
-            req.add_header('User-Agent', 'Mozilla/5.0 (X11; Ubuntu; Linux x86_64; rv:77.0) Gecko/20100101 Firefox/77.0')
-            raw_rows = str(urlopen(req).read()).split('\\r\\n')
-            rows = []
-            # There is some intro guff until empty line '', Start reading from after this line onwards
-            for i in range(raw_rows.index('') + 1, len(raw_rows)):
-                row = raw_rows[i][1:].split(',')  # Ignore first character it's always a space
-                row = [x.replace("'", "").replace('"', '') for x in row]  # Replace existing apostrophes/speech marks
-                rows.append(row)
-
-            df = pd.DataFrame(columns=rows[0], data=rows[1:])
-            cols = ['Date']
-            # Columns contain unreferenceable char for degrees c iterate through and get column names from df instead
-            for column in df.columns:
-                [cols.append(column) for key in ['maximum', 'minimum', 'rainfall'] if (key in column.lower())]
-
-            # 1 - Last column is time of max wind gust, remove and use cols to select the columns we want
-            # 2 - Rename to avoid confusing unreferenceable character situation
-            return df[cols[:-1]].set_axis(['dt', 'TMIN', 'TMAX', 'RAIN', 'WINDDIR', 'WINDSPEED'], axis="columns")
-        except HTTPError:
+        content = self.fetcher().fetch(self.month_url(month, year, url_id), headers=self.HEADERS)
+        return self.parse_single_df(content, month, year, url_id)
+
+    def parse_single_df(self, content: bytes | None, month: str, year: str, url_id: str):
+        if content is None:
             self.log.info(f"No data available for {url_id}, {year}-{month}")
             return pd.DataFrame(columns=['dt', 'TMIN', 'TMAX', 'RAIN', 'WINDDIR', 'WINDSPEED'])
+        raw_rows = str(content).split('\\r\\n')
+        rows = []
+        # There is some intro guff until empty line '', Start reading from after this line onwards
+        for i in range(raw_rows.index('') + 1, len(raw_rows)):
+            row = raw_rows[i][1:].split(',')  # Ignore first character it's always a space
+            row = [x.replace("'", "").replace('"', '') for x in row]  # Replace existing apostrophes/speech marks
+            rows.append(row)
+
+        df = pd.DataFrame(columns=rows[0], data=rows[1:])
+        cols = ['Date']
+        # Columns contain unreferenceable char for degrees c iterate through and get column names from df instead
+        for column in df.columns:
+            [cols.append(column) for key in ['maximum', 'minimum', 'rainfall'] if (key in column.lower())]
+
+        # 1 - Last column is time of max wind gust, remove and use cols to select the columns we want
+        # 2 - Rename to avoid confusing unreferenceable character situation
+        return df[cols[:-1]].set_axis(['dt', 'TMIN', 'TMAX', 'RAIN', 'WINDDIR', 'WINDSPEED'], axis="columns")
 
     @staticmethod
     def units_of_measurement_exceptions() -> list:
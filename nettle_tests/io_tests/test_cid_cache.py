@@ -0,0 +1,41 @@
+import pickle
+import tempfile
+from unittest import TestCase
+from nettle.io.cid_cache import CIDCache
+from nettle.io.disk_cache import DiskCache
+
+
+class CIDCacheTestCase(TestCase):
+    def test_memory_lru(self):
+        cache = CIDCache(max_memory_bytes=10)
+        cache.put('a', b'12345')
+        cache.put('b', b'12345')
+        cache.get('a')
+        cache.put('c', b'12345')
+        # b was the least recently used
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('a'), b'12345')
+        self.assertEqual(cache.get('c'), b'12345')
+        cache.put('too big', b'12345678901')
+        self.assertIsNone(cache.get('too big'))
+
+    def test_disk_backed(self):
+        with tempfile.TemporaryDirectory() as cache_dir:
+            CIDCache(DiskCache(cache_dir)).put('block/bafy', b'block')
+            # a new process only has the disk copy
+            cache = CIDCache(DiskCache(cache_dir))
+            self.assertEqual(cache.get('block/bafy'), b'block')
+            self.assertEqual(list(cache._memory), ['block/bafy'])
+
+    def test_is_immutable(self):
+        self.assertTrue(CIDCache.is_immutable('bafyreigdmqpykrgxyaxtlafqpqhzrb7qy2rh75nldvfd4tucqmqqme5yje'))
+        self.assertFalse(CIDCache.is_immutable('/ipns/k51qzi5uqu5dlvj2baxnqndepeb86cbk3ng7n3i46uzyxzyqj2xjonzllnv0v8'))
+
+    def test_pickle(self):
+        with tempfile.TemporaryDirectory() as cache_dir:
+            cache = CIDCache(DiskCache(cache_dir))
+            cache.put('block/bafy', b'block')
+            unpickled = pickle.loads(pickle.dumps(cache))
+            # the memory copies stay behind, the disk copy is still there
+            self.assertEqual(len(unpickled._memory), 0)
+            self.assertEqual(unpickled.get('block/bafy'), b'block')
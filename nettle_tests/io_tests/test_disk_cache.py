@@ -0,0 +1,71 @@
+import os
+import pickle
+import tempfile
+from unittest import TestCase
+from nettle.io.disk_cache import DiskCache
+
+
+class DiskCacheTestCase(TestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.TemporaryDirectory()
+        self.cache = DiskCache(self.cache_dir.name, max_bytes=10)
+
+    def tearDown(self):
+        self.cache_dir.cleanup()
+
+    def test_put_and_get(self):
+        self.cache.put('a', b'12345', {'etag': 'x'})
+        self.assertEqual(self.cache.get('a'), b'12345')
+        self.assertEqual(self.cache.meta('a'), {'etag': 'x'})
+        self.assertEqual(self.cache.size(), 5)
+
+    def test_set_meta(self):
+        self.cache.put('a', b'12345', {'etag': 'x'})
+        self.cache.set_meta('a', {'etag': 'y'})
+        self.assertEqual(self.cache.meta('a'), {'etag': 'y'})
+        self.assertEqual(self.cache.get('a'), b'12345')
+        self.cache.set_meta('missing', {'etag': 'y'})
+        self.assertIsNone(self.cache.meta('missing'))
+
+    def test_get_missing(self):
+        self.assertIsNone(self.cache.get('missing'))
+        self.assertIsNone(self.cache.meta('missing'))
+
+    def test_put_replaces_entry(self):
+        self.cache.put('a', b'12345')
+        self.cache.put('a', b'12')
+        self.assertEqual(self.cache.get('a'), b'12')
+        self.assertEqual(self.cache.size(), 2)
+
+    def test_evicts_least_recently_used(self):
+        self.cache.put('a', b'1234')
+        self.cache.put('b', b'1234')
+        # make 'a' the oldest entry regardless of timestamp resolution
+        os.utime(self.cache._path('a'), (0, 0))
+        self.cache.put('c', b'1234')
+        self.assertIsNone(self.cache.get('a'))
+        self.assertEqual(self.cache.get('b'), b'1234')
+        self.assertEqual(self.cache.get('c'), b'1234')
+        self.assertEqual(self.cache.size(), 8)
+
+    def test_too_large_entry_is_not_cached(self):
+        self.cache.put('big', b'x' * 11)
+        self.assertIsNone(self.cache.get('big'))
+
+    def test_size_is_restored_from_disk(self):
+        self.cache.put('a', b'1234')
+        self.assertEqual(DiskCache(self.cache_dir.name, max_bytes=10).size(), 4)
+
+    def test_delete(self):
+        self.cache.put('a', b'1234')
+        self.cache.delete('a')
+        self.assertIsNone(self.cache.get('a'))
+        self.assertEqual(self.cache.size(), 0)
+
+    def test_pickle(self):
+        # stores are pickled to be sent to the transform worker processes
+        self.cache.put('a', b'12345')
+        cache = pickle.loads(pickle.dumps(self.cache))
+        self.assertEqual(cache.get('a'), b'12345')
+        cache.put('b', b'123')
+        self.assertEqual(cache.size(), 8)
@@ -0,0 +1,98 @@
+import threading
+import tempfile
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import TestCase
+from unittest.mock import patch
+from nettle.io.fetcher import HTTPFetcher
+from nettle.io.disk_cache import DiskCache
+
+
+class StationFileHandler(BaseHTTPRequestHandler):
+    flaky_calls = 0
+    not_modified_calls = 0
+
+    def do_GET(self):
+        if self.path == '/closed_month.csv':
+            if self.headers.get('If-None-Match') == '"v1"':
+                StationFileHandler.not_modified_calls += 1
+                self.send_response(304)
+                self.end_headers()
+                return
+            body = b"closed month"
+            self.send_response(200)
+            self.send_header('ETag', '"v1"')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+        if self.path == '/missing':
+            self.send_response(404)
+            self.end_headers()
+            return
+        if self.path == '/flaky' and StationFileHandler.flaky_calls == 0:
+            StationFileHandler.flaky_calls += 1
+            self.send_response(503)
+            self.end_headers()
+            return
+        body = f"body of {self.path}".encode()
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class HTTPFetcherTestCase(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), StationFileHandler)
+        cls.base_url = f"http://127.0.0.1:{cls.server.server_address[1]}"
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        with patch('nettle.utils.log_info.LogInfo') as MockClass:
+            log = MockClass.return_value
+        self.fetcher = HTTPFetcher(log=log, max_workers=4, max_per_host=2, backoff_factor=0)
+
+    def test_fetch(self):
+        self.assertEqual(self.fetcher.fetch(f"{self.base_url}/KALUMBURU.csv"), b"body of /KALUMBURU.csv")
+
+    def test_fetch_missing(self):
+        self.assertIsNone(self.fetcher.fetch(f"{self.base_url}/missing"))
+
+    def test_fetch_retries(self):
+        self.assertEqual(self.fetcher.fetch(f"{self.base_url}/flaky"), b"body of /flaky")
+
+    def test_fetch_many_keeps_order(self):
+        urls = [f"{self.base_url}/{i}.csv" for i in range(20)] + [f"{self.base_url}/missing"]
+        bodies = self.fetcher.fetch_many(urls)
+        self.assertEqual(bodies[:-1], [f"body of /{i}.csv".encode() for i in range(20)])
+        self.assertIsNone(bodies[-1])
+
+    def test_host_semaphore_shared_per_host(self):
+        self.assertIs(self.fetcher.host_semaphore(f"{self.base_url}/a"), self.fetcher.host_semaphore(f"{self.base_url}/b"))
+        self.assertIsNot(self.fetcher.host_semaphore(f"{self.base_url}/a"), self.fetcher.host_semaphore("http://other/a"))
+
+    def test_fetch_conditional_serves_cached_copy_on_304(self):
+        with tempfile.TemporaryDirectory() as cache_dir:
+            self.fetcher.cache = DiskCache(cache_dir, max_bytes=1024)
+            url = f"{self.base_url}/closed_month.csv"
+            self.assertEqual(self.fetcher.fetch(url), b"closed month")
+            self.assertEqual(self.fetcher.cache.meta(url)['etag'], '"v1"')
+            calls_before = StationFileHandler.not_modified_calls
+            self.assertEqual(self.fetcher.fetch(url), b"closed month")
+            self.assertEqual(StationFileHandler.not_modified_calls, calls_before + 1)
+
+    def test_fetch_conditional_does_not_cache_without_validators(self):
+        with tempfile.TemporaryDirectory() as cache_dir:
+            self.fetcher.cache = DiskCache(cache_dir, max_bytes=1024)
+            url = f"{self.base_url}/no_validators.csv"
+            self.assertEqual(self.fetcher.fetch(url), b"body of /no_validators.csv")
+            self.assertIsNone(self.fetcher.cache.meta(url))
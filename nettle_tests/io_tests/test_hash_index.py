@@ -0,0 +1,83 @@
+import os
+import json
+import tempfile
+import multiprocessing
+from unittest import TestCase
+from nettle.io.hash_index import HashIndex
+
+
+def record_many(path: str, worker: int) -> None:
+    index = HashIndex(path)
+    for i in range(25):
+        index.record({f"set_{worker}_{i}": f"bafy{worker}{i}"}, {f"set_{worker}_2023{i:04}": f"bafy{worker}{i}"})
+
+
+class HashIndexTestCase(TestCase):
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.folder.name, 'hashes', 'index.jsonl')
+        self.heads_path = os.path.join(self.folder.name, 'heads.json')
+        self.history_path = os.path.join(self.folder.name, 'history.json')
+        self.index = HashIndex(self.path, self.heads_path, self.history_path)
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def journal_lines(self) -> int:
+        with open(self.path) as f:
+            return len(f.readlines())
+
+    def test_record_and_lookup(self):
+        self.index.record({'bom': 'bafy1'}, {'bom_20230801': 'bafy1'})
+        self.index.record({'bom': 'bafy2'}, {'bom_20230802': 'bafy2'})
+        self.index.record({'ghcn': 'bafy3'})
+        self.assertEqual(self.index.head('bom'), 'bafy2')
+        self.assertEqual(self.index.history('bom_'), {'bom_20230801': 'bafy1', 'bom_20230802': 'bafy2'})
+        self.assertEqual(self.journal_lines(), 3)
+        with self.assertRaises(KeyError):
+            self.index.head('missing')
+
+    def test_other_instances_see_appends(self):
+        other = HashIndex(self.path)
+        self.index.record({'bom': 'bafy1'})
+        self.assertEqual(other.head('bom'), 'bafy1')
+        other.record({'bom': 'bafy2'})
+        self.index.compact()
+        other.record({'ghcn': 'bafy3'})
+        self.assertEqual(self.index.heads(), {'bom': 'bafy2', 'ghcn': 'bafy3'})
+        self.assertEqual(other.heads(), {'bom': 'bafy2', 'ghcn': 'bafy3'})
+
+    def test_compaction(self):
+        for i in range(3):
+            self.index.record({'bom': f'bafy{i}'})
+        self.index.compact()
+        self.assertEqual(self.journal_lines(), 1)
+        self.assertEqual(self.index.head('bom'), 'bafy2')
+        # automatic once the journal holds compact_ratio times more lines than keys
+        for i in range(10):
+            self.index.record({'bom': f'bafy{i}'})
+        self.assertLessEqual(self.journal_lines(), self.index.compact_ratio)
+        self.assertEqual(HashIndex(self.path).head('bom'), 'bafy9')
+
+    def test_legacy_import_and_export(self):
+        with open(self.heads_path, 'w') as f:
+            json.dump({'bom': 'bafy1'}, f)
+        with open(self.history_path, 'w') as f:
+            json.dump({'bom_20230801': 'bafy1'}, f)
+        self.assertEqual(self.index.head('bom'), 'bafy1')
+        self.index.record({'bom': 'bafy2'}, {'bom_20230802': 'bafy2'})
+        self.index.export_legacy()
+        with open(self.heads_path) as f:
+            self.assertEqual(json.load(f), {'bom': 'bafy2'})
+        with open(self.history_path) as f:
+            self.assertEqual(json.load(f), {'bom_20230801': 'bafy1', 'bom_20230802': 'bafy2'})
+
+    def test_concurrent_processes(self):
+        context = multiprocessing.get_context('spawn')
+        processes = [context.Process(target=record_many, args=(self.path, worker)) for worker in range(4)]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+        self.assertEqual(len(self.index.heads()), 100)
+        self.assertEqual(len(self.index.history()), 100)
@@ -0,0 +1,564 @@
+import os
+import json
+import pickle
+import time
+import hashlib
+import requests
+import dag_cbor
+import pandas as pd
+from multiformats import CID, multihash
+import tempfile
+import threading
+from email import policy
+from email.parser import BytesParser
+from urllib.parse import unquote, urlsplit, parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import TestCase
+from unittest.mock import patch, MagicMock
+from nettle.io.ipfs import IPFSIO
+from nettle.io.cid_cache import CIDCache
+from nettle.io.disk_cache import DiskCache
+from nettle.io.known_cids import KnownCIDs
+from nettle.io.hash_index import HashIndex
+from nettle.io.store import IPFS
+from nettle.io.car import CARWriter, read_car
+
+
+def block_cid(data: bytes, codec: str) -> str:
+    return str(CID('base32', 1, codec, multihash.digest(data, 'sha2-256')))
+
+
+class FakeKuboHandler(BaseHTTPRequestHandler):
+    """
+    Answers the parts of the Kubo RPC API used by IPFSIO, recording what it received
+    """
+    added_files = []
+    blocks = {}
+    raw_blocks = {}
+    cbor_blocks = {}
+    pins = []
+    pin_failures = 0
+    pinned_writes = []
+    calls = []
+    active_requests = 0
+    max_active_requests = 0
+    lock = threading.Lock()
+
+    def read_body(self) -> bytes:
+        if self.headers.get('Transfer-Encoding') == 'chunked':
+            body = b""
+            while True:
+                size = int(self.rfile.readline().strip(), 16)
+                if size == 0:
+                    self.rfile.readline()
+                    return body
+                body += self.rfile.read(size)
+                self.rfile.readline()
+        return self.rfile.read(int(self.headers.get('Content-Length', 0)))
+
+    def send_json_lines(self, entries: list[dict]):
+        body = b"".join(json.dumps(entry).encode() + b"\n" for entry in entries)
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_bytes(self, body: bytes):
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def multipart_parts(self, body: bytes):
+        message = BytesParser(policy=policy.default).parsebytes(
+            f"Content-Type: {self.headers['Content-Type']}\r\n\r\n".encode() + body)
+        return message.iter_parts()
+
+    def do_POST(self):
+        with FakeKuboHandler.lock:
+            FakeKuboHandler.active_requests += 1
+            FakeKuboHandler.max_active_requests = max(FakeKuboHandler.max_active_requests,
+                                                      FakeKuboHandler.active_requests)
+        try:
+            self.handle_api_call()
+        finally:
+            with FakeKuboHandler.lock:
+                FakeKuboHandler.active_requests -= 1
+
+    def handle_api_call(self):
+        body = self.read_body()
+        url = urlsplit(self.path)
+        arg = parse_qs(url.query).get('arg', [None])[0]
+        FakeKuboHandler.calls.append((url.path, arg))
+        if parse_qs(url.query).get('pin') == ['True']:
+            FakeKuboHandler.pinned_writes.append(url.path)
+        if url.path == '/api/v0/pin/add':
+            if FakeKuboHandler.pin_failures:
+                FakeKuboHandler.pin_failures -= 1
+                self.send_response(500)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            FakeKuboHandler.pins.extend(parse_qs(url.query)['arg'])
+            self.send_json_lines([{'Pins': parse_qs(url.query)['arg']}])
+            return
+        if url.path == '/api/v0/dag/put':
+            time.sleep(0.02)
+            content = next(self.multipart_parts(body)).get_payload(decode=True)
+            cid = block_cid(dag_cbor.encode(IPFSIO.dag_json_to_ipld(json.loads(content))), 'dag-cbor')
+            FakeKuboHandler.blocks[cid] = content
+            self.send_json_lines([{'Cid': {'/': cid}}])
+            return
+        if url.path == '/api/v0/block/put':
+            content = next(self.multipart_parts(body)).get_payload(decode=True)
+            cid = block_cid(content, 'raw')
+            FakeKuboHandler.raw_blocks[cid] = content
+            self.send_json_lines([{'Key': cid, 'Size': len(content)}])
+            return
+        if url.path == '/api/v0/dag/import':
+            roots, blocks = read_car(next(self.multipart_parts(body)).get_payload(decode=True))
+            for cid, data in blocks:
+                cid = cid.encode('base32')
+                # the node checks every block against its CID
+                assert block_cid(data, CID.decode(cid).codec.name) == cid
+                if CID.decode(cid).codec.name == 'raw':
+                    FakeKuboHandler.raw_blocks[cid] = data
+                else:
+                    FakeKuboHandler.cbor_blocks[cid] = data
+            roots = [root.encode('base32') for root in roots]
+            if parse_qs(url.query).get('pin-roots') == ['True']:
+                FakeKuboHandler.pins.extend(roots)
+            self.send_json_lines([{'Root': {'Cid': {'/': root}, 'PinErrorMsg': ''}} for root in roots])
+            return
+        if url.path == '/api/v0/block/get' and arg in FakeKuboHandler.cbor_blocks:
+            self.send_bytes(FakeKuboHandler.cbor_blocks[arg])
+            return
+        if url.path == '/api/v0/block/get' and arg in FakeKuboHandler.raw_blocks:
+            self.send_bytes(FakeKuboHandler.raw_blocks[arg])
+            return
+        if url.path == '/api/v0/block/get' and arg in FakeKuboHandler.blocks:
+            self.send_bytes(dag_cbor.encode(IPFSIO.dag_json_to_ipld(json.loads(FakeKuboHandler.blocks[arg]))))
+            return
+        if url.path == '/api/v0/cat' and arg in FakeKuboHandler.raw_blocks:
+            self.send_bytes(FakeKuboHandler.raw_blocks[arg])
+            return
+        if url.path == '/api/v0/cat' and arg in FakeKuboHandler.blocks:
+            self.send_bytes(FakeKuboHandler.blocks[arg])
+            return
+        if url.path == '/api/v0/ls' and arg in FakeKuboHandler.blocks:
+            links = [{'Name': name, 'Hash': cid} for name, cid in json.loads(FakeKuboHandler.blocks[arg]).items()]
+            self.send_json_lines([{'Objects': [{'Hash': arg, 'Links': links}]}])
+            return
+        if url.path == '/api/v0/add':
+            entries = []
+            for part in self.multipart_parts(body):
+                content = part.get_payload(decode=True)
+                name = unquote(part.get_filename())
+                FakeKuboHandler.added_files.append((name, content))
+                entries.append({'Name': name, 'Hash': hashlib.sha256(content).hexdigest(),
+                                'Size': str(len(content))})
+            if parse_qs(url.query).get('wrap-with-directory') == ['True']:
+                directory_hash = str(CID('base58btc', 0, 'dag-pb', multihash.digest(
+                    "".join(entry['Hash'] for entry in entries).encode(), 'sha2-256')))
+                entries.append({'Name': '', 'Hash': directory_hash, 'Size': '0'})
+            self.send_json_lines(entries)
+            return
+        self.send_response(404)
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeKuboServer(ThreadingHTTPServer):
+    # the batch methods open many connections at once
+    request_queue_size = 64
+
+
+class IPFSTestCase(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = FakeKuboServer(('127.0.0.1', 0), FakeKuboHandler)
+        cls.host = f"http://127.0.0.1:{cls.server.server_address[1]}"
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        FakeKuboHandler.added_files = []
+        FakeKuboHandler.blocks = {}
+        FakeKuboHandler.raw_blocks = {}
+        FakeKuboHandler.cbor_blocks = {}
+        FakeKuboHandler.pins = []
+        FakeKuboHandler.pin_failures = 0
+        FakeKuboHandler.pinned_writes = []
+        FakeKuboHandler.calls = []
+        FakeKuboHandler.max_active_requests = 0
+        self.ipfs_io = IPFSIO(host=self.host)
+        self.folder = tempfile.TemporaryDirectory()
+        self.files = {
+            'KALUMBURU.csv': b"dt,TMIN\r\n2023-01-01,1\r\n",
+            'metadata.json': json.dumps({'name': 'bom'}).encode(),
+            'big file.bin': os.urandom(5000),
+        }
+        for name, content in self.files.items():
+            with open(os.path.join(self.folder.name, name), 'wb') as f:
+                f.write(content)
+        self.paths = [os.path.join(self.folder.name, name) for name in self.files]
+
+        self.hashes_folder = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.folder.cleanup()
+        self.hashes_folder.cleanup()
+
+    def ipfs_store(self, **kwargs) -> IPFS:
+        store = IPFS(**kwargs)
+        store.dm = MagicMock()
+        store.dm.__str__.return_value = 'bom'
+        store.ipfs_io = self.ipfs_io
+        store._hash_index = HashIndex(os.path.join(self.hashes_folder.name, 'index.jsonl'))
+        return store
+
+
+class IPFSAddDirectoryTestCase(IPFSTestCase):
+    def test_ipfs_add_directory(self):
+        added = []
+        with patch.object(IPFSIO, 'ADD_BLOCK_SIZE', 1024):
+            directory_hash = self.ipfs_io.ipfs_add_directory(self.paths, on_added=added.append)
+        self.assertEqual(dict(FakeKuboHandler.added_files), self.files)
+        self.assertEqual(len(added), 4)
+        self.assertEqual(added[-1], {'Name': '', 'Hash': directory_hash, 'Size': '0'})
+
+    def test_multipart_stream_opens_one_file_at_a_time(self):
+        open_files = []
+        max_open = []
+
+        class TrackedFile:
+            def __init__(self, path, mode):
+                self.f = open(path, mode)
+
+            def __enter__(self):
+                open_files.append(self)
+                max_open.append(len(open_files))
+                return self.f
+
+            def __exit__(self, *args):
+                open_files.remove(self)
+                self.f.close()
+
+        with patch('nettle.io.ipfs.open', TrackedFile, create=True):
+            body = b"".join(IPFSIO.multipart_files_stream(self.paths, 'boundary', 1024))
+        self.assertEqual(max(max_open), 1)
+        self.assertTrue(body.endswith(b"--boundary--\r\n"))
+        self.assertEqual(body.count(b'name="file"'), 3)
+
+    def test_directory_hash_from_add_response(self):
+        lines = [b'{"Name": "a.csv", "Hash": "h1"}', b'', b'{"Name": "", "Hash": "dir"}']
+        self.assertEqual(IPFSIO.directory_hash_from_add_response(iter(lines)), 'dir')
+        with self.assertRaises(Exception):
+            IPFSIO.directory_hash_from_add_response(iter(lines[:1]))
+
+    def test_store_cp_folder_to_remote(self):
+        store = self.ipfs_store()
+        directory_hash = store.cp_folder_to_remote(self.folder.name)
+        self.assertEqual(store.latest_directory_hash('bom'), directory_hash)
+        self.assertEqual(list(store.directory_hash_history('bom').values()), [directory_hash])
+        self.assertEqual(sorted(name for name, _ in FakeKuboHandler.added_files), sorted(self.files))
+
+
+class IPFSBatchTestCase(IPFSTestCase):
+    def test_put_many_get_many_cat_many(self):
+        objects = [{'station': i} for i in range(12)]
+        self.ipfs_io.max_workers = 4
+        cids = self.ipfs_io.put_many([IPFSIO.json_to_bytes(obj) for obj in objects])
+        self.assertEqual(len(set(cids)), 12)
+        self.assertLessEqual(FakeKuboHandler.max_active_requests, 4)
+        self.assertGreater(FakeKuboHandler.max_active_requests, 1)
+        self.assertEqual(self.ipfs_io.get_many(cids), objects)
+        self.assertEqual(self.ipfs_io.cat_many(cids[:2]), objects[:2])
+        self.assertEqual(self.ipfs_io.put_many([]), [])
+
+    def test_store_write_many(self):
+        store = self.ipfs_store(max_workers=4)
+        hashes = store.write_many({'a.json': {'a': 1}, 'b.json': {'b': 2}})
+        c_hash = store.write('c.json', {'c': 3})
+        self.assertEqual(len(store.hash_index.heads()), 3)
+        self.assertEqual(sorted(hashes), ['a.json', 'b.json'])
+        self.assertEqual(self.ipfs_io.ipfs_get(hashes['b.json']), {'b': 2})
+        self.assertEqual(self.ipfs_io.ipfs_get(c_hash), {'c': 3})
+
+
+class IPFSCacheTestCase(IPFSTestCase):
+    def test_reads_are_cached_by_cid(self):
+        cid = self.ipfs_io.ipfs_put(IPFSIO.json_to_bytes({'KALUMBURU.csv': 'bafyk'}))
+        with tempfile.TemporaryDirectory() as cache_dir:
+            self.ipfs_io.cache = CIDCache(DiskCache(cache_dir))
+            for _ in range(3):
+                self.assertEqual(self.ipfs_io.ipfs_get(cid), {'KALUMBURU.csv': 'bafyk'})
+                self.assertEqual(self.ipfs_io.ipfs_cat(cid), {'KALUMBURU.csv': 'bafyk'})
+                self.assertEqual(self.ipfs_io.ipfs_ls(cid), [{'Name': 'KALUMBURU.csv', 'Hash': 'bafyk'}])
+            reads = [call for call in FakeKuboHandler.calls if call[0] != '/api/v0/dag/put']
+            self.assertEqual(sorted(reads), [('/api/v0/block/get', cid), ('/api/v0/cat', cid), ('/api/v0/ls', cid)])
+            # a fresh client with the same disk cache doesn't ask the node again
+            self.assertEqual(IPFSIO(host=self.host, cache=CIDCache(DiskCache(cache_dir))).ipfs_get(cid),
+                             {'KALUMBURU.csv': 'bafyk'})
+            self.assertEqual(len(FakeKuboHandler.calls), 4)
+
+    def test_missing_cid_is_not_cached(self):
+        self.ipfs_io.cache = CIDCache()
+        for _ in range(2):
+            with self.assertRaises(Exception):
+                self.ipfs_io.ipfs_get('bafkreibm6jg3ux5qumhcn2b3flc3tyu6dmlb4xa7u5bf44yegnrjhc4yeq')
+        self.assertEqual(len(FakeKuboHandler.calls), 2)
+
+
+class IPFSKnownCIDsTestCase(IPFSTestCase):
+    def setUp(self):
+        super().setUp()
+        self.known_cids = KnownCIDs(os.path.join(self.folder.name, 'hashes', 'known_cids.txt'))
+        self.ipfs_io.known_cids = self.known_cids
+
+    def puts(self) -> list:
+        return [call for call in FakeKuboHandler.calls if call[0] in ('/api/v0/dag/put', '/api/v0/block/put')]
+
+    def test_local_cids_match_the_node(self):
+        content = IPFSIO.json_to_bytes({'b': 1, 'a': [1.5, 'x'], 'link': {'/': block_cid(b'hello', 'raw')}})
+        self.assertEqual(self.ipfs_io.dag_cbor_cid(content), self.ipfs_io.ipfs_put(content))
+        self.assertEqual(self.ipfs_io.cid(b'hello', 'raw'),
+                         'bafkreibm6jg3ux5qumhcn2b3flc3tyu6dmlb4xa7u5bf44yegnrjhc4yeq')
+        # the well known CID of an empty dag-cbor map
+        self.assertEqual(self.ipfs_io.dag_cbor_cid(b'{}'),
+                         'bafyreigbtj4x7ip5legnfznufuopl4sg4knzc2cof6duas4b3q2fy6swua')
+        self.assertIsNone(self.ipfs_io.dag_cbor_cid(b'{"too big": 1180591620717411303424}'))
+
+    def test_known_content_is_not_sent_again(self):
+        content = IPFSIO.json_to_bytes({'station': 'KALUMBURU'})
+        cid = self.ipfs_io.ipfs_put(content)
+        self.assertEqual(self.ipfs_io.ipfs_put(content), cid)
+        block_cid_ = self.ipfs_io.ipfs_block_put(b'block')
+        self.assertEqual(self.ipfs_io.ipfs_block_put(b'block'), block_cid_)
+        self.assertEqual(len(self.puts()), 2)
+        # the set is kept on disk for the next run
+        self.assertEqual(len(KnownCIDs(self.known_cids.path)), 2)
+
+    def test_known_cids_pickle(self):
+        self.known_cids.add('bafk')
+        known_cids = pickle.loads(pickle.dumps(self.known_cids))
+        self.assertIn('bafk', known_cids)
+        known_cids.add('bafy')
+        self.assertEqual(len(KnownCIDs(self.known_cids.path)), 2)
+
+    def test_unpinned_content_is_not_known(self):
+        content = IPFSIO.json_to_bytes({'station': 'KALUMBURU'})
+        self.ipfs_io.ipfs_put(content, should_pin=False)
+        self.ipfs_io.ipfs_put(content)
+        self.assertEqual(len(self.puts()), 2)
+
+
+class IPFSHashIndexTestCase(IPFSTestCase):
+    def test_legacy_hash_files(self):
+        store = self.ipfs_store(export_legacy_hashes=True)
+        heads_path = os.path.join(self.hashes_folder.name, 'heads.json')
+        history_path = os.path.join(self.hashes_folder.name, 'history.json')
+        with open(heads_path, 'w') as f:
+            json.dump({'bom': 'bafyold'}, f)
+        store._hash_index = HashIndex(os.path.join(self.hashes_folder.name, 'index.jsonl'), heads_path, history_path)
+        self.assertEqual(store.latest_directory_hash('bom'), 'bafyold')
+        directory_hash = store.cp_folder_to_remote(self.folder.name)
+        with open(heads_path) as f:
+            self.assertEqual(json.load(f), {'bom': directory_hash})
+        with open(history_path) as f:
+            self.assertEqual(list(json.load(f).values()), [directory_hash])
+
+    def test_pickle_reopens_hash_index(self):
+        store = self.ipfs_store()
+        store.hash_index.record({'bom': 'bafy1'})
+        self.assertIsNone(pickle.loads(pickle.dumps(store))._hash_index)
+
+
+class IPFSDataFrameTestCase(IPFSTestCase):
+    def setUp(self):
+        super().setUp()
+        self.store = self.ipfs_store()
+        self.dataframe = pd.DataFrame({
+            'dt': pd.date_range('2000-01-01', periods=3000, freq='D'),
+            'TMIN': [float(i % 37) for i in range(3000)],
+            'station': ['KALUMBURU'] * 3000,
+        })
+
+    def block_gets(self) -> int:
+        return len([call for call in FakeKuboHandler.calls if call[0] == '/api/v0/block/get'])
+
+    def test_put_and_read_dataframe(self):
+        with patch.object(IPFSIO, 'MAX_BLOCK_SIZE', 8 * 1024):
+            cid = self.store.put_dataframe(self.dataframe.sample(frac=1, random_state=0))
+        manifest = self.ipfs_io.ipfs_get(cid)
+        self.assertGreater(len(manifest['chunks']), 2)
+        self.assertEqual(sum(chunk['rows'] for chunk in manifest['chunks']), 3000)
+        self.assertTrue(all(chunk['size'] <= 8 * 1024 for chunk in manifest['chunks']))
+        self.assertEqual(manifest['chunks'][0]['start'], '2000-01-01 00:00:00')
+        self.assertEqual(set(FakeKuboHandler.raw_blocks),
+                         {self.ipfs_io.cid_string(chunk['data']) for chunk in manifest['chunks']})
+        pd.testing.assert_frame_equal(self.store.read_dataframe(cid), self.dataframe)
+
+    def test_read_dataframe_time_range(self):
+        with patch.object(IPFSIO, 'MAX_BLOCK_SIZE', 8 * 1024):
+            cid = self.store.put_dataframe(self.dataframe)
+        chunks = len(self.ipfs_io.ipfs_get(cid)['chunks'])
+        gets = self.block_gets()
+        dataframe = self.store.read_dataframe(cid, start='2005-03-01', end='2005-03-10', columns=['TMIN'])
+        self.assertEqual(list(dataframe.columns), ['TMIN'])
+        self.assertEqual(len(dataframe), 10)
+        # only the chunks holding those dates were fetched
+        self.assertLess(self.block_gets() - gets, chunks)
+
+    def test_write_dataframe_and_legacy_csv(self):
+        hashes = self.store.write_many({'KALUMBURU.parquet': self.dataframe.head(5), 'metadata.json': {'a': 1}})
+        self.assertEqual(len(self.store.read_dataframe(hashes['KALUMBURU.parquet'])), 5)
+        legacy_cid = self.ipfs_io.ipfs_put(IPFSIO.json_to_bytes({'csv': 'dt,TMIN\n2023-01-01,1\n'}))
+        pd.testing.assert_frame_equal(self.store.read_dataframe(legacy_cid),
+                                      pd.DataFrame({'dt': ['2023-01-01'], 'TMIN': [1]}))
+
+
+class IPFSDagLayoutTestCase(IPFSTestCase):
+    def setUp(self):
+        super().setUp()
+        self.store = self.ipfs_store(layout='dag')
+
+    def puts(self) -> list:
+        return [call[0] for call in FakeKuboHandler.calls if call[0] in ('/api/v0/dag/put', '/api/v0/block/put')]
+
+    def write_file(self, name: str, content: bytes):
+        with open(os.path.join(self.folder.name, name), 'wb') as f:
+            f.write(content)
+
+    def test_publish_only_changed_files(self):
+        first_root = self.store.cp_folder_to_remote(self.folder.name)
+        entries = self.store.dag_entries(first_root)
+        self.assertEqual(sorted(entries), sorted(self.files))
+        for name, content in self.files.items():
+            self.assertEqual(self.store.read_dag_file(first_root, name), content)
+
+        FakeKuboHandler.calls = []
+        self.write_file('KALUMBURU.csv', b"dt,TMIN\r\n2023-01-02,2\r\n")
+        second_root = self.store.cp_folder_to_remote(self.folder.name)
+        # the changed file and the new root
+        self.assertEqual(sorted(self.puts()), ['/api/v0/block/put', '/api/v0/dag/put'])
+        self.assertEqual(self.ipfs_io.ipfs_get(second_root)['previous hash'], first_root)
+        self.assertEqual(self.store.latest_directory_hash('bom'), second_root)
+        new_entries = self.store.dag_entries(second_root)
+        self.assertEqual(new_entries['metadata.json'], entries['metadata.json'])
+        self.assertNotEqual(new_entries['KALUMBURU.csv'], entries['KALUMBURU.csv'])
+
+    def test_sharded_publish_only_puts_changed_shards(self):
+        for i in range(20):
+            self.write_file(f'STATION_{i}.csv', f"dt,TMIN\n2023-01-01,{i}\n".encode())
+        with patch.object(IPFS, 'DAG_SHARD_THRESHOLD', 4):
+            first_root = self.store.cp_folder_to_remote(self.folder.name)
+            shards = self.ipfs_io.ipfs_get(first_root)['shards']
+            self.assertGreater(len(shards), 1)
+            FakeKuboHandler.calls = []
+            self.write_file('STATION_3.csv', b"dt,TMIN\n2023-01-02,3\n")
+            second_root = self.store.cp_folder_to_remote(self.folder.name)
+        # the changed file, its shard and the new root
+        self.assertEqual(sorted(self.puts()), ['/api/v0/block/put', '/api/v0/dag/put', '/api/v0/dag/put'])
+        self.assertEqual(len(self.store.dag_entries(second_root)), 23)
+        self.assertEqual(self.store.read_dag_file(second_root, 'STATION_3.csv'), b"dt,TMIN\n2023-01-02,3\n")
+
+    def test_previous_directory_layout(self):
+        directory_hash = self.ipfs_store().cp_folder_to_remote(self.folder.name)
+        root = self.store.cp_folder_to_remote(self.folder.name)
+        self.assertEqual(self.ipfs_io.ipfs_get(root)['previous hash'], directory_hash)
+        self.assertEqual(sorted(self.store.dag_entries(root)), sorted(self.files))
+
+
+class IPFSCarLayoutTestCase(IPFSTestCase):
+    def setUp(self):
+        super().setUp()
+        self.store = self.ipfs_store(layout='car')
+
+    def test_car_writer(self):
+        car_path = os.path.join(self.hashes_folder.name, 'test.car')
+        cids = [block_cid(data, 'raw') for data in (b'a', b'b')]
+        with CARWriter(car_path) as car:
+            for cid, data in zip(cids + cids, (b'a', b'b', b'a', b'b')):
+                car.add(cid, data)
+            car.roots = cids[:1]
+        self.assertEqual(len(car), 2)
+        self.assertEqual(os.listdir(self.hashes_folder.name), ['test.car'])
+        with open(car_path, 'rb') as f:
+            roots, blocks = read_car(f.read())
+        self.assertEqual([root.encode('base32') for root in roots], cids[:1])
+        self.assertEqual([(cid.encode('base32'), data) for cid, data in blocks], list(zip(cids, (b'a', b'b'))))
+
+    def test_publish_with_a_single_import(self):
+        with patch.object(IPFSIO, 'MAX_BLOCK_SIZE', 1024):
+            root = self.store.cp_folder_to_remote(self.folder.name)
+        self.assertEqual([call[0] for call in FakeKuboHandler.calls], ['/api/v0/dag/import'])
+        self.assertEqual(FakeKuboHandler.pins, [root])
+        self.assertTrue(os.path.exists(f"{self.folder.name}.car"))
+        self.assertEqual(self.store.latest_directory_hash('bom'), root)
+        entries = self.store.dag_entries(root)
+        # the 5000 bytes file is split in 1024 bytes blocks
+        self.assertEqual(len(entries['big file.bin']['chunks']), 5)
+        for name, content in self.files.items():
+            self.assertEqual(entries[name]['sha256'], hashlib.sha256(content).hexdigest())
+            self.assertEqual(self.store.read_dag_file(root, name), content)
+
+    def test_same_dag_as_dag_layout(self):
+        car_root = self.store.cp_folder_to_remote(self.folder.name)
+        dag_store = self.ipfs_store(layout='dag')
+        dag_store._hash_index = HashIndex(os.path.join(self.hashes_folder.name, 'dag_index.jsonl'))
+        self.assertEqual(dag_store.cp_folder_to_remote(self.folder.name), car_root)
+        # and the dag layout patches a root imported from a CAR
+        with open(os.path.join(self.folder.name, 'metadata.json'), 'wb') as f:
+            f.write(b'{}')
+        self.store.layout = 'dag'
+        root = self.store.cp_folder_to_remote(self.folder.name)
+        self.assertEqual(self.ipfs_io.ipfs_get(root)['previous hash'], car_root)
+        self.assertEqual(self.store.read_dag_file(root, 'metadata.json'), b'{}')
+
+
+class IPFSDeferredPinsTestCase(IPFSTestCase):
+    def test_pin_many_in_batches_with_retries(self):
+        cids = [block_cid(str(i).encode(), 'raw') for i in range(5)]
+        FakeKuboHandler.pin_failures = 1
+        progress = []
+        with patch.object(IPFSIO, 'PIN_BATCH_SIZE', 2), patch.object(IPFSIO, 'PIN_RETRY_DELAY', 0):
+            pinned = self.ipfs_io.pin_many(cids + cids[:1], on_progress=lambda *args: progress.append(args))
+        self.assertEqual(pinned, cids)
+        self.assertEqual(FakeKuboHandler.pins, cids)
+        self.assertEqual(progress, [(2, 5), (4, 5), (5, 5)])
+        # the first batch failed once
+        self.assertEqual([call[0] for call in FakeKuboHandler.calls].count('/api/v0/pin/add'), 4)
+
+    def test_pin_many_raises_after_attempts(self):
+        FakeKuboHandler.pin_failures = IPFSIO.PIN_ATTEMPTS
+        with patch.object(IPFSIO, 'PIN_RETRY_DELAY', 0), self.assertRaises(requests.HTTPError):
+            self.ipfs_io.pin_many([block_cid(b'a', 'raw')])
+
+    def test_put_local_file_is_deferred(self):
+        store = self.ipfs_store(defer_pins=True)
+        file_hash = store.put_local_file(self.paths[0])
+        self.assertEqual(FakeKuboHandler.pinned_writes, [])
+        self.assertEqual(store.pending_pins, [file_hash])
+        self.assertEqual(store.pin_pending(), [file_hash])
+        self.assertEqual(FakeKuboHandler.pins, [file_hash])
+
+    def test_store_pins_roots_once_published(self):
+        for layout in ('directory', 'dag', 'car'):
+            with self.subTest(layout=layout):
+                FakeKuboHandler.pins = []
+                FakeKuboHandler.pinned_writes = []
+                store = self.ipfs_store(layout=layout, defer_pins=True)
+                metadata_hash = store.write('metadata.json', {'name': 'bom'})
+                dataframe_hash = store.write('KALUMBURU', pd.DataFrame({'dt': ['2023-01-01'], 'TMIN': [1.0]}))
+                self.assertEqual(FakeKuboHandler.pins, [])
+                root = store.cp_folder_to_remote(self.folder.name)
+                self.assertEqual(FakeKuboHandler.pinned_writes, [])
+                self.assertEqual(FakeKuboHandler.pins, [metadata_hash, dataframe_hash, root])
+                self.assertEqual(store.pending_pins, [])
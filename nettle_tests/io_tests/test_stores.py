@@ -1,12 +1,21 @@
 from unittest import TestCase
 from unittest.mock import patch
+from unittest.mock import MagicMock
 from nettle.io.store import S3
+from nettle.io import store
 from nettle.io.store import Local
+from nettle.io.store import read_csv_edges
+from nettle.io.store import compression_suffix
+from nettle.io.disk_cache import DiskCache
 import s3fs
 import botocore
 import os
+import gzip
+import hashlib
+import tempfile
 import fsspec
 import pandas as pd
+import pyarrow.parquet as pq
 import nettle_tests
 
 s3_bucket_name = "arbol-station-dev"
@@ -30,6 +39,340 @@ class StoreTestCase(TestCase):
                 raise Exception()
 
 
+class ParquetTestCase(TestCase):
+    def setUp(self):
+        with patch('nettle.utils.log_info.LogInfo') as MockClass:
+            log = MockClass.return_value
+        self.folder = tempfile.TemporaryDirectory()
+        self.local_store = Local(log=log, base_folder=self.folder.name, parquet_row_group_size=10)
+        self.dataframe = pd.DataFrame(data={
+            'dt': pd.date_range('2023-01-01', periods=100),
+            'TMIN': [float(day) for day in range(100)],
+            'TMAX': [float(day) + 10 for day in range(100)]
+        })
+        self.local_store.write('KALUMBURU.parquet', self.dataframe)
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def test_round_trip(self):
+        pd.testing.assert_frame_equal(self.local_store.read('KALUMBURU.parquet'), self.dataframe, check_dtype=False)
+
+    def test_compression_and_row_groups(self):
+        metadata = pq.ParquetFile(os.path.join(self.folder.name, 'KALUMBURU.parquet')).metadata
+        self.assertEqual(metadata.num_row_groups, 10)
+        self.assertEqual(metadata.row_group(0).column(0).compression, 'ZSTD')
+        self.local_store.write('SNAPPY.parquet', self.dataframe, compression='snappy')
+        metadata = pq.ParquetFile(os.path.join(self.folder.name, 'SNAPPY.parquet')).metadata
+        self.assertEqual(metadata.row_group(0).column(0).compression, 'SNAPPY')
+
+    def test_read_columns_and_dates(self):
+        df = self.local_store.read('KALUMBURU.parquet', columns=['dt', 'TMAX'],
+                                   start=pd.Timestamp('2023-02-01'), end=pd.Timestamp('2023-02-10'))
+        self.assertEqual(list(df.columns), ['dt', 'TMAX'])
+        self.assertEqual(len(df), 10)
+        self.assertEqual(df['dt'].iloc[0], pd.Timestamp('2023-02-01'))
+        self.assertEqual(df['TMAX'].iloc[-1], 50.0)
+
+
+class S3ListingSnapshotTestCase(TestCase):
+    def setUp(self):
+        with patch('nettle.utils.log_info.LogInfo') as MockClass:
+            log = MockClass.return_value
+        self.s3_store = S3(bucket='bucket', log=log, snapshot_listings=True)
+        self.s3_store._fs = MagicMock()
+        self.s3_store._fs.find.return_value = {
+            'bucket/bom/daily/KALUMBURU.csv': {'name': 'bucket/bom/daily/KALUMBURU.csv', 'size': 10, 'ETag': '"e1"'}
+        }
+        self.s3_store.snapshot_listing('bom/daily')
+
+    def test_snapshot_lists_prefix(self):
+        self.s3_store._fs.find.assert_called_once_with('bucket/bom/daily', detail=True)
+
+    def test_existence_from_snapshot(self):
+        self.assertTrue(self.s3_store.has_existing_file('bom/daily/KALUMBURU.csv'))
+        self.assertFalse(self.s3_store.has_existing_file('bom/daily/TRUSCOTT.csv'))
+        self.s3_store._fs.exists.assert_not_called()
+        # paths outside the snapshot are still asked to S3
+        self.s3_store.has_existing_file('other/daily/TRUSCOTT.csv')
+        self.s3_store._fs.exists.assert_called_once()
+
+    def test_file_info_from_snapshot(self):
+        self.assertEqual(self.s3_store.file_info('s3://bucket/bom/daily/KALUMBURU.csv')['ETag'], '"e1"')
+        with self.assertRaises(FileNotFoundError):
+            self.s3_store.file_info('s3://bucket/bom/daily/TRUSCOTT.csv')
+        self.s3_store._fs.info.assert_not_called()
+
+    def test_snapshot_updated_on_writes(self):
+        self.s3_store.write('bom/daily/TRUSCOTT.geojson', {'type': 'FeatureCollection'})
+        self.assertTrue(self.s3_store.has_existing_file('bom/daily/TRUSCOTT.geojson'))
+        # the ETag of a file we wrote is unknown, so it is asked again
+        self.s3_store.write('bom/daily/KALUMBURU.csv', pd.DataFrame(data={'dt': ['2023-01-01']}))
+        self.s3_store.file_info('s3://bucket/bom/daily/KALUMBURU.csv')
+        self.s3_store._fs.info.assert_called_once()
+
+    def test_cat_many_skips_known_missing(self):
+        self.s3_store._fs._strip_protocol = s3fs.S3FileSystem._strip_protocol
+        self.s3_store._fs.cat.return_value = {'bucket/bom/daily/KALUMBURU.csv': b'dt\n2023-01-01\n'}
+        contents = self.s3_store.cat_many(['bom/daily/KALUMBURU.csv', 'bom/daily/TRUSCOTT.csv'])
+        self.s3_store._fs.cat.assert_called_once_with(['bucket/bom/daily/KALUMBURU.csv'], on_error='omit')
+        self.assertEqual(list(contents), ['bom/daily/KALUMBURU.csv'])
+
+
+class S3SyncTestCase(TestCase):
+    def setUp(self):
+        with patch('nettle.utils.log_info.LogInfo') as MockClass:
+            log = MockClass.return_value
+        self.folder = tempfile.TemporaryDirectory()
+        self.local_path = os.path.join(self.folder.name, 'bom-daily')
+        os.makedirs(self.local_path)
+        for name, content in [('A.csv', b'same'), ('B.csv', b'changed'), ('C.csv', b'new')]:
+            with open(os.path.join(self.local_path, name), 'wb') as f:
+                f.write(content)
+        self.s3_store = S3(bucket='bucket', log=log, sync_uploads=True, upload_concurrency=4)
+        self.s3_store._fs = MagicMock()
+        self.s3_store._fs.find.return_value = {
+            'bucket/bom/bom-daily/A.csv': {'size': 4, 'ETag': f'"{hashlib.md5(b"same").hexdigest()}"'},
+            'bucket/bom/bom-daily/B.csv': {'size': 3, 'ETag': '"old"'},
+        }
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def test_only_new_or_changed_files_are_uploaded(self):
+        self.s3_store.cp_folder_to_remote(self.local_path, 'bom')
+        self.s3_store._fs.put.assert_called_once_with(
+            [os.path.join(self.local_path, 'B.csv'), os.path.join(self.local_path, 'C.csv')],
+            ['s3://bucket/bom/bom-daily/B.csv', 's3://bucket/bom/bom-daily/C.csv'],
+            batch_size=4, chunksize=self.s3_store.multipart_chunksize)
+        report = self.s3_store.last_sync_report
+        self.assertEqual(report.skipped, ['s3://bucket/bom/bom-daily/A.csv'])
+        self.assertEqual((report.bytes_uploaded, report.bytes_skipped), (10, 4))
+        self.assertTrue(os.path.exists(f"{self.local_path}.sync_manifest.json"))
+
+    def test_multipart_etag_recognised_from_manifest(self):
+        local_filepath = os.path.join(self.local_path, 'A.csv')
+        self.s3_store._fs.find.return_value = {}
+        self.assertFalse(S3.remote_file_unchanged(local_filepath, {'size': 4, 'ETag': '"abc-2"'}, None))
+        manifest_entry = {'md5': hashlib.md5(b'same').hexdigest(), 'etag': 'abc-2'}
+        self.assertTrue(S3.remote_file_unchanged(local_filepath, {'size': 4, 'ETag': '"abc-2"'}, manifest_entry))
+
+    def test_without_sync_every_file_is_uploaded(self):
+        self.s3_store.sync_uploads = False
+        self.s3_store.cp_folder_to_remote(self.local_path, 'bom')
+        self.assertEqual(len(self.s3_store._fs.put.call_args.args[0]), 3)
+        self.s3_store._fs.find.assert_not_called()
+        self.s3_store._fs.touch.assert_not_called()
+
+
+class S3AppendTestCase(TestCase):
+    def setUp(self):
+        with patch('nettle.utils.log_info.LogInfo') as MockClass:
+            log = MockClass.return_value
+        self.s3_store = S3(bucket='bucket', log=log)
+        self.s3_store._fs = MagicMock()
+        self.s3_store._fs.split_path.return_value = ('bucket', 'bom/KALUMBURU.csv', None)
+        self.s3_store._fs.call_s3.side_effect = lambda method, **kwargs: {
+            'create_multipart_upload': {'UploadId': 'u1'},
+            'upload_part_copy': {'CopyPartResult': {'ETag': f'"copy{kwargs.get("PartNumber")}"'}},
+            'upload_part': {'ETag': '"rows"'},
+        }.get(method, {})
+        self.new_rows = pd.DataFrame(data={'dt': ['2023-01-02'], 'TMIN': ['2']})
+
+    def test_small_object_is_rewritten(self):
+        self.s3_store._fs.size.return_value = 14
+        self.s3_store._fs.cat_file.return_value = b'dt,TMIN\n2023-01-01,1'
+        self.s3_store.append_csv('bom/KALUMBURU.csv', self.new_rows)
+        self.s3_store._fs.pipe_file.assert_called_once_with(
+            's3://bucket/bom/KALUMBURU.csv', b'dt,TMIN\n2023-01-01,1\n2023-01-02,2\n')
+        self.s3_store._fs.call_s3.assert_not_called()
+
+    def test_large_object_is_copied_server_side(self):
+        self.s3_store._fs.size.return_value = 10
+        self.s3_store._fs.cat_file.return_value = b'\n'
+        with patch.object(store, 'S3_MIN_PART_SIZE', 4), patch.object(store, 'S3_MAX_PART_SIZE', 6):
+            self.s3_store.append_csv('bom/KALUMBURU.csv', self.new_rows)
+        # only the last byte is read and only the new rows are uploaded
+        self.s3_store._fs.cat_file.assert_called_once_with('s3://bucket/bom/KALUMBURU.csv', start=9, end=10)
+        calls = self.s3_store._fs.call_s3.call_args_list
+        self.assertEqual([call.args[0] for call in calls], [
+            'create_multipart_upload', 'upload_part_copy', 'upload_part_copy', 'upload_part',
+            'complete_multipart_upload'])
+        self.assertEqual([calls[i].kwargs['CopySourceRange'] for i in (1, 2)], ['bytes=0-4', 'bytes=5-9'])
+        self.assertEqual(calls[3].kwargs['Body'], b'2023-01-02,2\n')
+        self.assertEqual(calls[4].kwargs['MultipartUpload'], {'Parts': [
+            {'PartNumber': 1, 'ETag': '"copy1"'}, {'PartNumber': 2, 'ETag': '"copy2"'},
+            {'PartNumber': 3, 'ETag': '"rows"'}]})
+
+    def test_failed_append_is_aborted(self):
+        self.s3_store._fs.size.return_value = 10
+        self.s3_store._fs.cat_file.return_value = b'\n'
+        self.s3_store._fs.call_s3.side_effect = lambda method, **kwargs: \
+            {'UploadId': 'u1'} if method == 'create_multipart_upload' else self.fail_upload(method)
+        with patch.object(store, 'S3_MIN_PART_SIZE', 4), self.assertRaises(botocore.exceptions.ClientError):
+            store.s3_append_csv(self.s3_store._fs, 's3://bucket/bom/KALUMBURU.csv', self.new_rows)
+        self.assertEqual(self.s3_store._fs.call_s3.call_args_list[-1].args[0], 'abort_multipart_upload')
+
+    @staticmethod
+    def fail_upload(method):
+        if method == 'abort_multipart_upload':
+            return {}
+        raise botocore.exceptions.ClientError({'Error': {'Code': 'InternalError'}}, method)
+
+
+class CompressionTestCase(TestCase):
+    def setUp(self):
+        with patch('nettle.utils.log_info.LogInfo') as MockClass:
+            log = MockClass.return_value
+        self.folder = tempfile.TemporaryDirectory()
+        self.local_store = Local(log=log, base_folder=self.folder.name)
+        self.dataframe = pd.DataFrame(data={'dt': ['2023-01-01', '2023-01-02'], 'TMIN': ['1', '2']})
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def test_file_type(self):
+        self.assertEqual(Local.file_type('KALUMBURU.csv.gz'), 'csv')
+        self.assertEqual(Local.file_type('stations.geojson.zst'), 'geojson')
+        self.assertEqual(Local.file_type('KALUMBURU.csv'), 'csv')
+
+    def test_compression_suffix(self):
+        self.assertEqual(compression_suffix('gzip'), '.gz')
+        self.assertEqual(compression_suffix(None), '')
+        with self.assertRaises(ValueError):
+            compression_suffix('brotli')
+
+    def test_write_read_gzip(self):
+        self.local_store.write('KALUMBURU.csv.gz', self.dataframe)
+        self.local_store.write('KALUMBURU.geojson.gz', {'type': 'FeatureCollection'})
+        with gzip.open(os.path.join(self.folder.name, 'KALUMBURU.csv.gz'), 'rt') as f:
+            self.assertEqual(f.readline().strip(), 'dt,TMIN')
+        pd.testing.assert_frame_equal(self.local_store.read('KALUMBURU.csv.gz'), self.dataframe)
+        self.assertEqual(self.local_store.read('KALUMBURU.geojson.gz'), {'type': 'FeatureCollection'})
+        contents = self.local_store.read_many(['KALUMBURU.csv.gz', 'KALUMBURU.geojson.gz'])
+        pd.testing.assert_frame_equal(contents['KALUMBURU.csv.gz'], self.dataframe)
+        self.assertEqual(contents['KALUMBURU.geojson.gz'], {'type': 'FeatureCollection'})
+
+    def test_read_gzip_through_cache(self):
+        with tempfile.TemporaryDirectory() as cache_dir:
+            self.local_store.cache = DiskCache(cache_dir)
+            self.local_store.write('KALUMBURU.csv.gz', self.dataframe)
+            pd.testing.assert_frame_equal(self.local_store.read('KALUMBURU.csv.gz'), self.dataframe)
+
+    def test_write_read_zstd(self):
+        try:
+            import zstandard  # noqa: F401
+        except ImportError:
+            with self.assertRaises(ImportError):
+                self.local_store.write('KALUMBURU.csv.zst', self.dataframe)
+            return
+        self.local_store.write('KALUMBURU.csv.zst', self.dataframe)
+        pd.testing.assert_frame_equal(self.local_store.read('KALUMBURU.csv.zst'), self.dataframe)
+
+
+class ReadCacheTestCase(TestCase):
+    def setUp(self):
+        with patch('nettle.utils.log_info.LogInfo') as MockClass:
+            log = MockClass.return_value
+        self.folder = tempfile.TemporaryDirectory()
+        self.cache_folder = tempfile.TemporaryDirectory()
+        self.local_store = Local(log=log, base_folder=self.folder.name,
+                                 cache=DiskCache(self.cache_folder.name, max_bytes=1024 ** 2))
+        self.local_store.write('KALUMBURU.geojson', {'version': 1})
+
+    def tearDown(self):
+        self.folder.cleanup()
+        self.cache_folder.cleanup()
+
+    def test_unchanged_file_is_served_from_cache(self):
+        self.assertEqual(self.local_store.read('KALUMBURU.geojson'), {'version': 1})
+        with patch.object(self.local_store.fs(), 'cat_file') as cat_file:
+            self.assertEqual(self.local_store.read('KALUMBURU.geojson'), {'version': 1})
+        cat_file.assert_not_called()
+
+    def test_changed_file_is_fetched_again(self):
+        self.local_store.read('KALUMBURU.geojson')
+        self.local_store.write('KALUMBURU.geojson', {'version': 22})
+        self.assertEqual(self.local_store.read('KALUMBURU.geojson'), {'version': 22})
+
+    def test_ttl_skips_revalidation(self):
+        self.local_store.cache_ttl = 60
+        self.local_store.read('KALUMBURU.geojson')
+        with patch.object(self.local_store.fs(), 'info') as info:
+            self.assertEqual(self.local_store.read('KALUMBURU.geojson'), {'version': 1})
+        info.assert_not_called()
+
+    def test_missing_file(self):
+        self.assertIsNone(self.local_store.read('MISSING.geojson'))
+
+    def test_parquet_through_cache(self):
+        dataframe = pd.DataFrame(data={'dt': ['2023-01-01', '2023-01-02'], 'TMIN': ['1', '2']})
+        self.local_store.write('KALUMBURU.parquet', dataframe)
+        self.local_store.read('KALUMBURU.parquet')
+        df = self.local_store.read('KALUMBURU.parquet', columns=['dt'], start='2023-01-02')
+        self.assertEqual(list(df['dt']), ['2023-01-02'])
+        self.assertEqual(list(df.columns), ['dt'])
+
+
+class CsvEdgesTestCase(TestCase):
+    def setUp(self):
+        with patch('nettle.utils.log_info.LogInfo') as MockClass:
+            log = MockClass.return_value
+        self.folder = tempfile.TemporaryDirectory()
+        self.local_store = Local(log=log, base_folder=self.folder.name)
+        self.dataframe = pd.DataFrame(data={
+            'dt': [f"2023-01-{day:02}" for day in range(1, 29)],
+            'TMIN': [str(day) for day in range(1, 29)]
+        })
+        self.local_store.write('KALUMBURU.csv', self.dataframe)
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def test_read_csv_edges(self):
+        head, tail = self.local_store.read_csv_edges('KALUMBURU.csv')
+        self.assertEqual(list(head.columns), ['dt', 'TMIN'])
+        self.assertEqual(list(head['dt']), ['2023-01-01'])
+        self.assertEqual(tail['dt'].iloc[-1], '2023-01-28')
+
+    def test_read_csv_edges_small_blocks(self):
+        # blocks smaller than a row force both reads to grow
+        head, tail = read_csv_edges(self.local_store.fs(), os.path.join(self.folder.name, 'KALUMBURU.csv'), block_size=4)
+        self.assertEqual(list(head['dt']), ['2023-01-01'])
+        self.assertEqual(list(tail['TMIN'])[-1], '28')
+        self.assertTrue(set(tail['dt']).issubset(self.dataframe['dt']))
+
+    def test_read_string_dtype(self):
+        self.local_store.string_dtype = 'string[pyarrow]'
+        csv = self.local_store.read('KALUMBURU.csv')
+        self.assertEqual(list(csv.dtypes), [pd.StringDtype('pyarrow')] * 2)
+        self.local_store.write('KALUMBURU.parquet', csv)
+        parquet = self.local_store.read('KALUMBURU.parquet', start='2023-01-10')
+        self.assertEqual(list(parquet.dtypes), [pd.StringDtype('pyarrow')] * 2)
+        self.assertEqual(parquet['dt'].iloc[0], '2023-01-10')
+
+    def test_read_many(self):
+        self.local_store.write('KALUMBURU.geojson', {'type': 'FeatureCollection'})
+        contents = self.local_store.read_many(['KALUMBURU.geojson', 'KALUMBURU.csv', 'MISSING.geojson'])
+        self.assertEqual(sorted(contents), ['KALUMBURU.csv', 'KALUMBURU.geojson'])
+        self.assertEqual(contents['KALUMBURU.geojson'], {'type': 'FeatureCollection'})
+        pd.testing.assert_frame_equal(contents['KALUMBURU.csv'], self.dataframe)
+
+    def test_read_csv_edges_missing_file(self):
+        self.assertIsNone(self.local_store.read_csv_edges('MISSING.csv'))
+
+    def test_append_csv(self):
+        new_rows = pd.DataFrame(data={'dt': ['2023-01-29'], 'TMIN': ['29']})
+        self.local_store.append_csv('KALUMBURU.csv', new_rows)
+        # a file without a trailing newline still gets its rows on new lines
+        with open(os.path.join(self.folder.name, 'KALUMBURU.csv'), 'rb+') as f:
+            f.truncate(os.path.getsize(f.name) - 1)
+        self.local_store.append_csv('KALUMBURU.csv', pd.DataFrame(data={'dt': ['2023-01-30'], 'TMIN': ['30']}))
+        combined = self.local_store.read('KALUMBURU.csv')
+        self.assertEqual(len(combined), 30)
+        self.assertEqual(list(combined['dt'])[-2:], ['2023-01-29', '2023-01-30'])
+
+
 # class S3StoreTestCase(TestCase):
 #     def setUp(self):
 #         with patch('nettle.utils.log_info.LogInfo') as MockClass:
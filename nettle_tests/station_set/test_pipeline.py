@@ -0,0 +1,103 @@
+import os
+import logging
+import pandas as pd
+from unittest import TestCase
+from unittest.mock import patch, MagicMock
+from nettle.io.store import Local
+from nettle.errors.custom_errors import FailedStationException
+from nettle.station_set import StationSet
+from nettle.utils.transform_pool import transform_station
+from nettle_tests.fixtures.bom_test import BOMTest
+import nettle_tests
+
+nettle_tests_dir = os.path.dirname(nettle_tests.__file__)
+
+
+class PipelineTestCase(TestCase):
+    def setUp(self):
+        self.log = logging.getLogger('').log
+        self.etl = BOMTest(
+            log=self.log,
+            store=Local(),
+            custom_dict_path=f"{nettle_tests_dir}/fixtures/"
+        )
+
+    def test_extract_station(self):
+        station_df = pd.DataFrame(data={'dt': ['2023-08-26'], 'TMIN': ['1']})
+        with patch.object(self.etl, 'get_dfs_with_formatted_data', return_value=station_df) as get_dfs:
+            with patch.object(self.etl, 'get_new_start', return_value='2023-08-01'):
+                self.assertIs(self.etl.extract_station('KALUMBURU'), station_df)
+        get_dfs.assert_called_once_with(new_start='2023-08-01', station_id='KALUMBURU')
+
+    def test_pipeline_requires_extract_station(self):
+        with patch.object(BOMTest, 'extract_station', StationSet.extract_station):
+            with self.assertRaises(NotImplementedError):
+                self.etl.pipeline()
+
+    def test_pipeline_extract_station_stops_failed_station(self):
+        with patch.object(self.etl, 'extract_station') as extract_station:
+            extract_station.side_effect = FailedStationException('source offline')
+            with self.assertLogs('', level='INFO'):
+                with self.assertRaises(FailedStationException):
+                    self.etl.pipeline_extract_station('A')
+        self.assertNotIn('A', self.etl.failed_extracts)
+
+    def test_extract_failure_is_not_a_transform_failure(self):
+        # a subclass's own extract loop, the station keeps its raw file from an earlier run
+        with self.assertLogs('', level='ERROR'):
+            with self.etl.check_station_extract_loop('KALUMBURU'):
+                raise FailedStationException('source 503')
+        self.assertEqual(self.etl.failed_extracts, {'KALUMBURU': 'source 503'})
+        with patch.object(self.etl, 'single_station_transform'):
+            result = transform_station(self.etl, 'KALUMBURU')
+        self.assertTrue(result.succeeded)
+
+    def test_pipeline_extract_station_raises_when_raw_file_missing(self):
+        with patch.object(self.etl, 'extract_station', return_value=pd.DataFrame()), \
+                patch.object(self.etl, 'save_raw_dataframe'):
+            with self.assertLogs('', level='INFO'):
+                with self.assertRaises(FailedStationException):
+                    self.etl.pipeline_extract_station('NOT_SAVED_STATION')
+
+    def test_processed_station_file_names(self):
+        self.assertEqual(self.etl.processed_station_file_names('kalumburu'), ['KALUMBURU.csv', 'KALUMBURU.geojson'])
+
+    def test_pipeline(self):
+        raw_dataframe = pd.DataFrame(data={'dt': ['2023-08-26'], 'TMIN': ['1']})
+        with patch.object(self.etl, 'stations_to_extract', return_value=['A', 'B']), \
+                patch.object(self.etl, 'extract_station', return_value=raw_dataframe), \
+                patch.object(self.etl, 'save_raw_dataframe') as save_raw_dataframe, \
+                patch.object(self.etl.local_store, 'has_existing_file', return_value=True), \
+                patch.object(self.etl, 'single_station_transform') as single_station_transform, \
+                patch.object(self.etl, 'upload_processed_file') as upload_processed_file, \
+                patch.object(self.etl, 'save_combined_metadata_files'), \
+                patch.object(self.etl, 'write_transform_metrics'):
+            single_station_transform.side_effect = \
+                lambda station_id: self.etl.failed_stations.update({'B': 'bad data'}) if station_id == 'B' else None
+            with self.assertLogs('', level='INFO'):
+                self.etl.pipeline()
+
+        self.assertEqual(save_raw_dataframe.call_count, 2)
+        uploaded = sorted(call.args[0] for call in upload_processed_file.call_args_list)
+        self.assertEqual(uploaded, ['A.csv', 'A.geojson', 'metadata.json', 'stations.geojson'])
+        failed = [result for result in self.etl.transform_results if not result.succeeded]
+        self.assertEqual([result.station_id for result in failed], ['B'])
+
+    def test_pipeline_pins_ipfs_uploads_once_loaded(self):
+        self.etl.store = MagicMock()
+        self.etl.store.name.return_value = 'ipfs'
+        with patch.object(self.etl, 'stations_to_extract', return_value=[]), \
+                patch.object(self.etl, 'save_combined_metadata_files'), \
+                patch.object(self.etl, 'write_transform_metrics'):
+            with self.assertLogs('', level='INFO'):
+                self.etl.pipeline()
+        self.assertEqual([call[0] for call in self.etl.store.method_calls if call[0] != 'name'][-2:],
+                         ['cp_local_folder_to_remote', 'pin_pending'])
+
+    def test_pipeline_transform_station_raises_on_failed_station(self):
+        with patch.object(self.etl, 'single_station_transform') as single_station_transform:
+            single_station_transform.side_effect = \
+                lambda station_id: self.etl.failed_stations.update({station_id: 'bad data'})
+            with self.assertLogs('', level='INFO'):
+                with self.assertRaises(FailedStationException):
+                    self.etl.pipeline_transform_station('A')
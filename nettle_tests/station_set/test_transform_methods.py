@@ -1,12 +1,15 @@
 import os
 import logging
+import tempfile
 import time
+from contextlib import ExitStack
 from unittest import TestCase
 from unittest.mock import patch
 from nettle.io.store import Local
 from nettle.metadata.bases import BASE_OUTPUT_METADATA
 from nettle.metadata.bases import BASE_OUTPUT_STATION_METADATA
 import pandas as pd
+import pyarrow as pa
 from nettle_tests.fixtures.bom_test import BOMTest
 from nettle_tests.fixtures.metadatas import kalumburu_metadata
 from nettle_tests.fixtures.metadatas import bom_metadata
@@ -14,6 +17,7 @@ from nettle.errors.custom_errors import FailedStationException
 from nettle.errors.custom_errors import DataframeInvalidException
 from nettle.errors.custom_errors import MetadataInvalidException
 from nettle.station_set import StationSet
+from nettle.io.file_handler import FileHandler
 import nettle_tests
 
 nettle_tests_dir = os.path.dirname(nettle_tests.__file__)
@@ -51,6 +55,24 @@ class TransformMethodsTestCase(TestCase):
     def test_single_station_transform(self):
         pass
 
+    def test_single_station_transform_times_each_stage_once(self):
+        dataframe = pd.DataFrame(data={'dt': ['2023-01-01'], 'TMIN': ['1']})
+        patched = ['read_raw_station_data', 'get_old_or_default_station_geo_metadata', 'transform_raw_metadata',
+                   'validate_processed_dataframe', 'save_processed_dataframe', 'programmatic_station_metadata_update',
+                   'validate_station_metadata', 'save_processed_station_metadata']
+        with ExitStack() as stack:
+            for name in patched:
+                stack.enter_context(patch.object(self.etl, name))
+            stack.enter_context(patch.object(self.etl, 'transform_raw_data', return_value=({}, dataframe)))
+            stack.enter_context(patch.object(
+                self.etl, 'combine_processed_dataframe_with_remote_old_dataframe', return_value=dataframe))
+            self.etl.single_station_transform('KALUMBURU')
+        timings = self.etl.stage_timer.drain()
+        self.assertEqual(sorted(timings), [
+            'combine', 'fetch_old_metadata', 'metadata_update', 'read_raw', 'transform_raw_data', 'validate',
+            'validate_metadata', 'write', 'write_metadata'])
+        self.assertTrue(all(len(durations) == 1 for durations in timings.values()))
+
     def test_check_station_parse_loop(self):
         with self.assertLogs('', level='ERROR') as cm:
             with self.etl.check_station_parse_loop('STATION_IDENTIFIER'):
@@ -135,6 +157,27 @@ class TransformMethodsTestCase(TestCase):
         df = pd.DataFrame(data=d)
         self.assertIsNone(self.etl.validate_processed_dataframe(df))
 
+    def test_validate_processed_dataframe_arrow_strings(self):
+        df = pd.DataFrame(data={
+            'dt': pd.Series(['2023-08-01', '2023-08-02'], dtype='string[pyarrow]'),
+            'TMIN': pd.Series(['1', '2'], dtype=pd.ArrowDtype(pa.string())),
+            'TMAX': pd.Series(['3', '3'], dtype=pd.ArrowDtype(pa.dictionary(pa.int32(), pa.string()))),
+            'RAIN': pd.Series(['0', '0']).astype('category')
+        })
+        self.assertIsNone(self.etl.validate_processed_dataframe(df))
+        df['RAIN'] = pd.Series([0, 0]).astype('category')
+        with self.assertRaises(DataframeInvalidException):
+            with self.assertLogs('', level='ERROR'):
+                self.etl.validate_processed_dataframe(df)
+
+    def test_combine_dataframes_keeps_arrow_strings(self):
+        old_df = pd.DataFrame(data={'dt': ['2023-08-01', '2023-08-02'], 'TMIN': ['1', '2']}, dtype='string[pyarrow]')
+        processed_dataframe = pd.DataFrame(data={'dt': ['2023-08-02', '2023-08-03'], 'TMIN': ['20', '3']},
+                                           dtype='string[pyarrow]')
+        combined = StationSet.combine_dataframes(old_df, processed_dataframe)
+        self.assertEqual(list(combined['TMIN']), ['1', '20', '3'])
+        self.assertTrue(all(dtype == 'string[pyarrow]' for dtype in combined.dtypes))
+
     # ToDo: Check this later
     # def test_programmatic_station_metadata_update(self):
     #     pass
@@ -173,9 +216,142 @@ class TransformMethodsTestCase(TestCase):
                 self.assertEqual(result, ['8/1/2023', '8/8/2023'])
                 pd.testing.assert_frame_equal(combined_dataframe, df)
 
-    # ToDo: Check this later
-    # def test_combine_processed_dataframe_with_remote_old_dataframe(self):
-    #     pass
+    def test_combine_processed_dataframe_with_remote_old_dataframe(self):
+        old_df = pd.DataFrame(data={'dt': ['2023-08-01', '2023-08-02'], 'TMIN': ['1', '2']})
+        processed_dataframe = pd.DataFrame(data={'dt': ['2023-08-03'], 'TMIN': ['3']})
+        with patch.object(self.etl.store, 'read', return_value=old_df):
+            with self.assertLogs('', level='INFO'):
+                combined = self.etl.combine_processed_dataframe_with_remote_old_dataframe(processed_dataframe, 'KALUMBURU')
+        self.assertEqual(list(combined['dt']), ['2023-08-01', '2023-08-02', '2023-08-03'])
+        self.assertNotIn('order', processed_dataframe.columns)
+
+    def test_save_processed_data_appends_to_remote(self):
+        self.etl.append_remote_history = True
+        with tempfile.TemporaryDirectory() as folder:
+            self.etl.store.base_folder = folder
+            remote_filepath = os.path.join(folder, self.etl.file_handler.relative_path, 'KALUMBURU.csv')
+            os.makedirs(os.path.dirname(remote_filepath))
+            old_df = pd.DataFrame(data={'dt': ['2023-08-01', '2023-08-02'], 'TMIN': ['1', '2'], 'TMAX': ['3', '4']})
+            old_df.to_csv(remote_filepath, index=False)
+            processed_dataframe = pd.DataFrame(data={'dt': ['2023-08-03'], 'TMIN': ['5']})
+            with patch.object(self.etl.store, 'read') as read:
+                with self.assertLogs('', level='INFO'):
+                    date_range, combined = self.etl.save_processed_data(processed_dataframe, 'KALUMBURU')
+            read.assert_not_called()
+            self.assertEqual(date_range, ['2023-08-01', '2023-08-03'])
+            self.assertEqual(list(combined.columns), ['dt', 'TMIN', 'TMAX'])
+            remote_df = pd.read_csv(remote_filepath, dtype=str)
+            self.assertEqual(list(remote_df['dt']), ['2023-08-01', '2023-08-02', '2023-08-03'])
+            self.assertTrue(pd.isna(remote_df['TMAX'].iloc[-1]))
+
+    def test_save_processed_data_falls_back_on_overlap(self):
+        self.etl.append_remote_history = True
+        old_df = pd.DataFrame(data={'dt': ['2023-08-01', '2023-08-02'], 'TMIN': ['1', '2']})
+        processed_dataframe = pd.DataFrame(data={'dt': ['2023-08-02'], 'TMIN': ['5']})
+        with patch.object(self.etl.store, 'read_csv_edges', return_value=(old_df.iloc[:1], old_df)):
+            with patch.object(self.etl, 'combine_processed_dataframe_with_remote_old_dataframe',
+                              return_value=processed_dataframe) as combine:
+                with patch.object(self.etl, 'save_processed_dataframe'):
+                    self.etl.save_processed_data(processed_dataframe, 'KALUMBURU')
+        combine.assert_called_once()
+
+    def test_processed_file_compression(self):
+        self.etl.processed_file_compression = 'gzip'
+        self.assertEqual(self.etl.station_file_name('kalumburu'), 'KALUMBURU.csv.gz')
+        self.assertEqual(self.etl.processed_file_codec(), 'gzip')
+        processed_dataframe = pd.DataFrame(data={'dt': ['2023-08-03'], 'TMIN': ['3']})
+        # compressed files can't be appended to, so no ranged read of the remote file is attempted
+        with patch.object(self.etl.store, 'read_csv_edges') as read_csv_edges:
+            self.assertIsNone(self.etl.stage_append_to_remote(processed_dataframe, 'KALUMBURU'))
+        read_csv_edges.assert_not_called()
+        with self.assertLogs('', level='INFO'):
+            self.etl.save_processed_dataframe(processed_dataframe, 'KALUMBURU')
+        filepath = os.path.join(self.etl.file_handler.PROCESSED_DATA_PATH, 'KALUMBURU.csv.gz')
+        try:
+            pd.testing.assert_frame_equal(pd.read_csv(filepath, compression='gzip', dtype=str), processed_dataframe)
+        finally:
+            os.remove(filepath)
+        self.etl.processed_file_compression = None
+        self.assertIsNone(self.etl.processed_file_codec())
+        self.etl.processed_file_format = 'parquet'
+        self.assertEqual(self.etl.processed_file_codec(), 'zstd')
+
+    def test_processed_file_compression_rejects_parquet(self):
+        with self.assertRaises(ValueError):
+            BOMTest(log=self.log, store=Local(), custom_dict_path=f"{nettle_tests_dir}/fixtures/",
+                    processed_file_format='parquet', processed_file_compression='gzip')
+
+    def test_compressed_history_falls_back_to_uncompressed_file(self):
+        self.etl.processed_file_compression = 'gzip'
+        old_dataframe = pd.DataFrame(data={'dt': ['2023-08-02'], 'TMIN': ['2']})
+        processed_dataframe = pd.DataFrame(data={'dt': ['2023-08-03'], 'TMIN': ['3']})
+        # only the uncompressed file exists remotely
+        read_history = lambda path: None if path.endswith('.gz') else old_dataframe
+        with patch.object(self.etl.store, 'read', side_effect=read_history) as read, self.assertLogs('', level='INFO'):
+            combined = self.etl.combine_processed_dataframe_with_remote_old_dataframe(processed_dataframe, 'KALUMBURU')
+        self.assertEqual([call.args[0].split('/')[-1] for call in read.call_args_list],
+                         ['KALUMBURU.csv.gz', 'KALUMBURU.csv'])
+        self.assertEqual(list(combined['dt']), ['2023-08-02', '2023-08-03'])
+
+    def test_processed_file_format_parquet(self):
+        self.etl.processed_file_format = 'parquet'
+        self.assertEqual(self.etl.station_file_name('kalumburu aws'), 'KALUMBURU_AWS.parquet')
+        self.assertEqual(self.etl.processed_station_file_names('KALUMBURU'), ['KALUMBURU.parquet', 'KALUMBURU.geojson'])
+        df = pd.DataFrame(data={'dt': pd.to_datetime(['2023-08-01', '2023-08-02']), 'TMIN': [1.0, 2.0]})
+        with self.assertLogs('', level='INFO'):
+            self.etl.save_processed_dataframe(df, 'KALUMBURU')
+        filepath = os.path.join(self.etl.file_handler.PROCESSED_DATA_PATH, 'KALUMBURU.parquet')
+        try:
+            pd.testing.assert_frame_equal(pd.read_parquet(filepath), df, check_dtype=False)
+        finally:
+            os.remove(filepath)
+
+    def test_write_transform_metrics(self):
+        with tempfile.TemporaryDirectory() as folder:
+            self.etl.file_handler.METRICS_OUTPUT_PATH = folder
+            with self.assertLogs('', level='INFO') as cm:
+                self.etl.write_transform_metrics({'combine': [0.5, 1.5], 'write': [0.25]})
+            self.assertEqual(sorted(os.listdir(folder)), ['transform.json', 'transform.prom'])
+        self.assertTrue(any('stage=combine count=2 total=2.00' in line for line in cm.output))
+
+    def test_write_transform_metrics_without_timings(self):
+        with patch('nettle.station_set.write_metrics_report') as write_metrics_report:
+            self.etl.write_transform_metrics({})
+        write_metrics_report.assert_not_called()
+
+    def test_combine_dataframes_without_old_data(self):
+        processed_dataframe = pd.DataFrame(data={'TMIN': ['2', '1', '9'], 'dt': ['2023-08-02', '2023-08-01', '2023-08-02']})
+        combined = StationSet.combine_dataframes(pd.DataFrame(), processed_dataframe)
+        pd.testing.assert_frame_equal(
+            combined, pd.DataFrame(data={'dt': ['2023-08-01', '2023-08-02'], 'TMIN': ['1', '2']}))
+
+    def test_combine_dataframes_overlap_keeps_processed_rows(self):
+        old_df = pd.DataFrame(data={'dt': ['2023-08-01', '2023-08-02', '2023-08-03'], 'TMIN': ['1', '2', '3']})
+        processed_dataframe = pd.DataFrame(data={'dt': ['2023-08-02', '2023-08-04'], 'TMIN': ['20', '4'], 'TMAX': ['5', '6']})
+        combined = StationSet.combine_dataframes(old_df, processed_dataframe)
+        self.assertEqual(list(combined['dt']), ['2023-08-01', '2023-08-02', '2023-08-03', '2023-08-04'])
+        self.assertEqual(list(combined['TMIN']), ['1', '20', '3', '4'])
+        self.assertEqual(list(combined.columns), ['dt', 'TMIN', 'TMAX'])
+
+    def test_combine_dataframes_matches_full_merge(self):
+        def full_merge(old_df, processed_dataframe):
+            # the previous concat + groupby + merge + sort implementation
+            processed_dataframe = processed_dataframe.assign(order=1)
+            df = pd.concat([old_df.assign(order=0), processed_dataframe])
+            joiner_df = df[['dt', 'order']].groupby('dt', as_index=False).max('order')
+            final_df = pd.merge(joiner_df, df, how='left', on=['dt', 'order'])
+            final_df.sort_values(by='dt', ascending=True, inplace=True, ignore_index=True)
+            final_df = final_df.drop(columns=['order'])
+            return final_df.drop_duplicates(subset='dt', ignore_index=True)
+
+        dates = [f"2023-{month:02}-{day:02}" for month in range(1, 13) for day in range(1, 29)]
+        old_df = pd.DataFrame(data={'dt': dates[:200], 'TMIN': [str(i) for i in range(200)]})
+        for processed_dates in [dates[200:], dates[150:250], dates[10:20][::-1] + dates[300:305]]:
+            processed_dataframe = pd.DataFrame(data={'dt': processed_dates, 'TMIN': ['new'] * len(processed_dates)})
+            pd.testing.assert_frame_equal(
+                StationSet.combine_dataframes(old_df, processed_dataframe),
+                full_merge(old_df, processed_dataframe)
+            )
 
     def test_save_processed_dataframe(self):
         d = {'col1': [1, 2], 'col2': [3, 4]}
@@ -251,3 +427,43 @@ class TransformMethodsTestCase(TestCase):
     # ToDo: Check this later
     # def test_generate_combined_station_metadata(self):
     #     pass
+
+    def test_filter_unchanged_stations(self):
+        self.etl.file_handler.RAW_DATA_PATH = f"{nettle_tests_dir}/fixtures/"
+        feature = kalumburu_metadata['features'][0]
+        with patch('nettle.utils.transform_manifest.TransformManifest') as MockClass:
+            self.etl.transform_manifest = MockClass.return_value
+            self.etl.transform_manifest.is_unchanged.side_effect = lambda station_id, raw_path: station_id == 'KALUMBURU'
+            self.etl.transform_manifest.feature.return_value = feature
+
+        with self.assertLogs('', level='INFO'):
+            self.assertEqual(self.etl.filter_unchanged_stations(['KALUMBURU', 'TRUSCOTT']), ['TRUSCOTT'])
+        self.assertEqual(self.etl.station_features, {'KALUMBURU': feature})
+
+    def test_generate_combined_station_metadata_reuses_skipped_features(self):
+        feature = kalumburu_metadata['features'][0]
+        self.etl.station_features = {'KALUMBURU': feature}
+        with patch.object(self.etl, 'get_old_or_default_dataset_geojson', return_value={'features': []}):
+            stations_geojson = self.etl.generate_combined_station_metadata()
+        self.assertIn(feature, stations_geojson['features'])
+
+    def test_generate_combined_station_metadata_merges_registry(self):
+        def feature(file_name, source):
+            return {'type': 'Feature', 'properties': {'file name': file_name, 'source': source}}
+
+        old_geojson = {'features': [feature('', 'template'), feature('A.csv', 'old'), feature('B.csv', 'old')]}
+        self.etl.station_features = {'B': feature('B.csv', 'registry'), 'C': feature('C.csv', 'registry')}
+        with patch.object(self.etl, 'get_old_or_default_dataset_geojson', return_value=old_geojson), \
+                patch('os.listdir', return_value=['B.geojson', 'D.geojson', 'B.csv', 'stations.geojson']), \
+                patch.object(FileHandler, 'load_dict') as load_dict:
+            load_dict.side_effect = lambda path: None if path.endswith('A.geojson') else \
+                {'features': [feature('D.csv', 'disk')]}
+            stations_geojson = self.etl.generate_combined_station_metadata()
+
+        self.assertEqual(
+            [(f['properties']['file name'], f['properties']['source']) for f in stations_geojson['features']],
+            [('A.csv', 'old'), ('B.csv', 'registry'), ('C.csv', 'registry'), ('D.csv', 'disk')]
+        )
+        # registered stations are never read back from disk
+        self.assertEqual([call.args[0][-9:] for call in load_dict.call_args_list], ['A.geojson', 'D.geojson'])
+
@@ -107,4 +107,22 @@ class MetadataHandlerTestCase(TestCase):
         self.assertEqual(
             metadata_handler.get_old_station_geo_metadata("KALUMBURU.geojson"),
             kalumburu_metadata
-        )
\ No newline at end of file
+        )
+
+    def test_prefetch_old_station_geo_metadata(self):
+        with patch('nettle.io.store.Local') as MockClass:
+            store = MockClass.return_value
+            store.read_many.return_value = {'bom/daily/KALUMBURU.geojson': kalumburu_metadata}
+        self.file_handler.relative_path = 'bom/daily'
+
+        metadata_handler = MetadataHandler(self.file_handler, "somewhere", "BOM", store, store, self.log)
+        metadata_handler.prefetch_old_station_geo_metadata(['KALUMBURU', 'TRUSCOTT'])
+        store.read_many.assert_called_once_with(['bom/daily/KALUMBURU.geojson', 'bom/daily/TRUSCOTT.geojson'])
+
+        self.assertEqual(metadata_handler.get_old_station_geo_metadata('KALUMBURU'), kalumburu_metadata)
+        # a station known to have no old metadata is not requested again
+        self.assertIsNone(metadata_handler.get_old_station_geo_metadata('TRUSCOTT'))
+        store.read.assert_not_called()
+        # prefetched metadata is only served once
+        metadata_handler.get_old_station_geo_metadata('KALUMBURU')
+        store.read.assert_called_once()
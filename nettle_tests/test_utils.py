@@ -1,10 +1,29 @@
+import os
+import json
+import tempfile
 from unittest import TestCase
+from unittest.mock import patch
 from datetime import datetime
 import pandas as pd
 import logging
 from nettle.utils.date_range_handler import DateRangeHandler
 from nettle.utils.log_info import LogInfo
+from nettle.utils.transform_pool import TransformPool
+from nettle.utils.transform_pool import transform_station
+from nettle.utils import transform_pool
+from nettle.utils.pipeline import PipelineStage
+from nettle.utils.pipeline import StationPipeline
+from nettle.utils.transform_manifest import TransformManifest
+from nettle.utils.metrics import StageTimer
+from nettle.utils.metrics import summarize_timings
+from nettle.utils.metrics import prometheus_textfile
+from nettle.utils.metrics import write_metrics_report
+from nettle.io.store import Local
+from nettle_tests.fixtures.bom_test import BOMTest
 from nettle_tests.fixtures.metadatas import kalumburu_metadata
+import nettle_tests
+
+nettle_tests_dir = os.path.dirname(nettle_tests.__file__)
 
 
 class DateRangeHandlerTestCase(TestCase):
@@ -89,4 +108,225 @@ class LogInfoTestCase(TestCase):
             [
                 'WARNING:root:[etl] [save_processed_data] could not find old dataframe KALUMBURU.csv on s3://arbol-somewhere/folder'
             ]
-        )
\ No newline at end of file
+        )
+
+class RegionalBOMTest(BOMTest):
+    # an extra required constructor argument that worker_init_kwargs does not know about
+    def __init__(self, region, **kwargs):
+        self.region = region
+        super().__init__(**kwargs)
+
+    @classmethod
+    def name(cls):
+        return 'bomtest'
+
+
+class TransformPoolTestCase(TestCase):
+    def setUp(self):
+        self.etl = BOMTest(
+            log=logging.getLogger('').log,
+            store=Local(),
+            custom_dict_path=f"{nettle_tests_dir}/fixtures/",
+            transform_workers=2,
+            transform_chunk_size=2
+        )
+
+    def test_chunk(self):
+        self.assertEqual(
+            TransformPool.chunk(['A', 'B', 'C', 'D', 'E'], 2),
+            [['A', 'B'], ['C', 'D'], ['E']]
+        )
+
+    def test_transform_station_success(self):
+        with patch.object(self.etl, 'single_station_transform') as single_station_transform:
+            result = transform_station(self.etl, 'KALUMBURU')
+        single_station_transform.assert_called_once_with('KALUMBURU')
+        self.assertTrue(result.succeeded)
+
+    def test_transform_station_returns_stage_timings(self):
+        def single_station_transform(station_id):
+            with self.etl.stage_timer.stage('read_raw'):
+                pass
+
+        with patch.object(self.etl, 'single_station_transform', side_effect=single_station_transform):
+            result = transform_station(self.etl, 'KALUMBURU')
+        self.assertEqual(list(result.timings), ['read_raw'])
+        self.assertEqual(self.etl.stage_timer.timings, {})
+
+    def test_chunk_prefetch_is_timed_apart_from_stations(self):
+        def prefetch_station_metadata(station_ids):
+            with self.etl.stage_timer.stage('prefetch_old_metadata'):
+                pass
+
+        def single_station_transform(station_id):
+            with self.etl.stage_timer.stage('read_raw'):
+                pass
+
+        with patch.object(transform_pool, '_worker_station_set', self.etl), \
+                patch.object(self.etl, 'prefetch_station_metadata', side_effect=prefetch_station_metadata), \
+                patch.object(self.etl, 'single_station_transform', side_effect=single_station_transform):
+            results, chunk_timings = transform_pool.transform_station_chunk((['A', 'B'], {}))
+        self.assertEqual([list(result.timings) for result in results], [['read_raw'], ['read_raw']])
+        self.assertEqual(list(chunk_timings), ['prefetch_old_metadata'])
+
+    def test_transform_station_returns_feature(self):
+        feature = kalumburu_metadata['features'][0]
+        with patch.object(self.etl, 'single_station_transform') as single_station_transform:
+            single_station_transform.side_effect = \
+                lambda station_id: self.etl.station_features.update({'KALUMBURU': feature})
+            result = transform_station(self.etl, 'kalumburu')
+        self.assertEqual(result.feature, feature)
+        self.assertEqual(self.etl.station_features, {})
+        self.etl.register_station_features([result])
+        self.assertEqual(self.etl.station_features, {'KALUMBURU': feature})
+
+    def test_transform_station_records_failure(self):
+        with patch.object(self.etl, 'single_station_transform') as single_station_transform:
+            single_station_transform.side_effect = ValueError('bad row')
+            with self.assertLogs('', level='ERROR'):
+                result = transform_station(self.etl, 'KALUMBURU')
+        self.assertFalse(result.succeeded)
+        self.assertEqual(result.error, 'ValueError: bad row')
+
+    def test_sequential_transform_raises_unexpected_errors(self):
+        self.etl.multithread_transform = False
+        with patch.object(self.etl, 'get_stations_to_transform', return_value=['KALUMBURU']), \
+                patch.object(self.etl, 'single_station_transform', side_effect=ValueError('bad row')), \
+                patch.object(self.etl, 'save_combined_metadata_files') as save_combined_metadata_files:
+            with self.assertRaises(ValueError):
+                self.etl.transform()
+        save_combined_metadata_files.assert_not_called()
+
+    def test_worker_init_kwargs(self):
+        init_kwargs = self.etl.worker_init_kwargs()
+        self.assertEqual(init_kwargs['transform_workers'], 2)
+        self.assertEqual(init_kwargs['custom_dict_path'], f"{nettle_tests_dir}/fixtures/")
+
+    def test_run_returns_a_result_per_station(self):
+        # these stations have no raw files so every worker reports a failure back to the parent
+        pool = TransformPool(self.etl, workers=2, chunk_size=2)
+        results = pool.run(['MISSING_1', 'MISSING_2', 'MISSING_3'])
+        self.assertEqual(sorted(result.station_id for result in results), ['MISSING_1', 'MISSING_2', 'MISSING_3'])
+        self.assertTrue(all(not result.succeeded for result in results))
+
+    def test_run_reports_worker_init_failure(self):
+        etl = RegionalBOMTest(
+            'north',
+            log=logging.getLogger('').log,
+            store=Local(),
+            custom_dict_path=f"{nettle_tests_dir}/fixtures/"
+        )
+        results = TransformPool(etl, workers=2, chunk_size=1).run(['A', 'B'])
+        self.assertEqual(sorted(result.station_id for result in results), ['A', 'B'])
+        self.assertTrue(all('could not build RegionalBOMTest in worker' in result.error for result in results))
+
+
+class StationPipelineTestCase(TestCase):
+    def test_run_passes_stations_through_every_stage(self):
+        seen = {'first': [], 'second': []}
+        stages = [
+            PipelineStage('first', seen['first'].append, workers=3),
+            PipelineStage('second', seen['second'].append, workers=2),
+        ]
+        results = StationPipeline(stages, queue_size=2).run([f'STATION_{i}' for i in range(20)])
+
+        self.assertEqual(len(results), 20)
+        self.assertTrue(all(result.succeeded for result in results))
+        self.assertEqual(sorted(seen['first']), sorted(seen['second']))
+
+    def test_failed_station_does_not_reach_next_stage(self):
+        def fail_on_b(station_id):
+            if station_id == 'B':
+                raise ValueError('no data')
+
+        reached = []
+        stages = [PipelineStage('extract', fail_on_b), PipelineStage('upload', reached.append)]
+        results = StationPipeline(stages).run(['A', 'B', 'C'])
+
+        self.assertEqual(sorted(reached), ['A', 'C'])
+        failed = [result for result in results if not result.succeeded]
+        self.assertEqual([result.station_id for result in failed], ['B'])
+        self.assertEqual(failed[0].error, '[extract] ValueError: no data')
+
+    def test_run_with_more_stations_than_queue_capacity(self):
+        stages = [PipelineStage(name, lambda station_id: None, workers=2) for name in ['extract', 'transform', 'upload']]
+        results = StationPipeline(stages, queue_size=4).run([f'STATION_{i}' for i in range(1000)])
+        self.assertEqual(len(results), 1000)
+
+
+class TransformManifestTestCase(TestCase):
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.raw_path = os.path.join(self.folder.name, 'KALUMBURU.csv')
+        with open(self.raw_path, 'w') as f:
+            f.write('dt,TMIN\n2023-08-26,1\n')
+        self.feature = {'type': 'Feature', 'properties': {'file name': 'KALUMBURU.csv'}}
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def test_unknown_station_is_changed(self):
+        manifest = TransformManifest(self.folder.name, 'fingerprint')
+        self.assertFalse(manifest.is_unchanged('KALUMBURU', self.raw_path))
+
+    def test_recorded_station_is_unchanged_after_reload(self):
+        manifest = TransformManifest(self.folder.name, 'fingerprint')
+        manifest.record('KALUMBURU', TransformManifest.entry(self.raw_path, ['KALUMBURU.csv'], self.feature))
+        manifest.save()
+
+        reloaded = TransformManifest(self.folder.name, 'fingerprint')
+        self.assertTrue(reloaded.is_unchanged('KALUMBURU', self.raw_path))
+        self.assertEqual(reloaded.feature('KALUMBURU'), self.feature)
+
+    def test_modified_raw_file_is_changed(self):
+        manifest = TransformManifest(self.folder.name, 'fingerprint')
+        manifest.record('KALUMBURU', TransformManifest.entry(self.raw_path, ['KALUMBURU.csv'], self.feature))
+        with open(self.raw_path, 'w') as f:
+            f.write('dt,TMIN\n2023-08-26,2\n')
+        self.assertFalse(manifest.is_unchanged('KALUMBURU', self.raw_path))
+
+    def test_new_fingerprint_discards_manifest(self):
+        manifest = TransformManifest(self.folder.name, 'fingerprint')
+        manifest.record('KALUMBURU', TransformManifest.entry(self.raw_path, ['KALUMBURU.csv'], self.feature))
+        manifest.save()
+        self.assertEqual(TransformManifest(self.folder.name, 'new data dictionary').stations, {})
+
+
+class StageTimerTestCase(TestCase):
+    def test_stage_records_durations(self):
+        timer = StageTimer()
+        with timer.stage('read_raw'):
+            pass
+        with self.assertRaises(ValueError):
+            with timer.stage('read_raw'):
+                raise ValueError()
+        timer.extend({'read_raw': [1.0], 'write': [2.0]})
+        timings = timer.drain()
+        self.assertEqual(len(timings['read_raw']), 3)
+        self.assertEqual(timings['write'], [2.0])
+        self.assertEqual(timer.drain(), {})
+
+    def test_summarize_timings(self):
+        summary = summarize_timings({'combine': [float(i) for i in range(1, 101)], 'empty': []})
+        self.assertEqual(list(summary), ['combine'])
+        self.assertEqual(summary['combine']['count'], 100)
+        self.assertEqual(summary['combine']['total'], 5050.0)
+        self.assertEqual(summary['combine']['max'], 100.0)
+        self.assertAlmostEqual(summary['combine']['p50'], 50.5)
+        self.assertAlmostEqual(summary['combine']['p99'], 99.01)
+
+    def test_prometheus_textfile(self):
+        summary = summarize_timings({'write': [1.0, 3.0]})
+        text = prometheus_textfile(summary, {'set': 'bomtest'})
+        self.assertIn('# TYPE nettle_transform_stage_seconds summary', text)
+        self.assertIn('nettle_transform_stage_seconds{set="bomtest",stage="write",quantile="0.5"} 2.0', text)
+        self.assertIn('nettle_transform_stage_seconds_sum{set="bomtest",stage="write"} 4.0', text)
+        self.assertIn('nettle_transform_stage_seconds_count{set="bomtest",stage="write"} 2', text)
+
+    def test_write_metrics_report(self):
+        with tempfile.TemporaryDirectory() as folder:
+            json_path, prom_path = write_metrics_report(
+                summarize_timings({'write': [1.0]}), os.path.join(folder, 'bom'), 'transform')
+            self.assertEqual(sorted(os.listdir(os.path.join(folder, 'bom'))), ['transform.json', 'transform.prom'])
+            with open(json_path) as f:
+                self.assertEqual(json.load(f)['write']['count'], 1)